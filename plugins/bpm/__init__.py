@@ -33,6 +33,7 @@ from gi.repository import Gtk
 from gi.repository import GObject
  
 from xl import (
+    common,
     event, 
     providers,
     settings
@@ -46,6 +47,8 @@ from xlgui.widgets import menu, dialogs
 import bpmdetect
 autodetect_enabled = bpmdetect.autodetect_supported()
 
+from batch import BatchBPMDetector
+
 menu_providers = [
     'track-panel-menu',
     'playlist-context-menu',
@@ -58,9 +61,13 @@ class BPMCounterPlugin(object):
     # Provider API requirement
     name = 'BPM'
     menuitem = None
+    batch_menuitem = None
+    tools_menuitems = []
+    batch = None
+    batch_thread = None
     
     def enable(self, exaile):
-        pass
+        self.exaile = exaile
     
     def on_gui_loaded(self):
         providers.register('mainwindow-info-area-widget', self)
@@ -69,9 +76,26 @@ class BPMCounterPlugin(object):
             self.menuitem = menu.simple_menu_item('_bpm', ['enqueue'],
                 _('Autodetect BPM'), callback=self.on_auto_menuitem,
                 condition_fn=lambda n, p, c: not c['selection-empty'])
+            self.batch_menuitem = menu.simple_menu_item('_bpm_batch', ['_bpm'],
+                _('Autodetect BPM in Background'), callback=self.on_batch_menuitem,
+                condition_fn=lambda n, p, c: not c['selection-empty'])
             
             for p in menu_providers:
                 providers.register(p, self.menuitem)
+                providers.register(p, self.batch_menuitem)
+            
+            self.tools_menuitems = [
+                menu.simple_separator('plugin-sep', ['track-properties']),
+                menu.simple_menu_item('bpm-batch', ['plugin-sep'],
+                    _('Autodetect BPM for Collection'),
+                    callback=self.on_batch_collection_menuitem),
+            ]
+            for item in self.tools_menuitems:
+                providers.register('menubar-tools-menu', item)
+            
+            # resume the tracks left over from last time
+            self.batch = BatchBPMDetector()
+            self.start_batch()
     
     def disable(self, exaile):
         """
@@ -82,6 +106,14 @@ class BPMCounterPlugin(object):
         if self.menuitem is not None:
             for p in menu_providers:
                 providers.unregister(p, self.menuitem)
+                providers.unregister(p, self.batch_menuitem)
+            for item in self.tools_menuitems:
+                providers.unregister('menubar-tools-menu', item)
+        
+        # the queue is saved, it is resumed the next time
+        self.batch = None
+        if self.batch_thread is not None:
+            self.batch_thread.stop()
         
     def create_widget(self, info_area):
         """
@@ -94,6 +126,34 @@ class BPMCounterPlugin(object):
         if len(tracks) > 0:
             self.autodetect_bpm(tracks[0], playlist_view.get_toplevel())
             
+    def on_batch_menuitem(self, menu, display_name, playlist_view, context):
+        self.batch_detect(context['selected-tracks'])
+    
+    def on_batch_collection_menuitem(self, *args):
+        self.batch_detect(self.exaile.collection)
+    
+    def batch_detect(self, tracks):
+        '''Detects the BPM of tracks in the background'''
+        if self.batch.add(tracks):
+            self.start_batch()
+    
+    def start_batch(self):
+        if self.batch is None or self.batch_thread is not None \
+                or not self.batch.pending:
+            return
+        
+        jobs = settings.get_option('plugin/bpm/batch_jobs', 2)
+        self.batch_thread = common.SimpleProgressThread(self.batch.run, jobs)
+        self.batch_thread.connect('done', self.on_batch_done)
+        self.exaile.gui.main.controller.progress_manager.add_monitor(
+            self.batch_thread, _('Detecting BPM...'), Gtk.STOCK_EXECUTE)
+    
+    @idle_add()
+    def on_batch_done(self, thread):
+        self.batch_thread = None
+        # tracks may have been added after the thread finished
+        self.start_batch()
+    
     def autodetect_bpm(self, track, parent_window=None):
         
         def _on_complete(bpm, err):
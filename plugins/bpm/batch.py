@@ -0,0 +1,197 @@
+'''
+    Detects the BPM of many tracks in the background
+    
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 2 as
+    published by the Free Software Foundation.
+'''
+
+import collections
+import logging
+import os
+import pickle
+import Queue
+import threading
+
+from gi.repository import GLib
+
+from xl import (
+    common,
+    trax,
+    xdg
+)
+
+import bpmdetect
+
+logger = logging.getLogger(__name__)
+
+# Sample rate the audio is analyzed at. This is plenty for finding the
+# beats, and much faster to process than CD quality.
+ANALYSIS_RATE = 11025
+
+class BatchBPMDetector(object):
+    '''
+        Runs BPM detection over a list of tracks, with a few GStreamer
+        pipelines at a time, and writes the results to the tracks in
+        batches.
+
+        The tracks still to be analyzed are saved to disk after each
+        batch, so that a run interrupted by quitting is resumed the next
+        time.
+    '''
+
+    # Number of results written to the tracks at a time
+    write_batch = 20
+
+    def __init__(self, location=None):
+        if location is None:
+            location = os.path.join(xdg.get_data_dir(), 'bpm_batch.pickle')
+        self.location = location
+        self.lock = threading.Lock()
+        self.pending = []
+        self.queue = collections.deque()
+        self.pipelines = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.location, 'rb') as f:
+                self.pending = pickle.load(f)
+        except (IOError, EOFError):
+            pass
+        except Exception:
+            logger.exception('Could not load the BPM detection queue')
+        self.queue.extend(self.pending)
+
+    def save(self):
+        with self.lock:
+            pending = list(self.pending)
+        try:
+            if pending:
+                with open(self.location + '.new', 'wb') as f:
+                    pickle.dump(pending, f, common.PICKLE_PROTOCOL)
+                os.rename(self.location + '.new', self.location)
+            elif os.path.exists(self.location):
+                os.remove(self.location)
+        except (IOError, OSError):
+            logger.exception('Could not save the BPM detection queue')
+
+    def add(self, tracks):
+        '''
+            Queues the local tracks that don't have a BPM yet
+
+            :returns: the number of tracks queued
+        '''
+        locs = [tr.get_loc_for_io() for tr in tracks
+                if tr.is_local() and not tr.get_tag_raw('bpm')]
+        with self.lock:
+            known = set(self.pending)
+            new = []
+            for loc in locs:
+                if loc not in known:
+                    known.add(loc)
+                    new.append(loc)
+            self.pending.extend(new)
+            self.queue.extend(new)
+        locs = new
+        if locs:
+            self.save()
+        return len(locs)
+
+    def run(self, jobs=2):
+        '''
+            Analyzes the queued tracks, running at most jobs pipelines at
+            the same time. This is a generator for
+            :class:`xl.common.SimpleProgressThread`, yielding the progress.
+        '''
+        results = Queue.Queue()
+        finished = 0
+        written = []
+
+        try:
+            while True:
+                started = []
+                with self.lock:
+                    while len(self.pipelines) < jobs and self.queue:
+                        loc = self.queue.popleft()
+                        self.pipelines[loc] = None
+                        started.append(loc)
+                    if not self.pipelines:
+                        break
+                    total = finished + len(self.queue) + len(self.pipelines)
+                for loc in started:
+                    GLib.idle_add(self._start, loc, results)
+
+                yield (finished, total)
+
+                try:
+                    loc, bpm, error = results.get(timeout=1)
+                except Queue.Empty:
+                    continue
+
+                with self.lock:
+                    self.pipelines.pop(loc, None)
+                finished += 1
+
+                if error is not None:
+                    logger.warning('BPM detection failed for %s: %s', loc, error)
+                    written.append((loc, None))
+                else:
+                    written.append((loc, bpm))
+
+                if len(written) >= self.write_batch:
+                    self._write(written)
+                    written = []
+        finally:
+            GLib.idle_add(self._stop)
+            self._write(written)
+
+    def _start(self, loc, results):
+        '''Starts a pipeline, called on the main thread'''
+
+        def _on_complete(bpm, error):
+            with self.lock:
+                if loc not in self.pipelines:
+                    # cancelled
+                    return
+            results.put((loc, bpm, error))
+
+        with self.lock:
+            if loc not in self.pipelines:
+                return
+
+        playbin = bpmdetect.detect_bpm(loc, _on_complete, rate=ANALYSIS_RATE)
+
+        with self.lock:
+            if playbin is None:
+                # _on_complete already reported the error
+                return
+            if loc not in self.pipelines:
+                bpmdetect.cancel_detection(playbin)
+                return
+            self.pipelines[loc] = playbin
+
+    def _stop(self):
+        '''Stops the running pipelines and requeues their tracks'''
+        with self.lock:
+            for loc, playbin in self.pipelines.iteritems():
+                if playbin is not None:
+                    bpmdetect.cancel_detection(playbin)
+            self.queue.extendleft(reversed(self.pipelines.keys()))
+            self.pipelines.clear()
+
+    def _write(self, written):
+        '''Writes the detected BPMs to the tracks, and forgets about them'''
+        for loc, bpm in written:
+            if not bpm:
+                continue
+            track = trax.Track(loc)
+            track.set_tag_raw('bpm', int(round(bpm)))
+            if not track.write_tags():
+                logger.warning('Could not write the BPM of %s', loc)
+
+        if written:
+            done = set(loc for loc, bpm in written)
+            with self.lock:
+                self.pending = [loc for loc in self.pending if loc not in done]
+            self.save()
@@ -22,7 +22,7 @@ from gi.repository import Gst, GObject, Gio
 def autodetect_supported():
     return Gst.ElementFactory.make('bpmdetect', None) != None
 
-def detect_bpm(uri, on_complete):
+def detect_bpm(uri, on_complete, rate=None):
     '''
         Detects the BPM of a song using GStreamer's bpmdetect plugin
         
@@ -30,6 +30,11 @@ def detect_bpm(uri, on_complete):
                   song processing, but the bpm detector accumulates
                   the results so this will only return the last
                   result.
+        
+        :param rate: Sample rate the audio is resampled to before it is
+                     analyzed. Lower rates are faster to analyze.
+        :returns: The pipeline, which can be passed to
+                  :func:`cancel_detection`, or None on error
     '''
     
     bpm = [None]
@@ -54,7 +59,7 @@ def detect_bpm(uri, on_complete):
             
         elif msg.type == Gst.MessageType.ERROR:
             
-            playbin.set_state(Gst.State.NULL)
+            cancel_detection(playbin)
             
             gerror, debug_info = msg.parse_error()
             if gerror:
@@ -63,15 +68,21 @@ def detect_bpm(uri, on_complete):
                 on_complete(None, debug_info)
             
         elif msg.type == Gst.MessageType.EOS:
-            playbin.set_state(Gst.State.NULL)
+            cancel_detection(playbin)
             on_complete(bpm[0], None)
     
     audio_sink = Gst.Bin.new('audiosink')
     
     # bpmdetect doesn't work properly with more than one channel, 
     # see https://bugzilla.gnome.org/show_bug.cgi?id=751457
+    caps = 'audio/x-raw,channels=1'
+    if rate is not None:
+        caps += ',rate=%d' % rate
+    
+    convert = Gst.ElementFactory.make('audioconvert', None)
+    resample = Gst.ElementFactory.make('audioresample', None)
     cf = Gst.ElementFactory.make('capsfilter', None)
-    cf.props.caps = Gst.Caps.from_string('audio/x-raw,channels=1')
+    cf.props.caps = Gst.Caps.from_string(caps)
     
     fakesink = Gst.ElementFactory.make('fakesink', None)
     fakesink.props.sync = False
@@ -82,14 +93,18 @@ def detect_bpm(uri, on_complete):
         on_complete(None, "GStreamer BPM detection plugin not found")
         return
     
+    audio_sink.add(convert)
+    audio_sink.add(resample)
     audio_sink.add(cf)
     audio_sink.add(bpmdetect)
     audio_sink.add(fakesink)
     
+    convert.link(resample)
+    resample.link(cf)
     cf.link(bpmdetect)
     bpmdetect.link(fakesink)
     
-    audio_sink.add_pad(Gst.GhostPad.new('sink', cf.get_static_pad('sink')))
+    audio_sink.add_pad(Gst.GhostPad.new('sink', convert.get_static_pad('sink')))
     
     playbin = Gst.ElementFactory.make('playbin', None)
     playbin.props.audio_sink = audio_sink
@@ -101,6 +116,15 @@ def detect_bpm(uri, on_complete):
 
     playbin.props.uri = uri
     playbin.set_state(Gst.State.PLAYING)
+    return playbin
+
+def cancel_detection(playbin):
+    '''
+        Stops a pipeline returned by :func:`detect_bpm`; its on_complete
+        callback is not called anymore.
+    '''
+    playbin.set_state(Gst.State.NULL)
+    playbin.get_bus().remove_signal_watch()
 
 
 
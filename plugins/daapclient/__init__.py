@@ -16,6 +16,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
+import hashlib
 from gi.repository import Gtk
 import dbus
 import dbus.exceptions
@@ -416,7 +417,25 @@ class DaapManager:
 class DaapConnection(object):
     """
         A connection to a DAAP share.
+
+        The track list of the share is kept in a snapshot on disk, along
+        with the revision of the server it belongs to, so that only the
+        changes since then need to be requested when reconnecting. The
+        snapshot is only used for the same database of the same server,
+        and only if the revision of the server has not gone back since:
+        a server that was restarted may number its revisions and tracks
+        from the start again.
     """
+    # Converts DAAP atoms to Exaile tags.
+    eqiv = {'title':'minm','artist':'asar','album':'asal','tracknumber':'astn',}
+#            'genre':'asgn','enc':'asfm','bitrate':'asbr'}
+
+    # Atoms kept in the snapshot for each track
+    snapshot_atoms = ('minm', 'asar', 'asal', 'astn', 'asfm', 'astm')
+
+    # Number of tracks handed to the callback of reload at a time
+    batch_size = 500
+
     def __init__(self, name, server, port):
         # if it's an ipv6 address
         if ':' in server and server[0] != '[':
@@ -426,12 +445,20 @@ class DaapConnection(object):
         self.session = None
         self.connected = False
         self.tracks = None
+        self.database = None
         self.server = server
         self.port = port
         self.name = name
         self.auth = False
         self.password = None
 
+        self.location = os.path.join(xdg.get_cache_dir(), 'daapclient',
+            hashlib.md5('%s:%s' % (server, port)).hexdigest())
+        self.revision = None
+        self.snapshot_id = None
+        self.items = None
+        self.converted = {}
+
     def connect(self, password = None):
         """
             Connect, login, and retrieve the track list.
@@ -465,30 +492,130 @@ class DaapConnection(object):
         self.tracks = None
         self.database = None
         self.all = []
+        self.converted = {}
         self.connected = False
 
-    def reload(self):
+    def load_snapshot(self):
         """
-            Reload the tracks from the server
+            Loads the track list saved by the last reload
+        """
+        self.revision = None
+        self.snapshot_id = None
+        self.items = {}
+        try:
+            with open(self.location, 'rb') as f:
+                self.revision, self.snapshot_id, self.items = pickle.load(f)
+        except IOError:
+            pass
+        except Exception:
+            logger.warning('Ignoring damaged DAAP snapshot %s', self.location)
+            self.revision = None
+            self.snapshot_id = None
+            self.items = {}
+
+    def save_snapshot(self):
+        """
+            Saves the track list, to be reused by the next connection
+        """
+        try:
+            dirname = os.path.dirname(self.location)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with open(self.location + '.new', 'wb') as f:
+                pickle.dump((self.revision, self.snapshot_id, self.items), f,
+                    common.PICKLE_PROTOCOL)
+            os.rename(self.location + '.new', self.location)
+        except (IOError, OSError):
+            logger.exception('Could not save DAAP snapshot %s', self.location)
+
+    def reload(self, callback=None):
+        """
+            Reload the tracks from the server.
+
+            Only the tracks changed since the revision in the snapshot are
+            requested, and the listing is converted while it is received.
+            callback is called with each batch of converted tracks.
+
+            :returns: the tracks removed from the share
         """
         self.tracks = None
-        self.database = None
-        self.all = []
-        self.get_database()
+        if self.database is None:
+            self.database = self.session.library()
 
         t = time.time()
-        self.convert_list()
+        self.session.update()
+        revision = self.session.revision
+
+        if self.items is None:
+            self.load_snapshot()
+            snapshot_id = self.get_snapshot_id()
+            if self.items and (self.snapshot_id != snapshot_id
+                    or revision < self.revision):
+                logger.debug('Not using the DAAP snapshot of {0}, it is '
+                    'for revision {1} of {2}'.format(self.name,
+                    self.revision, self.snapshot_id))
+                self.revision = None
+                self.items = {}
+            self.snapshot_id = snapshot_id
+        batch = []
+
+        def add(id, tags):
+            batch.append(self.convert_track(id, tags))
+            if len(batch) >= self.batch_size:
+                if callback is not None:
+                    callback(batch[:])
+                del batch[:]
+
+        removed = []
+        if revision != self.revision or not self.items:
+            listing = self.database.track_listing(revision,
+                self.revision if self.items else None)
+            seen = set()
+            for atom in listing:
+                id = atom.getAtom('miid')
+                tags = dict((code, atom.getAtom(code))
+                    for code in self.snapshot_atoms)
+                seen.add(id)
+                self.items[id] = tags
+                add(id, tags)
+
+            if listing.response.getAtom('muty'):
+                deleted = listing.response.getAtom('mudl')
+                if deleted is not None:
+                    removed = [a.value for a in deleted.contains]
+            else:
+                removed = [id for id in self.items if id not in seen]
+            logger.debug('{0} tracks changed and {1} removed since revision '
+                '{2} of {3}'.format(len(seen), len(removed), self.revision,
+                self.name))
+
+        for id in removed:
+            self.items.pop(id, None)
+        removed = [tr for tr in (self.converted.pop(id, None)
+            for id in removed) if tr is not None]
+
+        # tracks from the snapshot
+        for id, tags in self.items.iteritems():
+            if id not in self.converted:
+                add(id, tags)
+        if batch and callback is not None:
+            callback(batch)
+
+        self.all = self.converted.values()
+        if revision != self.revision:
+            self.revision = revision
+            self.save_snapshot()
+
         logger.debug('{0} tracks loaded in {1}s'.format(len(self.all),
                                                         time.time()-t))
+        return removed
 
-
-    def get_database(self):
+    def get_snapshot_id(self):
         """
-            Get a DAAP database and its track list.
+            Identifies the database the track list is taken from
         """
-        if self.session:
-            self.database = self.session.library()
-            self.get_tracks(1)
+        return (self.session.connection.server_name,
+            self.database.persistentid, self.database.id)
 
     def get_tracks(self, reset = False):
         """
@@ -501,52 +628,40 @@ class DaapConnection(object):
 
         return self.tracks
 
-    def convert_list(self):
+    def convert_track(self, id, tags):
         """
-            Converts the DAAP track database into Exaile Tracks.
+            Converts the atoms of a DAAP track into an Exaile Track.
         """
-        # Convert DAAPTrack's attributes to Tracks.
-        eqiv = {'title':'minm','artist':'asar','album':'asal','tracknumber':'astn',}
-#            'genre':'asgn','enc':'asfm','bitrate':'asbr'}
-
-        for tr in self.tracks:
-            if tr is not None:
-                #http://<server>:<port>/databases/<dbid>/items/<id>.<type>?session-id=<sessionid>
-
-                uri = "http://%s:%s/databases/%s/items/%s.%s?session-id=%s" % \
-                    (self.server, self.port, self.database.id, tr.id,
-                    tr.type, self.session.sessionid)
+        #http://<server>:<port>/databases/<dbid>/items/<id>.<type>?session-id=<sessionid>
 
-                # Don't scan tracks because gio is slow!
-                temp = trax.Track(uri, scan=False)
+        uri = "http://%s:%s/databases/%s/items/%s.%s?session-id=%s" % \
+            (self.server, self.port, self.database.id, id,
+            tags['asfm'], self.session.sessionid)
 
-                for field in eqiv.keys():
-                    try:
-                        tag = u'%s'%tr.atom.getAtom(eqiv[field])
-                        if tag != 'None':
-                            temp.set_tag_raw(field, [tag], notify_changed=False)
+        # Don't scan tracks because gio is slow!
+        temp = trax.Track(uri, scan=False)
 
-                    except Exception:
-                        if field is 'tracknumber':
-                            temp.set_tag_raw('tracknumber', [0], notify_changed=False)
+        for field, code in self.eqiv.iteritems():
+            tag = tags.get(code)
+            if tag is not None:
+                temp.set_tag_raw(field, [u'%s' % tag], notify_changed=False)
+            elif field == 'tracknumber':
+                temp.set_tag_raw('tracknumber', [0], notify_changed=False)
 
+        #TODO: convert year (asyr) here as well, what's the formula?
+        length = tags.get('astm')
+        temp.set_tag_raw("__length", length / 1000 if length else 0,
+                         notify_changed=False)
 
-                #TODO: convert year (asyr) here as well, what's the formula?
-                try:
-                    temp.set_tag_raw("__length", tr.atom.getAtom('astm') / 1000,
-                                                         notify_changed=False)
-                except Exception:
-                    temp.set_tag_raw("__length", 0, notify_changed=False)
-
-                self.all.append(temp)
-
+        self.converted[id] = temp
+        return temp
 
     @common.threaded
     def get_track(self, track_id, filename):
         """
             Save the track with track_id to filename
         """
-        for t in self.tracks:
+        for t in self.get_tracks():
             if t.id == track_id:
                 try:
                     t.save(filename)
@@ -586,23 +701,20 @@ class DaapLibrary(collection.Library):
         self.scanning = True
         db = self.collection
 
-        # DAAP gives us all the tracks in one dump
-        self.daap_share.reload()
-        if self.daap_share.all:
-            count = len(self.daap_share.all)
-        else:
-            count = 0
+        # tracks are added as they are received
+        removed = self.daap_share.reload(self.collection.add_tracks)
+        count = len(self.daap_share.all)
 
-        if count > 0:
-            logger.info('Adding %d tracks from %s. (%f s)' % (count, 
-                                    self.daap_share.name, time.time()-t))
-            self.collection.add_tracks(self.daap_share.all)
+        if removed:
+            self.collection.remove_tracks(removed)
 
+        logger.info('Loaded %d tracks from %s, %d removed. (%f s)' % (count,
+                                self.daap_share.name, len(removed),
+                                time.time()-t))
 
         if notify_interval is not None:
             event.log_event('tracks_scanned', self, count)
 
-        # track removal?
         self.scanning = False
         #return True
 
@@ -9,7 +9,7 @@
 #
 # Stripped clean + a few bug fixes, Erik Hetzner
 
-import struct, sys, httplib
+import struct, sys, httplib, zlib
 import logging
 from daap_data import *
 from cStringIO import StringIO
@@ -259,10 +259,79 @@ class DAAPObject(object):
 do = DAAPObject
 
 
+def _parse(data):
+    object = DAAPObject()
+    object.processData(StringIO(data))
+    return object
+
+
+class _ResponseReader(object):
+    """Reads an HTTP response in pieces of a given size, gunzipping it on
+    the way if needed"""
+
+    def __init__(self, response, chunk_size = 64 * 1024):
+        self.response = response
+        self.chunk_size = chunk_size
+        if response.getheader("Content-Encoding") == "gzip":
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = None
+        self.buffer = ''
+        self.pos = 0
+
+    def read(self, size):
+        while len(self.buffer) - self.pos < size:
+            data = self.response.read(self.chunk_size)
+            if self.decompressor is not None:
+                data = self.decompressor.decompress(data) if data \
+                        else self.decompressor.flush()
+            if not data:
+                raise DAAPError('DAAPClient: response ended too early')
+            self.buffer = self.buffer[self.pos:] + data
+            self.pos = 0
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+
+class DAAPListing(object):
+    """A response holding a dmap.listing, read as it is received.
+
+    Iterating over it yields each listing item as a DAAPObject, as soon as
+    it has arrived. Once done, response holds the other atoms of the
+    response, like dmap.updatetype or dmap.deletedidlisting."""
+
+    def __init__(self, response):
+        self.http_response = response
+        self.response = None
+
+    def __iter__(self):
+        reader = _ResponseReader(self.http_response)
+        try:
+            code, length = struct.unpack('!4sI', reader.read(8))
+            self.response = top = DAAPObject(code, [])
+            while length > 0:
+                header = reader.read(8)
+                code, size = struct.unpack('!4sI', header)
+                length -= 8 + size
+                if code != 'mlcl':
+                    top.contains.append(_parse(header + reader.read(size)))
+                    continue
+                top.contains.append(DAAPObject(code, []))
+                while size > 0:
+                    item_header = reader.read(8)
+                    item_size = struct.unpack('!4sI', item_header)[1]
+                    size -= 8 + item_size
+                    yield _parse(item_header + reader.read(item_size))
+        finally:
+            self.http_response.close()
+
+
 class DAAPClient(object):
     def __init__(self):
         self.socket = None
         self.request_id = 0
+        self.server_name = None
 #        self._old_itunes = 0
 
     def connect(self, hostname, port = 3689, password = None):
@@ -358,6 +427,17 @@ class DAAPClient(object):
 
         return self.readResponse( content )
 
+    def request_listing(self, r, params = {}):
+        """Like request, for responses holding a dmap.listing. Returns a
+        DAAPListing, so that the items can be used while the rest of the
+        response is still being received."""
+        response = self._get_response(r, params)
+        if response.status != 200:
+            response.read()
+            response.close()
+            raise DAAPError('DAAPClient: %s: Error %s making request'%(r, response.status))
+        return DAAPListing(response)
+
     def readResponse(self, data):
         """Convert binary response from a request to a DAAPObject"""
         str = StringIO(data)
@@ -373,6 +453,7 @@ class DAAPClient(object):
 
     def getInfo(self):
         response = self.request('/server-info')
+        self.server_name = response.getAtom("minm")
 
         # detect the 'old' iTunes 4.2 servers, and set a flag, so we use
         # the real MD5 hash algo to verify requests.
@@ -405,6 +486,12 @@ class DAAPSession(object):
         params['session-id'] = self.sessionid
         return self.connection.request(r, params, answers)
 
+    def request_listing(self, r, params = {}):
+        """Pass the request through to the connection, adding the session-id
+        parameter."""
+        params['session-id'] = self.sessionid
+        return self.connection.request_listing(r, params)
+
     def update(self):
         response = self.request("/update")
         self.revision = response.getAtom('musr')
@@ -435,15 +522,26 @@ class DAAPDatabase(object):
         self.session = session
         self.name = atom.getAtom("minm")
         self.id = atom.getAtom("miid")
+        self.persistentid = atom.getAtom("mper")
 
     def tracks(self):
         """returns all the tracks in this database, as DAAPTrack objects"""
-        response = self.session.request("/databases/%s/items"%self.id, {
-            'meta':daap_atoms
-        })
-        #response.printTree()
-        track_list = response.getAtom("mlcl").contains
-        return [DAAPTrack(self, t) for t in track_list]
+        return [DAAPTrack(self, t) for t in self.track_listing()]
+
+    def track_listing(self, revision = None, delta = None):
+        """returns the tracks in this database as a DAAPListing.
+
+        If delta is the revision the client has, only the tracks added or
+        changed since then up to revision are listed, and the ids of the
+        removed ones are in the dmap.deletedidlisting of the response.
+        Servers may still send all the tracks, dmap.updatetype is 0
+        then."""
+        params = {'meta':daap_atoms}
+        if delta is not None:
+            params['revision-number'] = revision
+            params['delta'] = delta
+        return self.session.request_listing("/databases/%s/items"%self.id,
+            params)
 
     def playlists(self):
         response = self.session.request("/databases/%s/containers"%self.id)
@@ -1,15 +1,35 @@
 
+import gzip
 import logging
+import threading
+import time
+from cStringIO import StringIO
 from gi.repository import GObject
 from xl import collection, event, settings
 import spydaap.parser.exaile
+from spydaap.daap import do
 
 log = logging.getLogger(__file__)
 
 
 # todo support multiple connections?
 class CollectionWrapper:
-    '''Class to wrap Exaile's collection to make it spydaap compatible'''
+    '''Class to wrap Exaile's collection to make it spydaap compatible
+
+    Tracks keep their item id while the server runs, and their encoded
+    listing items are kept until they change. Every change to the
+    collection makes a new server revision, and the changes of the last
+    revisions are remembered, so that clients can be sent only what
+    changed since their revision.'''
+
+    # number of revisions clients can get the changes since
+    max_changes = 100
+
+    # tags that are not part of the listing items
+    ignored_tags = frozenset(['__playcount', '__last_played', '__rating',
+        '__date_added', '__modified', '__basedir', '__startoffset',
+        '__stopoffset'])
+
     class TrackWrapper:
         '''Wrap a single track for spydaap'''
         def __init__(self, id, track):
@@ -17,6 +37,7 @@ class CollectionWrapper:
             self.id = id
             self.parser = spydaap.parser.exaile.ExaileParser()
             self.daap = None
+            self.item = None
 
         def get_dmap_raw(self):
             if self.daap is None:
@@ -27,26 +48,174 @@ class CollectionWrapper:
                     self.daap = ''
             return self.daap
 
+        def get_listing_item(self):
+            '''The encoded dmap.listingitem of the track'''
+            if self.item is None:
+                self.item = do('dmap.listingitem',
+                               [ do('dmap.itemkind', 2),
+                                 do('dmap.containeritemid', self.id),
+                                 do('dmap.itemid', self.id),
+                                 self.get_dmap_raw()
+                                 ]).encode()
+            return self.item
+
         def get_original_filename(self):
             return self.track.get_local_path()
 
     def __init__(self, collection):
         self.collection = collection
-        self.map = []
+        self.lock = threading.Lock()
+        self.map = None
+        self.ids = {}
+        self.next_id = 1
+        # Revisions of previous runs of the server are older than all
+        # the ones of this run, so their clients get a full update
+        self.revision = int(time.time())
+        # (revision, ids of added or changed tracks, ids of removed tracks)
+        self.changes = []
+        # responses for the current revision
+        self.responses = {}
+
+        self._callbacks = [
+            event.add_batch_callback(self.on_tracks_changed, 'tracks_added',
+                collection),
+            event.add_batch_callback(self.on_tracks_changed,
+                'tracks_removed', collection),
+            event.add_batch_callback(self.on_tracks_changed,
+                'track_tags_changed'),
+        ]
+
+    def close(self):
+        for remove in self._callbacks:
+            remove()
+        self._callbacks = []
+
+    def _get_map(self):
+        '''Returns the id -> TrackWrapper map, must hold the lock'''
+        if self.map is None:
+            self.map = {}
+            for track in self.collection:
+                self._add(track)
+        return self.map
+
+    def _add(self, track):
+        loc = track.get_loc_for_io()
+        id = self.ids.get(loc)
+        if id is None:
+            id = self.ids[loc] = self.next_id
+            self.next_id += 1
+        # a new wrapper, so that listing items being encoded for a
+        # request can't end up in the cache of the changed track
+        self.map[id] = self.TrackWrapper(id, track)
+        return id
+
+    def on_tracks_changed(self, events):
+        changed = set()
+        removed = set()
+        with self.lock:
+            if self.map is None:
+                # nobody asked for the tracks yet
+                return
+            for type, obj, data in events:
+                if type == 'tracks_added':
+                    for loc in data:
+                        track = self.collection.get_track_by_loc(loc)
+                        if track is not None:
+                            changed.add(self._add(track))
+                elif type == 'tracks_removed':
+                    for loc in data:
+                        id = self.ids.pop(loc, None)
+                        if id is not None:
+                            del self.map[id]
+                            changed.discard(id)
+                            removed.add(id)
+                elif data not in self.ignored_tags:
+                    id = self.ids.get(obj.get_loc_for_io())
+                    if id is not None:
+                        self._add(obj)
+                        changed.add(id)
+            if not changed and not removed:
+                return
+            self.revision += 1
+            self.changes.append((self.revision, changed, removed))
+            del self.changes[:-self.max_changes]
+            self.responses = {}
+
+    def get_item_list(self, delta=None, compress=False):
+        '''Returns the encoded daap.databasesongs response
+
+        :param delta: the revision of the client, to only send the changes
+            since then; None for all the tracks
+        :param compress: whether to gzip the response'''
+        with self.lock:
+            tracks = self._get_map()
+            revision = self.revision
+            if delta == revision:
+                start = len(self.changes)
+            elif delta is not None:
+                for start, change in enumerate(self.changes):
+                    if change[0] == delta + 1:
+                        break
+                else:
+                    # we don't know what changed since then
+                    delta = None
+            key = (delta, compress)
+            data = self.responses.get(key)
+            if data is not None:
+                return data
+
+            total = len(tracks)
+            if delta is None:
+                items = tracks.values()
+                removed = ()
+            else:
+                changed = set()
+                removed = set()
+                for rev, c, r in self.changes[start:]:
+                    changed |= c
+                    changed -= r
+                    removed |= r
+                items = [tracks[id] for id in changed]
+
+        # Encoding is done without the lock, it can take a while
+        children = [ do('dmap.status', 200),
+                     do('dmap.updatetype', 0 if delta is None else 1),
+                     do('dmap.specifiedtotalcount', total),
+                     do('dmap.returnedcount', len(items)),
+                     do('dmap.listing',
+                        [ ''.join([w.get_listing_item() for w in items]) ])
+                     ]
+        if removed:
+            children.append(do('dmap.deletedidlisting',
+                               [ do('dmap.itemid', id) for id in removed ]))
+        data = do('daap.databasesongs', children).encode()
+
+        if compress:
+            buf = StringIO()
+            f = gzip.GzipFile(mode='wb', fileobj=buf)
+            f.write(data)
+            f.close()
+            data = buf.getvalue()
+
+        with self.lock:
+            if self.revision == revision:
+                self.responses[key] = data
+        return data
 
     def __iter__(self):
-        i = 0
-        self.map = []
-        for t in self.collection:
-            self.map.append(self.TrackWrapper(i, t))
-            yield self.map[i]
-            i += 1
-    
+        with self.lock:
+            tracks = self._get_map().values()
+        return iter(tracks)
+
     def get_item_by_id(self, id):
-        return self.map[int(id)]
-    
+        with self.lock:
+            try:
+                return self._get_map()[int(id)]
+            except KeyError:
+                raise IndexError(id)
+
     def __getitem__(self, idx):
-        return self.map[idx]
+        return self.get_item_by_id(idx)
 
     def __len__(self):
         return len(self.collection)
@@ -64,9 +233,11 @@ def _enable(exaile):
     port = int(settings.get_option('plugin/daapserver/port', 3689))
     name = settings.get_option('plugin/daapserver/name', 'Exaile Share')
     host = settings.get_option('plugin/daapserver/host', '0.0.0.0')
+    workers = int(settings.get_option('plugin/daapserver/workers', 16))
     
     ds = DaapServer(CollectionWrapper(exaile.collection), 
-                                        port=port, name=name, host=host)
+                                        port=port, name=name, host=host,
+                                        workers=workers)
                                         
     if( settings.get_option('plugin/daapserver/enabled', True) ):
         ds.start()
@@ -86,6 +257,7 @@ def teardown(exaile):
 
 def disable(exaile):
     ds.stop_server()
+    ds.library.close()
     
     
 
@@ -102,6 +274,8 @@ def on_settings_change(event, setting, option):
         ds.set(port=settings.get_option(option,3689))
     if option == 'plugin/daapserver/host' and ds is not None:
         ds.set(host=settings.get_option(option,'0.0.0.0'))
+    if option == 'plugin/daapserver/workers' and ds is not None:
+        ds.set(workers=int(settings.get_option(option, 16)))
     if option == 'plugin/daapserver/enabled' and ds is not None:
         enabled = setting.get_option(option, True)
         if enabled:
@@ -15,11 +15,11 @@
 #You should have received a copy of the GNU General Public License
 #along with Spydaap. If not, see <http://www.gnu.org/licenses/>.
 
-import BaseHTTPServer, SocketServer, getopt, grp, httplib, logging, os, pwd, select, signal, spydaap, sys, socket
+import BaseHTTPServer, getopt, grp, httplib, logging, os, pwd, Queue, select, signal, spydaap, sys, socket, threading, time
 import spydaap.daap, spydaap.metadata, spydaap.containers, spydaap.cache, spydaap.server, spydaap.zeroconf
 from spydaap.daap import do
 from threading import Thread
-from xl import common, event
+from xl import common
 import config
 
 #logging.basicConfig()
@@ -27,46 +27,122 @@ logger = logging.getLogger('daapserver')
 
 __all__ = ['DaapServer']
 
-class MyThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
-    """Handle requests in a separate thread."""
+class MyThreadedHTTPServer(BaseHTTPServer.HTTPServer):
+    """Handle requests in a fixed number of worker threads.
+
+    A worker handles one request of a connection at a time. Kept-alive
+    connections wait for their next request here, without holding a
+    worker, and are closed after idle_timeout seconds."""
     timeout = 1
+    workers = 16
+    idle_timeout = 300
 
-    def __init__(self, *args):
-        if ':' in args[0][0]:
+    def __init__(self, address, handler, workers=None):
+        if ':' in address[0]:
             self.address_family = socket.AF_INET6   
-        BaseHTTPServer.HTTPServer.__init__(self,*args)
+        if workers is not None:
+            self.workers = max(1, workers)
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
         self.keep_running = True
+        self.queue = Queue.Queue()
+        # idle connection -> (client address, time it became idle)
+        self.idle = {}
+        self.idle_lock = threading.Lock()
+        # written to when a connection becomes idle, so that the main
+        # loop waits for it as well
+        self.wakeup = os.pipe()
+        self.threads = []
+        for i in range(self.workers):
+            thread = Thread(target=self.work, name='DaapServerWorker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def process_request(self, request, client_address):
+        self.queue.put((request, client_address))
+
+    def finish_request(self, request, client_address):
+        """Handles a request, returns whether to keep the connection"""
+        handler = self.RequestHandlerClass(request, client_address, self)
+        return not handler.close_connection
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            (request, client_address) = item
+            keep = False
+            try:
+                keep = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            if keep and self.keep_running:
+                with self.idle_lock:
+                    self.idle[request] = (client_address, time.time())
+                try:
+                    os.write(self.wakeup[1], 'x')
+                except OSError:
+                    pass # stopped meanwhile
+            else:
+                self.shutdown_request(request)
 
     def serve_forever(self):
         while self.keep_running:
-            self.handle_request()
+            with self.idle_lock:
+                idle = list(self.idle)
+            try:
+                readable = select.select([self, self.wakeup[0]] + idle,
+                                         [], [], self.timeout)[0]
+            except (select.error, socket.error):
+                if not self.keep_running:
+                    return
+                raise
+            for sock in readable:
+                if sock is self:
+                    self._handle_request_noblock()
+                elif sock == self.wakeup[0]:
+                    os.read(self.wakeup[0], 512)
+                else:
+                    with self.idle_lock:
+                        (client_address, since) = self.idle.pop(sock)
+                    self.queue.put((sock, client_address))
+            self.close_idle(time.time() - self.idle_timeout)
+
+    def close_idle(self, before=None):
+        """Closes the connections idle since before, or all of them"""
+        with self.idle_lock:
+            expired = [sock for sock, (client_address, since)
+                       in self.idle.iteritems()
+                       if before is None or since < before]
+            for sock in expired:
+                del self.idle[sock]
+        for sock in expired:
+            self.shutdown_request(sock)
 
     def force_stop(self):
         self.keep_running = False
         self.server_close()
+        self.close_idle()
+        for thread in self.threads:
+            self.queue.put(None)
+        for fd in self.wakeup:
+            os.close(fd)
         
 class DaapServer():
-    def __init__(self, library, name=spydaap.server_name, host='', port=spydaap.port):
+    def __init__(self, library, name=spydaap.server_name, host='', port=spydaap.port,
+                 workers=MyThreadedHTTPServer.workers):
 #        Thread.__init__(self)
         self.host = host
         self.port = port
+        self.workers = workers
         self.library = library
         self.name = name
         self.httpd = None
         self.handler = None
-        
-        # Set a callback that will let us propagate library changes to clients
-        event.add_callback( self.update_rev, 'libraries_modified',
-                                                     library.collection) 
-        
-    def update_rev(self, *args):
-        if self.handler is not None:
-            # Updating the server revision, so if a client checks 
-            # it can see the library has changed
-            self.handler.daap_server_revision += 1
-            logger.info('Libraries Changed, incrementing revision to %d.' 
-                                    % self.handler.daap_server_revision )
-        
+        # The library keeps track of the server revision, so if a client
+        # checks it can see the library has changed
+
     def set(self, **kwargs):
         for key in kwargs:
             setattr(self, key, kwargs[key])
@@ -79,7 +155,7 @@ class DaapServer():
         self.handler = spydaap.server.makeDAAPHandlerClass(
                                         str(self.name), [], self.library, [])
         self.httpd = MyThreadedHTTPServer((self.host, self.port), 
-                                     self.handler)
+                                     self.handler, self.workers)
         
         #signal.signal(signal.SIGTERM, make_shutdown(httpd))
         #signal.signal(signal.SIGHUP, rebuild_cache)
@@ -13,9 +13,59 @@
 #You should have received a copy of the GNU General Public License
 #along with Spydaap. If not, see <http://www.gnu.org/licenses/>.
 
-import BaseHTTPServer, errno, logging, os, re, urlparse, socket, spydaap, sys
+import BaseHTTPServer, errno, logging, mimetypes, os, re, urlparse, socket, spydaap, sys
 from spydaap.daap import do
 
+# MIME types of the audio formats, by file extension
+audio_types = {
+    'aac': 'audio/aac',
+    'aif': 'audio/x-aiff',
+    'aiff': 'audio/x-aiff',
+    'ape': 'audio/x-ape',
+    'flac': 'audio/flac',
+    'm4a': 'audio/mp4',
+    'm4b': 'audio/mp4',
+    'mp2': 'audio/mpeg',
+    'mp3': 'audio/mpeg',
+    'mpc': 'audio/x-musepack',
+    'oga': 'audio/ogg',
+    'ogg': 'audio/ogg',
+    'opus': 'audio/ogg',
+    'spx': 'audio/ogg',
+    'wav': 'audio/x-wav',
+    'wma': 'audio/x-ms-wma',
+    'wv': 'audio/x-wavpack',
+}
+
+def get_audio_type(fn):
+    ext = os.path.splitext(fn)[1][1:].lower()
+    if ext in audio_types:
+        return audio_types[ext]
+    return mimetypes.guess_type(fn)[0] or 'application/octet-stream'
+
+range_re = re.compile('bytes=([0-9]*)-([0-9]*)$')
+
+def parse_range(header, size):
+    """Returns the first and last byte of a Range header, or None if
+    none of the file can be sent"""
+    m = range_re.match(header.strip())
+    if m is None:
+        return None
+    (start, end) = m.groups()
+    if start == '':
+        # the last 'end' bytes
+        if end == '' or int(end) == 0:
+            return None
+        return (max(0, size - int(end)), size - 1)
+    start = int(start)
+    if end == '' or int(end) >= size:
+        end = size - 1
+    else:
+        end = int(end)
+    if start > end:
+        return None
+    return (start, end)
+
 def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
     session_id = 1
     log = logging.getLogger('spydaap.server')
@@ -23,6 +73,24 @@ def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
     class DAAPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         daap_server_revision = 1
         protocol_version = "HTTP/1.1"
+        # for reading a request; responses get write_timeout, as a client
+        # that pauses a stream stops reading for a while
+        timeout = 30
+        write_timeout = 1800
+        # unbuffered, so that nothing of the next request on the
+        # connection is read along with this one
+        rbufsize = 0
+        chunk_size = 64 * 1024
+
+        def handle(self):
+            # a single request, the server waits for the next one on the
+            # connection without holding a worker
+            self.close_connection = 1
+            self.handle_one_request()
+
+        def end_headers(self):
+            BaseHTTPServer.BaseHTTPRequestHandler.end_headers(self)
+            self.connection.settimeout(self.write_timeout)
 
         def h(self, data, **kwargs):
             self.send_response(kwargs.get('status', 200))
@@ -97,8 +165,12 @@ def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
             return
 
         def do_HEAD(self):
+            # the handler serves all the requests of a connection
             self.isHEAD = True
-            self.do_GET()
+            try:
+                self.do_GET()
+            finally:
+                self.isHEAD = False
 
         def do_GET_login(self):
             mlog = do('dmap.loginresponse',
@@ -185,14 +257,35 @@ def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
                             children) ])
                 return d.encode()
 
+            if hasattr(md_cache, 'get_item_list'):
+                # the library keeps encoded responses and can send only
+                # what changed since the revision of the client
+                query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+                try:
+                    delta = int(query['delta'][0])
+                except (KeyError, ValueError):
+                    delta = None
+                if not delta:
+                    delta = None
+                compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+                data = md_cache.get_item_list(delta, compress)
+                extra_headers = {}
+                if compress:
+                    extra_headers['Content-Encoding'] = 'gzip'
+                self.h(data, extra_headers=extra_headers)
+                return
+
             data = build()
 #            data = cache.get('item_list', build)
             self.h(data)
 
+        def get_revision(self):
+            return getattr(md_cache, 'revision', self.daap_server_revision)
+
         def do_GET_update(self):
             mupd = do('dmap.updateresponse',
                       [ do('dmap.status', 200),
-                        do('dmap.serverrevision', self.daap_server_revision),
+                        do('dmap.serverrevision', self.get_revision()),
                         ])
             self.h(mupd.encode())
 
@@ -203,23 +296,75 @@ def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
                 self.send_error(404)    # this can be caused by left overs from previous sessions
                 return
 
-            if (self.headers.has_key('Range')):
-                rs = self.headers['Range']
-                m = re.compile('bytes=([0-9]+)-([0-9]+)?').match(rs)
-                (start, end) = m.groups()
-                if end != None: end = int(end)
-                else: end = os.stat(fn).st_size
-                start = int(start)
-                f = spydaap.ContentRangeFile(fn, open(fn), start, end)
-                extra_headers={"Content-Range": "bytes %s-%s/%s"%(str(start), str(end), str(os.stat(fn).st_size))}
-                status=206
-            else: 
-                f = open(fn)
-                extra_headers={}
-                status=200
-            # this is ugly, very wrong.
-            type = "audio/%s"%(os.path.splitext(fn)[1])
-            self.h(f, type=type, status=status, extra_headers=extra_headers)
+            try:
+                f = open(fn, 'rb')
+            except IOError:
+                self.send_error(404)
+                return
+            try:
+                size = os.fstat(f.fileno()).st_size
+                extra_headers = {}
+                status = 200
+                (start, end) = (0, size - 1)
+                if self.headers.has_key('Range'):
+                    r = parse_range(self.headers['Range'], size)
+                    if r is None:
+                        self.send_response(416)
+                        self.send_header('Content-Range', 'bytes */%d' % size)
+                        self.send_header('Content-Length', 0)
+                        self.end_headers()
+                        return
+                    (start, end) = r
+                    extra_headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+                    status = 206
+                self.send_file(f, start, end + 1 - start, status=status,
+                               type=get_audio_type(fn),
+                               extra_headers=extra_headers)
+            finally:
+                f.close()
+
+        def send_file(self, f, start, length, **kwargs):
+            """Like h, but sends length bytes of f from start"""
+            self.send_response(kwargs.get('status', 200))
+            self.send_header('Content-Type', kwargs.get('type', 'application/octet-stream'))
+            self.send_header('DAAP-Server', 'Simple')
+            self.send_header('Accept-Ranges', 'bytes')
+            for k, v in kwargs.get('extra_headers', {}).iteritems():
+                self.send_header(k, v)
+            self.send_header('Content-Length', length)
+            self.end_headers()
+            if getattr(self, 'isHEAD', False) or length <= 0:
+                return
+            try:
+                self.wfile.flush()
+                sendfile = getattr(os, 'sendfile', None)
+                if sendfile is not None:
+                    # the kernel copies the file straight to the socket
+                    out = self.connection.fileno()
+                    while length > 0:
+                        sent = sendfile(out, f.fileno(), start, min(length, 1 << 30))
+                        if sent == 0:
+                            break
+                        start += sent
+                        length -= sent
+                else:
+                    f.seek(start)
+                    while length > 0:
+                        data = f.read(min(length, self.chunk_size))
+                        if not data:
+                            break
+                        self.connection.sendall(data)
+                        length -= len(data)
+            except socket.timeout:
+                self.close_connection = 1
+            except socket.error as ex:
+                if ex.errno in [errno.ECONNRESET, errno.EPIPE]:
+                    self.close_connection = 1
+                else: raise
+            if length > 0:
+                # the file got shorter, the client can't know where the
+                # response ends
+                self.close_connection = 1
 
         def do_GET_container_list(self, database):
             container_do = []
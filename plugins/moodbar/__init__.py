@@ -23,17 +23,22 @@
 from __future__ import division, print_function
 
 import os.path
+import Queue
 
 from gi.repository import (
     Gdk,
     GLib,
+    Gtk,
 )
 
+import xl.common
 import xl.event
 from xl.nls import gettext as _
 import xl.player
+import xl.providers
 import xl.xdg
 import xlgui.guiutil
+from xlgui.widgets import menu
 
 from cache import ExaileMoodbarCache
 from generator import SpectrumMoodbarGenerator
@@ -62,9 +67,25 @@ class MoodbarPlugin:
     def on_gui_loaded(self):
         self.main_controller = MoodbarController(self, xl.player.PLAYER, self.exaile.gui.main.progress_bar)
 
+        self.menuitems = [
+            ('track-panel-menu', menu.simple_menu_item('_moodbar', ['enqueue'],
+                _('Generate Moodbars'), callback=self._on_generate_selected,
+                condition_fn=lambda n, p, c: not c['selection-empty'])),
+            ('playlist-context-menu', menu.simple_menu_item('_moodbar', ['enqueue'],
+                _('Generate Moodbars'), callback=self._on_generate_selected,
+                condition_fn=lambda n, p, c: not c['selection-empty'])),
+            ('menubar-tools-menu', menu.simple_separator('plugin-sep', ['track-properties'])),
+            ('menubar-tools-menu', menu.simple_menu_item('moodbar', ['plugin-sep'],
+                _('Generate Moodbars for Collection'), callback=self._on_generate_collection)),
+        ]
+        for provider, item in self.menuitems:
+            xl.providers.register(provider, item)
+
     def disable(self, exaile):
         if not self.main_controller:  # Disabled more than once or before gui_loaded
             return
+        for provider, item in self.menuitems:
+            xl.providers.unregister(provider, item)
         xl.event.remove_callback(self._on_preview_device_enabled, 'preview_device_enabled')
         xl.event.remove_callback(self._on_preview_device_disabling, 'preview_device_disabling')
         self.main_controller.destroy()
@@ -82,6 +103,48 @@ class MoodbarPlugin:
         self.preview_controller.destroy()
         self.preview_controller = None
 
+    # Pre-generation
+
+    def _on_generate_selected(self, widget, name, parent, context):
+        self.pregenerate(context['selected-tracks'])
+
+    def _on_generate_collection(self, *args):
+        self.pregenerate(self.exaile.collection)
+
+    def pregenerate(self, tracks):
+        """Generate the missing moodbars of local tracks in the background.
+
+        The moodbars are generated by the same workers as the ones for the
+        playing track, which go first.
+        """
+        thread = xl.common.SimpleProgressThread(self._pregenerate,
+            self.generator, self.cache, [tr.get_loc_for_io() for tr in tracks])
+        self.exaile.gui.main.controller.progress_manager.add_monitor(thread,
+            _("Generating moodbars..."), Gtk.STOCK_EXECUTE)
+
+    def _pregenerate(self, generator, cache, uris):
+        uris = [uri for uri in uris if uri.startswith('file://') and not cache.has(uri)]
+        total = len(uris)
+        done = Queue.Queue()
+
+        def callback(uri, data):
+            cache.put(uri, data)
+            done.put(uri)
+
+        for uri in uris:
+            generator.generate_async(uri, callback, priority=1)
+        try:
+            finished = 0
+            while finished < total:
+                yield (finished, total)
+                try:
+                    done.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                finished += 1
+        finally:
+            generator.cancel(callback)
+
 plugin_class = MoodbarPlugin
 
 
@@ -126,16 +189,23 @@ class MoodbarController:
         cache = self.plugin.cache
         uri = player.current.get_loc_for_io()
         data = cache.get(uri) if cache else None
-        self.moodbar.set_mood(data)
+        self.moodbar.set_mood(data, uri)
         self._on_timer()
         self.timer = GLib.timeout_add_seconds(1, self._on_timer)
         if not data and uri.startswith('file://'):
             def callback(uri, data):
                 if cache:
                     cache.put(uri, data)
-                self.moodbar.set_mood(data)
+                GLib.idle_add(self._on_mood_generated, uri, data)
             self.plugin.generator.generate_async(uri, callback)
 
+    def _on_mood_generated(self, uri, data):
+        if not self.moodbar:
+            return
+        current = self.player.current
+        if current and current.get_loc_for_io() == uri:
+            self.moodbar.set_mood(data, uri)
+
     def _on_timer(self):
         assert self.moodbar
         try:
@@ -42,6 +42,13 @@ class MoodbarCache:
         """
         raise NotImplementedError
 
+    def has(self, uri):
+        """
+        :type uri: bytes
+        :rtype: bool
+        """
+        return self.get(uri) is not None
+
 
 class ExaileMoodbarCache(MoodbarCache):
     def __init__(self, location):
@@ -58,6 +65,9 @@ class ExaileMoodbarCache(MoodbarCache):
         except IOError:
             return None
 
+    def has(self, uri):
+        return os.path.exists(self._get_cache_path(uri))
+
     def put(self, uri, data):
         if data is None:
             return
@@ -17,7 +17,11 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import itertools
+import logging
+import multiprocessing
 import os
+import Queue
 import subprocess
 import threading
 import tempfile
@@ -25,10 +29,32 @@ import tempfile
 from gi.repository import Gio
 
 
+logger = logging.getLogger(__name__)
+
+
 class MoodbarGeneratorError(Exception): pass
 
 
 class MoodbarGenerator:
+    def __init__(self, max_workers=None):
+        """
+        :param max_workers: Number of moodbars generated at the same time,
+            defaults to the number of CPUs
+        :type max_workers: int|None
+        """
+        if max_workers is None:
+            try:
+                max_workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                max_workers = 2
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._queue = Queue.PriorityQueue()
+        self._order = itertools.count()
+        self._pending = {}  # uri -> [priority, callbacks]
+        self._running = set()
+        self._workers = 0
+
     def check(self):
         """Check whether the generator works.
 
@@ -50,15 +76,79 @@ class MoodbarGenerator:
         """
         raise NotImplementedError
 
-    def generate_async(self, uri, callback=None):
-        """
+    def generate_async(self, uri, callback=None, priority=0):
+        """Generate the moodbar in one of the worker threads.
+
+        At most `max_workers` moodbars are generated at a time; requests with
+        lower priority values go first. Requests for a URI that is already
+        queued are merged. The callback is called from the worker thread,
+        with None as data if the generation failed.
+
         :type uri: bytes
+        :type callback: Callable[[bytes, bytes], None]
+        :type priority: int
+        """
+        with self._lock:
+            pending = self._pending.get(uri)
+            if pending is None:
+                self._pending[uri] = [priority, [callback]]
+            else:
+                pending[1].append(callback)
+                if priority >= pending[0]:
+                    return
+                # Queue it again with the higher priority; the old entry is
+                # skipped by the workers.
+                pending[0] = priority
+            self._queue.put((priority, next(self._order), uri))
+            if self._workers < self.max_workers:
+                self._workers += 1
+                t = threading.Thread(name=self.__class__.__name__, target=self._work)
+                t.daemon = True
+                t.start()
+
+    def cancel(self, callback):
+        """Forget about queued requests that were made with callback.
+
+        Requests that are already running still finish, but do not call it.
+
         :type callback: Callable[[bytes, bytes], None]
         """
-        t = threading.Thread(name=self.__class__.__name__,
-            target=self.generate, args=(uri, callback))
-        t.daemon = True
-        t.start()
+        with self._lock:
+            for uri, pending in self._pending.items():
+                callbacks = pending[1]
+                while callback in callbacks:
+                    callbacks.remove(callback)
+                if not callbacks and uri not in self._running:
+                    del self._pending[uri]
+
+    def _work(self):
+        while True:
+            try:
+                _priority, _order, uri = self._queue.get(timeout=5)
+            except Queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._workers -= 1
+                        return
+                continue
+            with self._lock:
+                if uri not in self._pending or uri in self._running:
+                    continue
+                self._running.add(uri)
+            data = None
+            try:
+                data = self.generate(uri)
+            except MoodbarGeneratorError as e:
+                logger.warning("Failed to generate moodbar for %s: %s", uri, e)
+            except Exception:
+                logger.exception("Failed to generate moodbar for %s", uri)
+            finally:
+                with self._lock:
+                    self._running.discard(uri)
+                    callbacks = self._pending.pop(uri)[1]
+            for callback in callbacks:
+                if callback:
+                    callback(uri, data)
 
 
 class SpectrumMoodbarGenerator(MoodbarGenerator):
@@ -17,29 +17,51 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import collections
+
 import cairo
 
 
 class MoodbarPainter:
     """Turn moodbar data into Cairo surface, ready to be drawn"""
 
-    def paint(self, data):
+    cache_size = 20
+
+    def __init__(self):
+        self._surfaces = collections.OrderedDict()
+
+    def paint(self, data, uri=None):
         """Paint moodbar to a surface.
 
+        The surfaces of the last few URIs are kept, so that painting the same
+        mood again is free.
+
         :param data: Moodbar data
         :type data: bytes
+        :param uri: URI the data belongs to, used to cache the surface
+        :type uri: bytes|None
         :return: Cairo surface containing the image to be drawn
         :rtype: cairo.ImageSurface
         """
-        surf = cairo.ImageSurface(cairo.FORMAT_RGB24, 1000, 1)
-        arr = surf.get_data()
-        for p in xrange(0, 1000):
-            p4 = p * 4
-            p3 = p * 3
-            # Cairo RGB24 is BGRX
-            arr[p4 + 0] = data[p3 + 2]
-            arr[p4 + 1] = data[p3 + 1]
-            arr[p4 + 2] = data[p3 + 0]
+        if uri is not None:
+            cached = self._surfaces.pop(uri, None)
+            if cached and cached[0] == data:
+                self._surfaces[uri] = cached
+                return cached[1]
+
+        # Cairo RGB24 is BGRX; shuffle the channels with slices instead of
+        # going through the pixels one by one.
+        pixels = bytearray(4000)
+        rgb = bytearray(data[:3000])
+        pixels[0::4] = rgb[2::3]
+        pixels[1::4] = rgb[1::3]
+        pixels[2::4] = rgb[0::3]
+        surf = cairo.ImageSurface.create_for_data(pixels, cairo.FORMAT_RGB24, 1000, 1, 4000)
+
+        if uri is not None:
+            self._surfaces[uri] = (data, surf)
+            while len(self._surfaces) > self.cache_size:
+                self._surfaces.popitem(last=False)
         return surf
 
 
@@ -43,15 +43,17 @@ class Moodbar(Gtk.DrawingArea):
         self.surf = self.text = self.text_extents = self.tint = None
         self._seek_position = None
 
-    def set_mood(self, data):
+    def set_mood(self, data, uri=None):
         """
         :param data: Mood data, or None to not show any
         :type data: bytes|None
+        :param uri: URI of the track the data belongs to
+        :type uri: bytes|None
         :return: Whether the mood data is successfully set
         :rtype: bool
         """
         if data:
-            self.surf = self.loader.paint(data)
+            self.surf = self.loader.paint(data, uri)
             self._invalidate()
             return bool(self.surf)
         else:
@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+"""
+Measures how many settings lookups per second can be made.
+
+Compares parsing the stored string on every lookup, as get_option did
+before values were cached, with get_option and with the value of a
+subscribed option handle.
+
+Run from the top of the source tree:
+
+    EXAILE_DIR=. PYTHONPATH=. python2 tests/benchmarks/get_option.py [count]
+"""
+
+import sys
+import time
+
+from xl.settings import SettingsManager
+
+OPTIONS = [
+    ('gui/sync_on_tag_change', True),
+    ('player/volume', 0.75),
+    ('gui/columns', ['tracknumber', 'title', 'album', 'artist', '__length']),
+    ('playlist/replace_content', False),
+]
+
+
+def get_option_uncached(manager, option, default=None):
+    splitvals = option.split('/')
+    section, key = "/".join(splitvals[:-1]), splitvals[-1]
+    try:
+        return manager._str_to_val(manager.get(section, key))
+    except Exception:
+        return default
+
+
+def timed(func, count):
+    start = time.time()
+    func(count)
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    manager = SettingsManager(None)
+    for option, value in OPTIONS:
+        manager.set_option(option, value, save=False)
+
+    print "%d lookups of each option" % count
+    for option, value in OPTIONS:
+        handle = manager.subscribe(option)
+        assert get_option_uncached(manager, option) == value
+        assert manager.get_option(option) == value
+        assert handle.value == value
+
+        def uncached(count):
+            for i in xrange(count):
+                get_option_uncached(manager, option)
+
+        def cached(count):
+            for i in xrange(count):
+                manager.get_option(option)
+
+        def subscribed(count):
+            for i in xrange(count):
+                handle.value
+
+        print option
+        for name, func in (('uncached', uncached), ('get_option', cached),
+                ('subscribe', subscribed)):
+            elapsed = timed(func, count)
+            print "  %-11s %10.0f lookups/s" % (name + ':', count / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python2
+"""
+Measures how long sorting a collection by artist/album/disc/track takes.
+
+Compares computing every sort value on each comparison key, as
+sort_tracks did before sort values were cached, with the first (cold)
+and a repeated (warm) sort_tracks call.
+
+Run from the top of the source tree:
+
+    EXAILE_DIR=. PYTHONPATH=. python2 tests/benchmarks/sort_tracks.py [count]
+"""
+
+import random
+import sys
+import time
+
+from xl.trax.track import Track
+from xl.trax.util import sort_tracks
+
+FIELDS = ('artist', 'date', 'album', 'discnumber', 'tracknumber', 'title')
+
+
+def make_tracks(count):
+    tracks = []
+    for i in xrange(count):
+        album = i // 12
+        artist = album // 4
+        tr = Track(_unpickles={
+            '__loc': u'file:///music/%d/%d/%02d.ogg' % (artist, album, i % 12),
+            'artist': [u'The Artist %d' % artist],
+            'album': [u'Album %d' % album],
+            'date': [u'%d' % (1970 + album % 40)],
+            'discnumber': [u'1/1'],
+            'tracknumber': [u'%d/12' % (i % 12 + 1)],
+            'title': [u'Title %d' % i],
+        })
+        tracks.append(tr)
+    random.shuffle(tracks)
+    return tracks
+
+
+def sort_uncached(tracks):
+    keyfunc = lambda tr: [tr._Track__get_tag_sort(field, True, False, True)
+        for field in FIELDS]
+    return sorted(tracks, key=keyfunc)
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    tracks = make_tracks(count)
+
+    uncached, expected = timed(sort_uncached, tracks)
+    cold, result = timed(sort_tracks, FIELDS, tracks)
+    assert result == expected
+    warm, result = timed(sort_tracks, FIELDS, tracks)
+    assert result == expected
+
+    print "%d tracks, sorted by %s" % (count, ', '.join(FIELDS))
+    print "uncached: %6.3fs" % uncached
+    print "cold:     %6.3fs" % cold
+    print "warm:     %6.3fs" % warm
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python2
+"""
+Measures how many bytes the tags of a track take in memory.
+
+Compares the current Track/TrackHolder representation with the one
+used before tag values were packed and interned: a dict of lists per
+track, and a TrackHolder with an instance dict and an attribute dict.
+Also measures the tracks once their caches hold the sort keys and the
+formatted columns of a typical playlist view.
+
+Run from the top of the source tree:
+
+    EXAILE_DIR=. PYTHONPATH=. python2 tests/benchmarks/track_memory.py [count]
+"""
+
+import sys
+
+from xl import formatter
+from xl.trax import track as track_module
+from xl.trax.track import Track
+from xl.trax.trackdb import TrackHolder
+
+
+def make_tags(i):
+    """
+        Returns the tags of a synthetic track. Like tags read from files,
+        every value is a new string object.
+    """
+    album = i // 12
+    artist = album // 4
+    return {
+        '__loc': u'file:///music/artist%d/album%d/%02d.ogg' % (artist, album, i % 12),
+        '__basedir': '/music/artist%d/album%d' % (artist, album),
+        '__length': 180.0 + i % 120,
+        '__bitrate': 192000,
+        '__modified': 1400000000.0 + i,
+        '__date_added': 1400000000.0 + i,
+        'artist': [u'Artist %d' % artist],
+        'albumartist': [u'Artist %d' % artist],
+        'album': [u'Album %d' % album],
+        'title': [u'Title of track %d' % i],
+        'tracknumber': [u'%d/12' % (i % 12 + 1)],
+        'date': [u'%d' % (1970 + album % 40)],
+        'genre': [u'Genre %d' % (artist % 20), u'Rock'],
+    }
+
+
+class _OldTrackHolder(object):
+    def __init__(self, track, key, **kwargs):
+        self._track = track
+        self._key = key
+        self._attrs = kwargs
+
+
+def deep_size(obj, seen):
+    """
+        Returns the size of obj and everything it refers to that has not
+        been counted yet
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += deep_size(value, seen)
+    elif isinstance(obj, _OldTrackHolder):
+        size += deep_size(obj.__dict__, seen)
+    elif isinstance(obj, TrackHolder):
+        for attr in TrackHolder.__slots__:
+            size += deep_size(getattr(obj, attr), seen)
+    elif isinstance(obj, Track):
+        size += deep_size(obj._Track__tags, seen)
+        size += deep_size(obj._Track__tag_cache, seen)
+    return size
+
+
+def measure_old(count):
+    seen = set()
+    total = 0
+    # keep everything alive, so that ids are not reused
+    holders = []
+    for i in xrange(count):
+        holder = _OldTrackHolder(make_tags(i), i)
+        holders.append(holder)
+        total += deep_size(holder, seen)
+    return total
+
+
+# the columns of the default playlist view
+COLUMNS = [u'$tracknumber', u'$title', u'$artist', u'$album',
+    u'$__length', u'$__rating']
+SORT_FIELDS = ('artist', 'date', 'album', 'discnumber', 'tracknumber',
+    'title')
+
+
+def fill_cache(track, formatters):
+    """
+        Caches what a playlist view sorted by artist asks for: the sort
+        key and the columns, with and without markup
+    """
+    track._get_sort_key(SORT_FIELDS)
+    for tag in SORT_FIELDS:
+        track.get_tag_sort(tag)
+    for f in formatters:
+        f.format(track)
+        f.format(track, markup_escape=True)
+
+
+def measure_new(count, cached=False):
+    seen = set()
+    total = 0
+    holders = []
+    formatters = [formatter.TrackFormatter(column, cache=True)
+        for column in COLUMNS]
+    for i in xrange(count):
+        holder = TrackHolder(Track(_unpickles=make_tags(i)), i)
+        if cached:
+            fill_cache(holder._track, formatters)
+        holders.append(holder)
+        total += deep_size(holder, seen)
+    return total
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    old = measure_old(count)
+    new = measure_new(count)
+    cached = measure_new(count, cached=True)
+    print "%d tracks" % count
+    print "before: %7.1f bytes per track" % (float(old) / count)
+    print "after:  %7.1f bytes per track" % (float(new) / count)
+    print "saved:  %7.1f%%" % (100.0 * (old - new) / old)
+    print "cached: %7.1f bytes per track, %d values at most" % (
+        float(cached) / count, track_module._TAG_CACHE_SIZE)
+
+
+if __name__ == '__main__':
+    main()
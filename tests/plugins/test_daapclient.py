@@ -0,0 +1,211 @@
+import gzip
+import os
+import sys
+from cStringIO import StringIO
+
+import pytest
+
+from xl import xdg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+    'plugins', 'daapclient'))
+import daap
+from daap import DAAPObject as do
+
+
+class FakeResponse(object):
+    """
+        An HTTP response handing out at most chunk bytes per read
+    """
+    def __init__(self, data, encoding=None, chunk=7):
+        self.data = StringIO(data)
+        self.encoding = encoding
+        self.chunk = chunk
+        self.closed = False
+
+    def getheader(self, name):
+        if name == 'Content-Encoding':
+            return self.encoding
+
+    def read(self, size=-1):
+        return self.data.read(min(size, self.chunk))
+
+    def close(self):
+        self.closed = True
+
+
+def item(id, name):
+    return do('mlit', [do('miid', id), do('minm', name)])
+
+
+def listing_data(items, deleted=None):
+    contains = [do('mstt', 200), do('muty', 1 if deleted else 0),
+        do('mlcl', items)]
+    if deleted:
+        contains.append(do('mudl', [do('miid', id) for id in deleted]))
+    return do('adbs', contains).encode()
+
+
+def read_listing(response):
+    listing = daap.DAAPListing(response)
+    items = [(atom.getAtom('miid'), atom.getAtom('minm'))
+        for atom in listing]
+    return listing, items
+
+
+def test_listing():
+    response = FakeResponse(listing_data(
+        [item(1, 'one'), item(2, 'two')], deleted=[3, 4]))
+    listing, items = read_listing(response)
+    assert items == [(1, 'one'), (2, 'two')]
+    assert listing.response.getAtom('mstt') == 200
+    assert listing.response.getAtom('muty') == 1
+    assert [a.value for a in listing.response.getAtom('mudl').contains] == \
+        [3, 4]
+    assert response.closed
+
+
+def test_listing_gzip():
+    data = StringIO()
+    with gzip.GzipFile(fileobj=data, mode='wb') as f:
+        f.write(listing_data([item(i, 'track %d' % i) for i in range(1, 101)]))
+    response = FakeResponse(data.getvalue(), 'gzip', chunk=100)
+    listing, items = read_listing(response)
+    assert items == [(i, 'track %d' % i) for i in range(1, 101)]
+    assert not listing.response.getAtom('muty')
+
+
+def test_listing_truncated():
+    data = listing_data([item(1, 'one'), item(2, 'two')])
+    response = FakeResponse(data[:-5])
+    listing = iter(daap.DAAPListing(response))
+    assert next(listing).getAtom('miid') == 1
+    with pytest.raises(daap.DAAPError):
+        next(listing)
+    assert response.closed
+
+
+class FakeListing(object):
+
+    def __init__(self, items, deleted=None):
+        self.items = items
+        self.response = do('adbs', [do('muty', 1 if deleted else 0)] +
+            ([do('mudl', [do('miid', id) for id in deleted])]
+            if deleted else []))
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class FakeDatabase(object):
+    id = 1
+    persistentid = 1234
+
+    def __init__(self):
+        self.listings = []
+        self.requests = []
+
+    def track_listing(self, revision=None, delta=None):
+        self.requests.append((revision, delta))
+        return self.listings.pop(0)
+
+
+class FakeSession(object):
+    sessionid = 5
+
+    def __init__(self, database, revision):
+        self.database = database
+        self.revision = revision
+        self.connection = type('Connection', (), {'server_name': 'server'})
+
+    def update(self):
+        pass
+
+    def library(self):
+        return self.database
+
+
+def song(id, name):
+    return do('mlit', [do('miid', id), do('minm', name), do('asfm', 'mp3'),
+        do('astm', 1000)])
+
+
+@pytest.fixture
+def daapclient(tmpdir, monkeypatch):
+    pytest.importorskip('dbus')
+    from plugins import daapclient
+    monkeypatch.setattr(xdg, 'get_cache_dir', lambda: str(tmpdir))
+    return daapclient
+
+
+def connect(daapclient, revision, listing=None):
+    database = FakeDatabase()
+    if listing is not None:
+        database.listings.append(listing)
+    connection = daapclient.DaapConnection('share', 'localhost', 3689)
+    connection.session = FakeSession(database, revision)
+    return connection, database
+
+
+def titles(connection):
+    return sorted(tr.get_tag_raw('title')[0] for tr in connection.all)
+
+
+def test_snapshot_saved(daapclient):
+    connection, database = connect(daapclient, 3,
+        FakeListing([song(1, 'one'), song(2, 'two')]))
+    connection.reload()
+    assert database.requests == [(3, None)]
+    assert titles(connection) == [u'one', u'two']
+
+    other, database = connect(daapclient, 3)
+    other.load_snapshot()
+    assert other.revision == 3
+    assert other.snapshot_id == ('server', 1234, 1)
+    assert sorted(other.items) == [1, 2]
+
+
+def test_snapshot_reused_when_unchanged(daapclient):
+    connection, database = connect(daapclient, 3,
+        FakeListing([song(1, 'one'), song(2, 'two')]))
+    connection.reload()
+
+    connection, database = connect(daapclient, 3)
+    assert connection.reload() == []
+    assert database.requests == []
+    assert titles(connection) == [u'one', u'two']
+
+
+def test_snapshot_delta(daapclient):
+    connection, database = connect(daapclient, 3,
+        FakeListing([song(1, 'one'), song(2, 'two')]))
+    connection.reload()
+
+    connection, database = connect(daapclient, 5,
+        FakeListing([song(3, 'three')], deleted=[1]))
+    connection.reload()
+    assert database.requests == [(5, 3)]
+    assert titles(connection) == [u'three', u'two']
+
+
+def test_snapshot_discarded_for_older_revision(daapclient):
+    connection, database = connect(daapclient, 3,
+        FakeListing([song(1, 'one'), song(2, 'two')]))
+    connection.reload()
+
+    # the server was restarted
+    connection, database = connect(daapclient, 1,
+        FakeListing([song(1, 'uno')]))
+    connection.reload()
+    assert database.requests == [(1, None)]
+    assert titles(connection) == [u'uno']
+
+
+def test_snapshot_damaged(daapclient):
+    connection, database = connect(daapclient, 3)
+    os.makedirs(os.path.dirname(connection.location))
+    with open(connection.location, 'wb') as f:
+        f.write('garbage')
+    connection.load_snapshot()
+    assert connection.revision is None
+    assert connection.items == {}
@@ -0,0 +1,187 @@
+import gzip
+import imp
+import os
+import sys
+from cStringIO import StringIO
+
+import pytest
+
+from xl.trax import track
+from xl.trax import trackdb
+
+PLUGIN = os.path.join(os.path.dirname(__file__), '..', '..', 'plugins',
+    'daapserver')
+sys.path.insert(0, PLUGIN)
+daapserver = imp.load_source('daapserver', os.path.join(PLUGIN,
+    '__init__.py'))
+from spydaap.daap import DAAPObject
+from spydaap import server
+
+
+def make_track(name):
+    tr = track.Track('file:///daapserver/%s.mp3' % name, scan=False)
+    tr.set_tag_raw('title', name)
+    tr.set_tag_raw('__length', 100)
+    return tr
+
+
+@pytest.fixture
+def wrapper():
+    db = trackdb.TrackDB('daap')
+    db.add_tracks([make_track(name) for name in ['a', 'b', 'c']])
+    wrapper = daapserver.CollectionWrapper(db)
+    # the events are passed by the tests
+    wrapper.close()
+    return wrapper
+
+
+def parse(data):
+    response = DAAPObject()
+    response.processData(StringIO(data))
+    return response
+
+
+def listing(response):
+    """
+        Returns the update type, the names of the listed tracks and the
+        removed ids of a response
+    """
+    names = sorted(item.getAtom('minm')
+        for item in response.getAtom('mlcl').contains)
+    deleted = response.getAtom('mudl')
+    deleted = sorted(a.value for a in deleted.contains) if deleted else []
+    return response.getAtom('muty') or 0, names, deleted
+
+
+def ids(wrapper):
+    return dict((w.track.get_tag_raw('title')[0], w.id) for w in wrapper)
+
+
+def add(wrapper, name):
+    tr = make_track(name)
+    wrapper.collection.add_tracks([tr])
+    wrapper.on_tracks_changed([('tracks_added', wrapper.collection,
+        [tr.get_loc_for_io()])])
+    return tr
+
+
+def remove(wrapper, name):
+    tr = wrapper.collection.get_track_by_loc(
+        'file:///daapserver/%s.mp3' % name)
+    wrapper.collection.remove_tracks([tr])
+    wrapper.on_tracks_changed([('tracks_removed', wrapper.collection,
+        [tr.get_loc_for_io()])])
+
+
+def retag(wrapper, name, tag, value):
+    tr = wrapper.collection.get_track_by_loc(
+        'file:///daapserver/%s.mp3' % name)
+    tr.set_tag_raw(tag, value)
+    wrapper.on_tracks_changed([('track_tags_changed', tr, tag)])
+
+
+def test_full_listing(wrapper):
+    response = parse(wrapper.get_item_list())
+    assert listing(response) == (0, [u'a', u'b', u'c'], [])
+    assert response.getAtom('mtco') == 3
+
+
+def test_delta_listing(wrapper):
+    wrapper.get_item_list()
+    revision = wrapper.revision
+    known = ids(wrapper)
+
+    add(wrapper, 'd')
+    remove(wrapper, 'b')
+    retag(wrapper, 'c', 'title', u'C')
+    # not part of the listing items
+    retag(wrapper, 'a', '__playcount', 5)
+    assert wrapper.revision == revision + 3
+
+    response = parse(wrapper.get_item_list(delta=revision))
+    assert listing(response) == (1, [u'C', u'd'], [known['b']])
+    # ids are kept across changes
+    assert ids(wrapper)['C'] == known['c']
+
+    # only the last change
+    response = parse(wrapper.get_item_list(delta=revision + 2))
+    assert listing(response) == (1, [u'C'], [])
+
+    response = parse(wrapper.get_item_list(delta=wrapper.revision))
+    assert listing(response) == (1, [], [])
+
+
+def test_added_and_removed(wrapper):
+    wrapper.get_item_list()
+    revision = wrapper.revision
+    add(wrapper, 'd')
+    d = ids(wrapper)['d']
+    remove(wrapper, 'd')
+    response = parse(wrapper.get_item_list(delta=revision))
+    assert listing(response) == (1, [], [d])
+
+
+def test_unknown_revision(wrapper):
+    wrapper.max_changes = 2
+    wrapper.get_item_list()
+    revision = wrapper.revision
+    for name in ['d', 'e', 'f']:
+        add(wrapper, name)
+    # the changes since then are forgotten
+    response = parse(wrapper.get_item_list(delta=revision))
+    assert listing(response)[0] == 0
+    assert len(listing(response)[1]) == 6
+
+    response = parse(wrapper.get_item_list(delta=revision + 1))
+    assert listing(response) == (1, [u'e', u'f'], [])
+
+
+def test_responses_cached(wrapper):
+    data = wrapper.get_item_list()
+    assert wrapper.get_item_list() is data
+
+    compressed = wrapper.get_item_list(compress=True)
+    assert wrapper.get_item_list(compress=True) is compressed
+    assert gzip.GzipFile(fileobj=StringIO(compressed)).read() == data
+
+    revision = wrapper.revision
+    delta = wrapper.get_item_list(delta=revision)
+    assert wrapper.get_item_list(delta=revision) is delta
+
+    retag(wrapper, 'a', 'title', u'A')
+    new = wrapper.get_item_list()
+    assert new is not data
+    assert listing(parse(new)) == (0, [u'A', u'b', u'c'], [])
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-', (0, 999)),
+    ('bytes=100-199', (100, 199)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=900-5000', (900, 999)),
+    (' bytes=10-10 ', (10, 10)),
+    # suffix ranges
+    ('bytes=-100', (900, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=-0', None),
+    ('bytes=-', None),
+    ('bytes=200-100', None),
+    ('bytes=1000-', None),
+    ('bytes=0-10,20-30', None),
+    ('items=0-10', None),
+])
+def test_parse_range(header, expected):
+    assert server.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('/music/song.mp3', 'audio/mpeg'),
+    ('/music/SONG.FLAC', 'audio/flac'),
+    ('/music/song.m4a', 'audio/mp4'),
+    ('/music/song.opus', 'audio/ogg'),
+    ('/music/notes.txt', 'text/plain'),
+    ('/music/song.unknown', 'application/octet-stream'),
+    ('/music/song', 'application/octet-stream'),
+])
+def test_get_audio_type(filename, expected):
+    assert server.get_audio_type(filename) == expected
@@ -0,0 +1,205 @@
+import os
+import Queue
+import shutil
+
+from gi.repository import Gio
+
+import pytest
+
+from xl import collection
+from xl import xdg
+from xl.trax import track
+
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data', 'music',
+    'testartist')
+
+
+@pytest.yield_fixture
+def library(tmpdir, monkeypatch):
+    monkeypatch.setattr(xdg, 'get_cache_dir',
+        lambda: str(tmpdir.join('cache')))
+    location = str(tmpdir.join('music'))
+    shutil.copytree(DATA, location)
+    with open(os.path.join(location, 'first', 'cover.jpg'), 'wb') as f:
+        f.write('not a track')
+
+    coll = collection.Collection('test', location=str(tmpdir.join('db')))
+    lib = collection.Library(Gio.File.new_for_path(location).get_uri())
+    coll.add_library(lib)
+    yield lib
+    coll.close()
+
+
+def path_uri(lib, *names):
+    path = os.path.join(Gio.File.new_for_uri(lib.location).get_path(),
+        *names)
+    return Gio.File.new_for_path(path).get_uri()
+
+
+def locations(lib):
+    return sorted(lib.collection.tracks)
+
+
+def test_rescan_finds_tracks(library):
+    library.rescan()
+    assert locations(library) == sorted([
+        path_uri(library, 'first', '1-black.ogg'),
+        path_uri(library, 'first', '2-white.ogg'),
+        path_uri(library, 'second', '1-woot.ogg'),
+        path_uri(library, 'second', '2-foo.ogg'),
+        path_uri(library, 'second', '3-baz.ogg'),
+    ])
+
+
+def test_rescan_skips_unchanged_directories(library, monkeypatch):
+    library.rescan()
+    cache = library._load_directory_cache()
+    files = [f for mtime, subdirs, fs in cache.itervalues() for f in fs]
+    assert len(files) == 5
+    assert path_uri(library, 'first', 'cover.jpg') not in files
+
+    walked = []
+    read = []
+    walk_children = collection.common.walk_children
+    monkeypatch.setattr(collection.common, 'walk_children',
+        lambda dir, root: walked.append(dir) or walk_children(dir, root))
+    monkeypatch.setattr(collection.Library, '_read_track',
+        lambda self, uri, mtime, force: read.append(uri))
+    library.rescan()
+    assert walked == []
+    assert read == []
+    assert len(library.collection) == 5
+
+
+def test_rescan_removes_missing_tracks(library):
+    library.rescan()
+    os.remove(Gio.File.new_for_uri(
+        path_uri(library, 'second', '2-foo.ogg')).get_path())
+    shutil.rmtree(Gio.File.new_for_uri(path_uri(library, 'first')).get_path())
+    library.rescan()
+    assert locations(library) == sorted([
+        path_uri(library, 'second', '1-woot.ogg'),
+        path_uri(library, 'second', '3-baz.ogg'),
+    ])
+
+
+def test_rescan_stopped(library):
+    library.rescan()
+    os.remove(Gio.File.new_for_uri(
+        path_uri(library, 'second', '2-foo.ogg')).get_path())
+    library.collection.stop_scan()
+    library.rescan()
+    assert len(library.collection) == 5
+    assert not library.scanning
+
+
+def test_rescan_aborted(library, monkeypatch):
+    library.rescan()
+    os.remove(Gio.File.new_for_uri(
+        path_uri(library, 'second', '2-foo.ogg')).get_path())
+
+    def fail(dir, root):
+        raise ValueError(dir)
+    monkeypatch.setattr(collection.common, 'walk_children', fail)
+    library.rescan(force_update=True)
+    # what wasn't seen is not removed
+    assert len(library.collection) == 5
+    assert not library.scanning
+
+
+def make_track(name, artist, album, basedir):
+    tr = track.Track('http://collection/%s/%s.ogg' % (basedir, name),
+        scan=False)
+    tr.set_tag_raw('artist', artist)
+    tr.set_tag_raw('album', album)
+    tr.set_tag_raw('__basedir', basedir)
+    return tr
+
+
+def commit(lib, directories, batch_size=200):
+    """
+        Runs the committer on the given (directory, tracks) pairs, with
+        all tracks new to the collection
+    """
+    results = Queue.Queue()
+    for directory, tracks in directories:
+        directory.changed = True
+        for tr in tracks:
+            directory.submitted += 1
+            results.put((collection._SCAN_FILE, directory, tr, True))
+        results.put((collection._SCAN_DIRECTORY_DONE, directory, None, False))
+    results.put(None)
+    return lib._scan_commit(results, None, batch_size)
+
+
+def test_commit_adds_tracks_in_batches(library, monkeypatch):
+    batches = []
+    monkeypatch.setattr(library.collection, 'add_tracks',
+        lambda tracks: batches.append(len(tracks)))
+    tracks = [make_track('t%d' % i, u'a', u'b%d' % i, '/d') for i in range(5)]
+    count = commit(library, [(collection._ScanDirectory(), tracks)], 2)
+    # directories are not counted
+    assert count == 5
+    assert batches == [2, 2, 1]
+
+
+def test_commit_detects_compilations_per_directory(library):
+    various = [
+        make_track('1', u'Someone', u'Hits', '/various'),
+        make_track('2', u'Someone else', u'Hits', '/various'),
+    ]
+    single = [
+        make_track('1', u'Someone', u'Hits', '/single'),
+        make_track('2', u'Someone', u'Hits', '/single'),
+    ]
+    commit(library, [
+        (collection._ScanDirectory(), various),
+        (collection._ScanDirectory(), single),
+    ])
+    for tr in various:
+        assert tr.get_tag_raw('__compilation') == ('/various', u'hits')
+    for tr in single:
+        assert tr.get_tag_raw('__compilation') is None
+    assert len(library.collection) == 4
+
+
+def test_commit_stopped(library, monkeypatch):
+    batches = []
+    monkeypatch.setattr(library.collection, 'add_tracks',
+        lambda tracks: batches.append(len(tracks)))
+    library.collection.stop_scan()
+    tracks = [make_track('t', u'a', u'b', '/d')]
+    assert commit(library, [(collection._ScanDirectory(), tracks)]) is None
+    assert batches == []
+
+
+def test_monitor_coalesces_changes(library, monkeypatch):
+    monitor = library.monitor
+    processed = []
+    monkeypatch.setattr(monitor, '_LibraryMonitor__process_changes',
+        processed.append)
+    monkeypatch.setattr(collection.LibraryMonitor,
+        '_LibraryMonitor__get_delay', lambda self: 0)
+
+    created = Gio.File.new_for_uri(path_uri(library, 'new.ogg'))
+    replaced = Gio.File.new_for_uri(path_uri(library, 'first', '1-black.ogg'))
+    monitor.on_location_changed(None, created, None,
+        Gio.FileMonitorEvent.CREATED)
+    monitor.on_location_changed(None, replaced, None,
+        Gio.FileMonitorEvent.DELETED)
+    monitor.on_location_changed(None, created, None,
+        Gio.FileMonitorEvent.CHANGED)
+    monitor.on_location_changed(None, created, None,
+        Gio.FileMonitorEvent.DELETED)
+    monitor.on_location_changed(None, replaced, None,
+        Gio.FileMonitorEvent.CREATED)
+
+    assert monitor._LibraryMonitor__on_queue_timeout() is False
+    assert len(processed) == 1
+    changes = dict((gfile.get_uri(), change)
+        for gfile, change in processed[0].iteritems())
+    assert changes == {
+        created.get_uri(): collection._CHANGE_REMOVED,
+        replaced.get_uri(): collection._CHANGE_UPDATED,
+    }
@@ -0,0 +1,93 @@
+import os
+import time
+
+import pytest
+
+from xl import common
+
+
+@pytest.fixture
+def location(tmpdir):
+    return os.path.join(str(tmpdir), 'cache.db')
+
+
+def test_persistent_cache_batches_writes(location):
+    cache = common.PersistentCache(location, batch_size=3, sync_delay=60)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert not os.path.exists(location)
+    cache['c'] = 3
+    assert os.path.exists(location)
+
+    cache['a'] = 4
+    del cache['b']
+    cache.flush()
+    cache = common.PersistentCache(location)
+    assert sorted(cache.keys()) == ['a', 'c']
+    assert cache['a'] == 4
+    assert 'b' not in cache
+
+
+def test_persistent_cache_expires(location):
+    cache = common.PersistentCache(location, ttl=60)
+    cache['a'] = 1
+    cache.set('b', 2, ttl=0.05)
+    time.sleep(0.1)
+    assert cache['a'] == 1
+    assert cache.get('b') is None
+    assert 'b' not in cache
+    with pytest.raises(KeyError):
+        cache['b']
+
+    cache.flush()
+    assert common.PersistentCache(location).keys() == ['a']
+
+
+def test_persistent_cache_evicts_least_recently_used(location):
+    cache = common.PersistentCache(location, max_entries=10)
+    for i in range(10):
+        cache[i] = i
+    time.sleep(0.01)
+    cache.get(0)
+    cache[10] = 10
+    assert len(cache) == 9
+    assert 0 in cache and 10 in cache
+    assert 1 not in cache and 2 not in cache
+
+    cache.flush()
+    assert sorted(common.PersistentCache(location).keys()) == \
+        sorted(cache.keys())
+
+
+def test_persistent_cache_rewrites_file(location):
+    cache = common.PersistentCache(location, batch_size=10)
+    for i in range(1000):
+        cache['a'] = i
+    cache.flush()
+    assert os.path.getsize(location) < 1000
+    assert common.PersistentCache(location)['a'] == 999
+
+
+def test_persistent_cache_damaged_file(location):
+    cache = common.PersistentCache(location)
+    cache['a'] = 1
+    cache.flush()
+    with open(location, 'ab') as f:
+        f.write('\x80\x02(garbage')
+    cache = common.PersistentCache(location)
+    assert cache['a'] == 1
+    cache['b'] = 2
+    cache.flush()
+    assert sorted(common.PersistentCache(location).keys()) == ['a', 'b']
+
+
+def test_persistent_cache_keeps_changes_on_failure(tmpdir):
+    location = os.path.join(str(tmpdir), 'missing', 'cache.db')
+    cache = common.PersistentCache(location, sync_delay=60)
+    cache['a'] = 1
+    cache['b'] = 2
+    cache.flush()
+    assert not os.path.exists(location)
+    os.mkdir(os.path.dirname(location))
+    cache.flush()
+    assert sorted(common.PersistentCache(location).keys()) == ['a', 'b']
@@ -0,0 +1,176 @@
+import os
+
+import pytest
+
+from xl import covers
+from xl.trax import track
+
+
+def set_used(cacher, key, when):
+    """
+        Sets when an entry was last used, as remembered between runs
+    """
+    path = os.path.join(cacher.cache_dir, key)
+    os.utime(path, (when, when))
+
+
+@pytest.fixture
+def cache_dir(tmpdir):
+    return str(tmpdir.join('cache'))
+
+
+def test_cacher_add_get(cache_dir):
+    cacher = covers.Cacher(cache_dir)
+    key = cacher.add('data')
+    assert cacher.get(key) == 'data'
+    assert cacher.add('data') == key
+    assert cacher.add('other', 'name') == 'name'
+    assert cacher.get('name') == 'other'
+    cacher.remove('name')
+    assert cacher.get('name') is None
+
+
+def test_cacher_removes_least_recently_used(cache_dir):
+    removed = []
+    cacher = covers.Cacher(cache_dir, 25, removed.extend)
+    cacher.add('a' * 10, 'a')
+    cacher.add('b' * 10, 'b')
+    cacher.get('a')
+    cacher.add('c' * 10, 'c')
+    assert removed == ['b']
+    assert cacher.get('b') is None
+    assert cacher.get('a') == 'a' * 10
+
+    cacher.set_max_size(10)
+    assert removed == ['b', 'c']
+    assert cacher.get('a') == 'a' * 10
+
+
+def test_cacher_keeps_entry_larger_than_max_size(cache_dir):
+    cacher = covers.Cacher(cache_dir, 5)
+    cacher.add('a' * 10, 'a')
+    assert cacher.get('a') == 'a' * 10
+
+
+def test_cacher_order_kept_across_runs(cache_dir):
+    cacher = covers.Cacher(cache_dir)
+    for i, key in enumerate(['c', 'a', 'b']):
+        cacher.add(key * 10, key)
+        set_used(cacher, key, 1000000 + i)
+
+    removed = []
+    cacher = covers.Cacher(cache_dir, 25, removed.extend)
+    cacher.add('d' * 10, 'd')
+    assert removed == ['c', 'a']
+
+
+def test_cacher_never_removes_pinned(cache_dir):
+    removed = []
+    cacher = covers.Cacher(cache_dir, 25, removed.extend)
+    cacher.add('a' * 10, 'a', pinned=True)
+    cacher.add('b' * 10, 'b')
+    cacher.add('c' * 10, 'c')
+    # pinned entries don't count towards the size
+    assert removed == []
+    cacher.add('d' * 10, 'd')
+    assert removed == ['b']
+    assert cacher.is_pinned('a')
+    assert cacher.get('a') == 'a' * 10
+
+    # pins are kept across runs
+    set_used(cacher, 'a', 1)
+    removed = []
+    cacher = covers.Cacher(cache_dir, 10, removed.extend)
+    assert cacher.is_pinned('a')
+    cacher.add('e' * 10, 'e')
+    assert sorted(removed) == ['c', 'd']
+    assert cacher.get('a') == 'a' * 10
+
+    # unpinned entries are removed first
+    cacher.set_max_size(15)
+    cacher.unpin('a')
+    assert not cacher.is_pinned('a')
+    assert cacher.get('a') is None
+    assert cacher.get('e') == 'e' * 10
+    assert not covers.Cacher(cache_dir).is_pinned('a')
+
+
+class _CachedMethod(covers.CoverSearchMethod):
+    name = 'cachedtest'
+    use_cache = True
+
+
+def make_track(album):
+    tr = track.Track('file:///covers/%s.ogg' % album, scan=False)
+    tr.set_tag_raw('album', album)
+    return tr
+
+
+@pytest.fixture
+def manager(tmpdir):
+    manager = covers.CoverManager(str(tmpdir.join('covers')))
+    manager.on_provider_added(_CachedMethod())
+    return manager
+
+
+def test_user_covers_never_removed(manager):
+    chosen = make_track(u'chosen')
+    found = make_track(u'found')
+    cache = manager._CoverManager__cache
+    manager.set_cover(chosen, 'cachedtest:1', 'a' * 10)
+    manager.set_cover(found, 'cachedtest:2', 'b' * 10, automatic=True)
+    cache.set_max_size(5)
+
+    # the album forgets about the removed cover
+    assert manager.get_db_string(found) is None
+    assert manager.get_cover_data(manager.get_db_string(chosen)) == 'a' * 10
+
+    # unused user covers can be removed
+    cache.set_max_size(15)
+    manager.set_cover(chosen, 'cachedtest:3', 'c' * 10, automatic=True)
+    assert manager.get_db_string(chosen) is not None
+    assert cache.get(covers.hashlib.sha256('a' * 10).hexdigest()) is None
+
+
+def test_db_kept_across_runs(manager, tmpdir):
+    first = make_track(u'first')
+    second = make_track(u'second')
+    manager.set_cover(first, 'cachedtest:1', 'a' * 10)
+    manager.set_cover(second, 'cachedtest:2', 'b' * 10)
+    manager.save()
+    manager.remove_cover(second)
+    manager.set_cover(first, 'cachedtest:3', 'c' * 10)
+    # appended to the log
+    manager.save()
+    db_string = manager.get_db_string(first)
+
+    other = covers.CoverManager(manager.location)
+    assert other.db == manager.db
+    assert other.get_db_string(first) == db_string
+    assert other.get_db_string(second) is None
+    assert other.get_cover_data(db_string) == 'c' * 10
+
+
+def test_db_damaged_log(manager):
+    first = make_track(u'first')
+    manager.set_cover(first, 'cachedtest:1', 'a' * 10)
+    manager.save()
+    log = os.path.join(manager.location, 'covers.db.log')
+    with open(log, 'ab') as f:
+        f.write('garbage')
+
+    other = covers.CoverManager(manager.location)
+    assert other.get_db_string(first) == manager.get_db_string(first)
+
+
+def test_thumbnails(manager):
+    tr = make_track(u'album')
+    manager.set_cover(tr, 'cachedtest:1', 'a' * 10)
+    db_string = manager.get_db_string(tr)
+    manager.set_thumbnail_data(db_string, 64, 'thumb')
+    assert manager.get_thumbnail_data(db_string, 64) == 'thumb'
+    assert manager.get_thumbnail_data(db_string, 32) is None
+
+    # thumbnails go away with the cover
+    manager.set_cover(tr, 'cachedtest:2', 'b' * 10)
+    assert manager.get_thumbnail_data(db_string, 64) is None
@@ -95,3 +95,90 @@ def test_thread_events():
     _finish_events()
     
     
+    
+def test_thread_event_counts():
+    
+    _init_events()
+    ncb = NormalCallback()
+    
+    def _run():
+        for i in range(200):
+            event.log_event('test', ncb, i)
+    
+    threads = [threading.Thread(target=_run) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert event.EVENT_MANAGER.emitted['test'] == 1600
+    assert event.EVENT_MANAGER.dispatched['test'] == 1600
+    
+    ncb.destroy()
+    _finish_events()
+    
+class BatchCallback(object):
+    
+    def __init__(self, coalesce):
+        self.batches = []
+        event.add_batch_callback(self.on_cb, 'test', coalesce=coalesce)
+        
+    def destroy(self):
+        event.remove_callback(self.on_cb, 'test')
+    
+    def on_cb(self, events):
+        assert on_ui_thread[0]
+        self.batches.append(events)
+
+class Sender(object):
+    pass
+
+def test_batch_events():
+    _init_events()
+    bcb = BatchCallback(False)
+    sender = Sender()
+    
+    pending = []
+    GLib.idle_add = lambda fn, *args: pending.append((fn, args))
+    try:
+        on_ui_thread[0] = False
+        event.log_event('test', sender, 1)
+        event.log_event('other', sender, 2)
+        event.log_event('test', sender, 3)
+        assert bcb.batches == []
+        assert len(pending) == 1
+    finally:
+        GLib.idle_add = glib_idle_add
+    
+    for fn, args in pending:
+        glib_idle_add(fn, *args)
+    
+    assert bcb.batches == [[('test', sender, 1), ('test', sender, 3)]]
+    assert event.EVENT_MANAGER.emitted['test'] == 2
+    assert event.EVENT_MANAGER.dispatched['test'] == 2
+    
+    bcb.destroy()
+    _finish_events()
+
+def test_coalesced_batch_events():
+    _init_events()
+    bcb = BatchCallback(True)
+    first, second = Sender(), Sender()
+    
+    pending = []
+    GLib.idle_add = lambda fn, *args: pending.append((fn, args))
+    try:
+        event.log_event('test', first, 1)
+        event.log_event('test', second, 2)
+        event.log_event('test', first, 3)
+    finally:
+        GLib.idle_add = glib_idle_add
+    
+    for fn, args in pending:
+        glib_idle_add(fn, *args)
+    
+    assert bcb.batches == [[('test', first, 3), ('test', second, 2)]]
+    
+    bcb.destroy()
+    _finish_events()
+    assert not event.EVENT_MANAGER.batch_callbacks
@@ -0,0 +1,109 @@
+# -*- coding: utf-8
+
+import pytest
+
+from xl import formatter
+from xl import providers
+from xl import trax
+
+
+@pytest.fixture
+def track():
+    tr = trax.Track('file:///formatter/test.ogg', scan=False)
+    tr.set_tag_raw('artist', u'Björk')
+    tr.set_tag_raw('title', u'Jóga')
+    tr.set_tag_raw('tracknumber', u'3/10')
+    tr.set_tag_raw('__length', 200)
+    return tr
+
+
+class _TitleTagFormatter(formatter.TagFormatter):
+    def __init__(self):
+        formatter.TagFormatter.__init__(self, 'title')
+        self.calls = 0
+
+    def format(self, track, parameters):
+        self.calls += 1
+        return u'title of %s' % track.get_tag_raw('artist', join=True)
+
+
+@pytest.mark.parametrize('format, expected', [
+    (u'$title', u'Jóga'),
+    (u'${title}', u'Jóga'),
+    (u'$$title', u'$title'),
+    (u'$artist - $title', u'Björk - Jóga'),
+    (u'${tracknumber:pad=3, padstring=0}', u'003'),
+    (u'${album:prefix=[, suffix=]}$title', u'Jóga'),
+    (u'${artist:prefix=[, suffix=]}', u'[Björk]'),
+    (u'${__length:format=long}', u'3m, 20s'),
+    (u'$', u'$'),
+    (u'', u''),
+])
+def test_track_formatter(track, format, expected):
+    assert formatter.TrackFormatter(format).format(track) == expected
+
+
+def test_extract():
+    f = formatter.Formatter(u'$a ${b:x=1, y} ${b:x=1, y}')
+    extractions = f.extract()
+    assert extractions == {
+        u'a': (u'a', {}),
+        u'b:x=1, y': (u'b', {u'x': u'1', u'y': True}),
+    }
+    # the result is a copy
+    extractions[u'b:x=1, y'][1].clear()
+    assert f.extract()[u'b:x=1, y'][1] == {u'x': u'1', u'y': True}
+
+
+def test_format_change(track):
+    f = formatter.TrackFormatter(u'$title', cache=True)
+    assert f.format(track) == u'Jóga'
+    f._template.template = u'$artist'
+    assert f.format(track) == u'Björk'
+
+
+def test_render_cache(track):
+    provider = _TitleTagFormatter()
+    provider.cacheable = True
+    providers.register('tag-formatting', provider)
+    try:
+        f = formatter.TrackFormatter(u'$title', cache=True)
+        assert f.format(track) == u'title of Björk'
+        assert f.format(track) == u'title of Björk'
+        assert provider.calls == 1
+
+        track.set_tag_raw('artist', u'Sigur Rós')
+        assert f.format(track) == u'title of Sigur Rós'
+        assert provider.calls == 2
+    finally:
+        providers.unregister('tag-formatting', provider)
+
+
+def test_render_cache_not_cacheable(track):
+    # providers are not cached unless they say so
+    provider = _TitleTagFormatter()
+    providers.register('tag-formatting', provider)
+    try:
+        f = formatter.TrackFormatter(u'$title', cache=True)
+        f.format(track)
+        f.format(track)
+        assert provider.calls == 2
+    finally:
+        providers.unregister('tag-formatting', provider)
+
+
+def test_render_cache_comment(track, monkeypatch):
+    reads = []
+    def get_tag_disk(self, tag):
+        reads.append(tag)
+        return [u'a comment']
+    monkeypatch.setattr(trax.Track, 'get_tag_disk', get_tag_disk)
+    f = formatter.TrackFormatter(u'$comment', cache=True)
+    assert f.format(track) == u'a comment'
+    assert f.format(track) == u'a comment'
+    assert reads == ['comment']
+
+    # the file was read again
+    track.set_tag_raw('__modified', 1)
+    f.format(track)
+    assert reads == ['comment', 'comment']
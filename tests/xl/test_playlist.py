@@ -0,0 +1,280 @@
+import os
+import time
+
+from xl import playlist
+from xl.trax import track
+from xl.trax import trackdb
+
+
+def make_tracks(names, album=None):
+    tracks = []
+    for i, name in enumerate(names):
+        tr = track.Track('http://playlist/%s.ogg' % name, scan=False)
+        tr.set_tag_raw('title', name)
+        tr.set_tag_raw('album', album or name[0])
+        tr.set_tag_raw('tracknumber', u'%d' % (i + 1))
+        tracks.append(tr)
+    return tracks
+
+
+def shuffled(names, mode='track'):
+    pl = playlist.Playlist('test', make_tracks(names))
+    pl.shuffle_mode = mode
+    return pl
+
+
+def played(pl):
+    return sorted(tr.get_tag_raw('title')[0]
+        for i, tr in pl.get_shuffle_history())
+
+
+def check_index(pl):
+    """
+        Compares the kept shuffle index with one built from scratch
+    """
+    index = pl._Playlist__shuffle_index
+    if index is None:
+        return
+    fresh = playlist._ShuffleIndex(pl._Playlist__tracks)
+    assert sorted(index.unplayed) == sorted(fresh.unplayed)
+    assert index.played == fresh.played
+
+
+def play_all(pl):
+    titles = []
+    tr = pl.current
+    while tr is not None:
+        titles.append(tr.get_tag_raw('title')[0])
+        check_index(pl)
+        tr = pl.next()
+    return titles
+
+
+def test_shuffle_plays_every_track_once():
+    names = ['a%d' % i for i in range(20)]
+    pl = shuffled(names)
+    pl.next()
+    assert sorted(play_all(pl)) == sorted(names)
+
+
+def test_shuffle_across_insert():
+    pl = shuffled(['a', 'b', 'c', 'd'])
+    pl.next()
+    second = pl.next()
+    assert pl._Playlist__shuffle_index is not None
+    pl[0:0] = make_tracks(['x', 'y'])
+    pl.append(make_tracks(['z'])[0])
+    check_index(pl)
+    assert pl.current is second
+    history = played(pl)
+    assert len(history) == 1
+
+    assert sorted(history + play_all(pl)) == \
+        ['a', 'b', 'c', 'd', 'x', 'y', 'z']
+
+
+def test_shuffle_across_delete():
+    pl = shuffled(['a', 'b', 'c', 'd', 'e', 'f'])
+    pl.next()
+    pl.next()
+    current = pl.next()
+    history = played(pl)
+    unplayed = [tr for tr in pl if tr is not current and
+        tr.get_tag_raw('title')[0] not in history]
+    del pl[pl.index(unplayed[0])]
+    del pl[pl.index(unplayed[1])]
+    check_index(pl)
+    assert pl.current is current
+    assert played(pl) == history
+
+    titles = play_all(pl)
+    assert sorted(history + titles) == \
+        sorted(tr.get_tag_raw('title')[0] for tr in pl)
+
+
+def test_shuffle_across_reorder():
+    pl = shuffled(['a', 'b', 'c', 'd', 'e'])
+    pl.next()
+    pl.next()
+    before = played(pl)
+    # move the last track to the front with its metadata
+    moved = pl[-1:]
+    del pl[-1:]
+    pl[0:0] = moved
+    check_index(pl)
+    assert played(pl) == before
+    # swap two tracks through an extended slice
+    pl[0:4:3] = pl[3::-3]
+    check_index(pl)
+    assert played(pl) == before
+
+
+def test_prev_goes_to_last_played_position():
+    pl = shuffled(['a', 'b', 'c', 'd', 'e'])
+    pl.next()
+    pl.next()
+    pl.next()
+    positions = [i for i, tr in pl.get_shuffle_history()]
+    pl[0:0] = make_tracks(['x'])
+    assert pl.prev() is pl[max(positions) + 1]
+    check_index(pl)
+    assert len(pl.get_shuffle_history()) == len(positions) - 1
+
+
+def test_album_shuffle_across_insert():
+    pl = playlist.Playlist('test',
+        make_tracks(['a1', 'a2', 'a3'], u'A') +
+        make_tracks(['b1', 'b2'], u'B'))
+    pl.shuffle_mode = 'album'
+    pl.next()
+    pl[0:0] = make_tracks(['c1', 'c2'], u'C')
+    check_index(pl)
+    titles = [pl.current.get_tag_raw('title')[0]] + play_all(pl)[1:]
+    assert sorted(set(titles)) == sorted(titles)
+    for album in 'ABC':
+        on_album = [t for t in titles if t[0] == album.lower()]
+        assert on_album == sorted(on_album)
+
+
+def uris(pl):
+    return [tr.get_loc_for_io() for tr in pl]
+
+
+def loaded(location):
+    pl = playlist.Playlist('loaded')
+    pl.load_from_location(location)
+    return pl
+
+
+def record_kinds(location):
+    with open(location, 'rb') as f:
+        assert f.read(len(playlist._PLAYLIST_MAGIC)) == \
+            playlist._PLAYLIST_MAGIC
+        return [kind for kind, data in playlist._read_records(f)]
+
+
+def test_journal_replay(tmpdir):
+    location = str(tmpdir.join('playlist'))
+    pl = playlist.Playlist('test', make_tracks(['a%d' % i for i in range(10)]))
+    pl.save_to_location(location)
+    assert record_kinds(location) == ['T', 'A']
+    with open(location, 'rb') as f:
+        full = f.read()
+
+    pl.append(make_tracks(['d'])[0])
+    del pl[1]
+    pl[0:0] = make_tracks(['e', 'f'])
+    pl.shuffle_mode = 'track'
+    pl.save_to_location(location)
+    with open(location, 'rb') as f:
+        assert f.read(len(full)) == full
+    assert record_kinds(location) == ['T', 'A', 'T', 'R', 'T', 'A']
+
+    other = loaded(location)
+    assert uris(other) == uris(pl)
+    assert other.shuffle_mode == 'track'
+
+
+def test_journal_rewrite_when_large(tmpdir):
+    location = str(tmpdir.join('playlist'))
+    pl = playlist.Playlist('test', make_tracks(['a']))
+    pl.save_to_location(location)
+    pl.extend(make_tracks(['b%d' % i for i in range(10)]))
+    pl.save_to_location(location)
+    assert record_kinds(location) == ['T', 'A']
+    assert uris(loaded(location)) == uris(pl)
+
+
+def test_journal_truncated_record(tmpdir):
+    location = str(tmpdir.join('playlist'))
+    pl = playlist.Playlist('test', make_tracks(['a', 'b']))
+    pl.save_to_location(location)
+    expected = uris(pl)
+    pl.append(make_tracks(['c'])[0])
+    pl.save_to_location(location)
+    assert record_kinds(location) == ['T', 'A', 'T']
+    with open(location, 'r+b') as f:
+        f.truncate(os.path.getsize(location) - 3)
+
+    other = loaded(location)
+    assert uris(other) == expected
+    # appending after the incomplete record would lose the changes
+    other.append(make_tracks(['d'])[0])
+    other.save_to_location(location)
+    assert record_kinds(location) == ['T', 'A']
+    assert uris(loaded(location)) == expected + ['http://playlist/d.ogg']
+
+
+def test_journal_file_changed(tmpdir):
+    location = str(tmpdir.join('playlist'))
+    pl = playlist.Playlist('test', make_tracks(['a', 'b']))
+    pl.save_to_location(location)
+    playlist.Playlist('other', make_tracks(['x', 'y', 'z'])) \
+        .save_to_location(location)
+
+    pl.append(make_tracks(['c'])[0])
+    pl.save_to_location(location)
+    assert record_kinds(location) == ['T', 'A']
+    assert uris(loaded(location)) == uris(pl)
+
+
+def test_load_legacy_format(tmpdir):
+    location = str(tmpdir.join('playlist'))
+    with open(location, 'w') as f:
+        f.write('http://playlist/legacy1.ogg\tartist=Someone&title=Song\n')
+        f.write('http://playlist/legacy2.ogg\n')
+        f.write('EOF\n')
+        f.write('shuffle_mode=S: album\n')
+        f.write('repeat_mode=S: playlist\n')
+        f.write('name=S: Old\n')
+
+    pl = loaded(location)
+    assert uris(pl) == ['http://playlist/legacy1.ogg',
+        'http://playlist/legacy2.ogg']
+    assert pl[0].get_tag_raw('artist') == [u'Someone']
+    assert pl[0].get_tag_raw('title') == [u'Song']
+    assert pl.shuffle_mode == 'album'
+    assert pl.repeat_mode == 'all'
+    assert pl.name == 'Old'
+
+    # the next save writes the current format
+    pl.append(make_tracks(['new'])[0])
+    pl.save_to_location(location)
+    assert record_kinds(location) == ['T', 'A']
+    assert uris(loaded(location)) == uris(pl)
+
+
+def smart_collection():
+    db = trackdb.TrackDB('smart')
+    tracks = make_tracks(['s1', 's2', 's3'], u'Smart')
+    tracks[0].set_tag_raw('__last_played', time.time() - 3600)
+    tracks[1].set_tag_raw('__last_played', time.time() - 3 * 86400)
+    db.add_tracks(tracks)
+    return db, tracks
+
+
+def test_smart_playlist_time_relative():
+    db, tracks = smart_collection()
+    sp = playlist.SmartPlaylist('recent', db)
+    sp.add_param('__last_played', '>=', (1, 'days'))
+    for i in range(3):
+        assert list(sp.get_playlist()) == tracks[:1]
+    # searched every time instead of kept up to date
+    assert sp._view is None
+
+
+def test_smart_playlist_view_replaced():
+    db, tracks = smart_collection()
+    sp = playlist.SmartPlaylist('album', db)
+    sp.add_param('album', '==', u'Smart')
+    assert list(sp.get_playlist()) == tracks
+    old = sp._view
+    sp.add_param('title', '!=', u's2')
+    assert list(sp.get_playlist()) == [tracks[0], tracks[2]]
+    assert sp._view is not old
+
+    # the old view no longer follows the collection
+    new = make_tracks(['s4'], u'Smart')[0]
+    db.add_tracks([new])
+    assert new not in old.get_tracks()
+    assert new in sp._view.get_tracks()
@@ -0,0 +1,131 @@
+import threading
+import time
+
+from xl import providers
+
+
+class FakeProvider(object):
+
+    def __init__(self, name, results, delay=0, local=False, timeout=None):
+        self.name = name
+        self.results = results
+        self.delay = delay
+        self.local = local
+        self.search_timeout = timeout
+        self.calls = 0
+
+    def find(self):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if isinstance(self.results, Exception):
+            raise self.results
+        return list(self.results)
+
+
+def search(searcher, key, fakes, limit=-1, refresh=False):
+    return searcher.search(key, fakes, lambda p: p.find(), limit,
+        lambda p: p.local, refresh)
+
+
+def test_local_first():
+    local = FakeProvider('local', ['l'], local=True)
+    remote = FakeProvider('remote', ['r'])
+    searcher = providers.ConcurrentSearch()
+    assert search(searcher, 'a', [remote, local], limit=1) == ['l']
+    assert remote.calls == 0
+    assert search(searcher, 'b', [remote, local]) == ['l', 'r']
+
+
+def test_results_in_provider_order():
+    slow = FakeProvider('slow', ['s'], delay=0.2)
+    fast = FakeProvider('fast', ['f'])
+    searcher = providers.ConcurrentSearch()
+    start = time.time()
+    assert search(searcher, 'a', [slow, fast], limit=1) == ['s']
+    # both were asked at the same time
+    assert fast.calls == 1
+    assert time.time() - start < 0.4
+
+
+def test_first_result_after_failures():
+    empty = FakeProvider('empty', [])
+    broken = FakeProvider('broken', ValueError('broken'))
+    found = FakeProvider('found', ['x', 'y'])
+    searcher = providers.ConcurrentSearch()
+    assert search(searcher, 'a', [empty, broken, found], limit=1) == ['x']
+
+
+def test_deadline():
+    stuck = FakeProvider('stuck', ['s'], delay=1, timeout=0.05)
+    fast = FakeProvider('fast', ['f'], delay=0.01)
+    searcher = providers.ConcurrentSearch()
+    start = time.time()
+    assert search(searcher, 'a', [stuck, fast]) == ['f']
+    assert time.time() - start < 0.5
+
+
+def test_concurrent_searches_collapse():
+    remote = FakeProvider('remote', ['r'], delay=0.1)
+    searcher = providers.ConcurrentSearch()
+    results = []
+
+    def run():
+        results.append(search(searcher, 'a', [remote]))
+
+    threads = [threading.Thread(target=run) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [['r']] * 5
+    assert remote.calls == 1
+
+
+def test_misses_remembered():
+    remote = FakeProvider('remote', [])
+    searcher = providers.ConcurrentSearch(miss_ttl=60)
+    assert search(searcher, 'a', [remote]) == []
+    assert search(searcher, 'a', [remote]) == []
+    assert remote.calls == 1
+
+    remote.results = ['r']
+    assert search(searcher, 'a', [remote], refresh=True) == ['r']
+    assert remote.calls == 2
+
+    remote.results = []
+    assert search(searcher, 'b', [remote]) == []
+    searcher.forget('b')
+    assert search(searcher, 'b', [remote]) == []
+    assert remote.calls == 4
+
+
+def test_misses_expire():
+    remote = FakeProvider('remote', [])
+    searcher = providers.ConcurrentSearch(miss_ttl=0.05)
+    search(searcher, 'a', [remote])
+    time.sleep(0.1)
+    search(searcher, 'a', [remote])
+    assert remote.calls == 2
+
+
+def test_no_more_providers_asked_after_limit():
+    first = FakeProvider('first', ['1'], delay=0.05)
+    second = FakeProvider('second', ['2'], delay=0.2)
+    rest = [FakeProvider('rest%d' % i, ['r']) for i in range(5)]
+    searcher = providers.ConcurrentSearch()
+    assert search(searcher, 'a', [first, second] + rest, limit=1) == ['1']
+    time.sleep(0.3)
+    # only max_parallel providers were asked
+    assert second.calls == 1
+    assert sum(p.calls for p in rest) == 0
+
+
+def test_worker_pool_bounded():
+    searcher = providers.ConcurrentSearch(timeout=0.05)
+    searcher.max_parallel = 10
+    searcher.max_workers = 2
+    remotes = [FakeProvider('remote%d' % i, ['r'], delay=0.1)
+        for i in range(6)]
+    search(searcher, 'a', remotes)
+    assert searcher._workers <= 2
@@ -0,0 +1,58 @@
+import pytest
+
+from xl import settings
+
+
+@pytest.fixture
+def manager():
+    return settings.SettingsManager(None)
+
+
+def test_get_option_default(manager):
+    assert manager.get_option('test/missing', 3) == 3
+    assert manager.get_option('test/missing', 4) == 4
+
+
+def test_get_option_cached(manager):
+    manager.set_option('test/value', 5)
+    assert manager.get_option('test/value') == 5
+    assert manager._cache['test/value'] == 5
+
+    manager.set_option('test/value', u'five')
+    assert manager.get_option('test/value') == u'five'
+
+    manager.remove_option('test/value')
+    assert manager.get_option('test/value', 6) == 6
+
+
+def test_get_option_copies_lists(manager):
+    manager.set_option('test/list', [1, 2])
+    manager.get_option('test/list').append(3)
+    assert manager.get_option('test/list') == [1, 2]
+
+
+def test_get_option_case(manager):
+    manager.set_option('test/value', 1)
+    assert manager.get_option('test/Value') == 1
+    manager.set_option('test/Value', 2)
+    assert manager.get_option('test/value') == 2
+    assert manager.get_option('test/Value') == 2
+
+
+def test_subscribe(manager):
+    handle = manager.subscribe('test/value', False)
+    assert handle.value is False
+
+    manager.set_option('test/value', True)
+    assert handle.value is True
+
+    manager.remove_option('test/value')
+    assert handle.value is False
+
+
+def test_subscribe_copy_settings(manager):
+    handle = manager.subscribe('test/value', 0)
+    other = settings.SettingsManager(None)
+    other.set_option('test/value', 7)
+    other.copy_settings(manager)
+    assert handle.value == 7
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from xl.startup import StartupScheduler
+
+
+def test_run_order():
+    scheduler = StartupScheduler()
+    ran = []
+    scheduler.add('b', lambda: ran.append('b'), depends=['a'])
+    scheduler.add('a', lambda: ran.append('a'))
+    scheduler.add('c', lambda: ran.append('c'), deferred=True)
+    scheduler.run()
+    assert ran == ['a', 'b']
+    assert not scheduler.is_done('c')
+
+    scheduler.run_deferred()
+    assert ran == ['a', 'b', 'c']
+
+
+def test_threaded_steps_run_concurrently():
+    scheduler = StartupScheduler()
+    started = threading.Event()
+    scheduler.add('slow', lambda: started.wait(5) and 'loaded',
+        threaded=True)
+    # only finishes if slow runs at the same time
+    scheduler.add('other', started.set)
+    scheduler.add('after', lambda: scheduler.require('slow'),
+        depends=['slow'])
+    scheduler.run()
+    assert scheduler.require('after') == 'loaded'
+    assert 'slow' in scheduler.report()
+
+
+def test_background_steps_are_not_waited_for():
+    scheduler = StartupScheduler()
+    done = threading.Event()
+    scheduler.add('a', lambda: 1)
+    scheduler.add('probe', lambda: done.wait(5), depends=['a'],
+        background=True)
+    scheduler.run()
+    scheduler.wait()
+    assert not scheduler.is_done('probe')
+    done.set()
+    assert scheduler.require('probe')
+
+
+def test_require_deferred():
+    scheduler = StartupScheduler()
+    scheduler.add('a', lambda: 1)
+    scheduler.add('b', lambda: scheduler.require('a') + 1, deferred=True)
+    scheduler.run()
+    assert scheduler.require('b') == 2
+
+
+def test_errors_are_raised_when_required():
+    scheduler = StartupScheduler()
+
+    def fail():
+        raise ValueError('broken')
+
+    scheduler.add('a', fail, threaded=True)
+    scheduler.run()
+    with pytest.raises(ValueError):
+        scheduler.wait()
+
+
+def test_step_needing_itself():
+    scheduler = StartupScheduler()
+    scheduler.add('a', lambda: scheduler.require('a'))
+    with pytest.raises(RuntimeError):
+        scheduler.run()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8
+
+import threading
+
+import pytest
+
+from xl.trax import index
+from xl.trax import search
+from xl.trax import track
+from xl.trax import trackdb
+
+
+_TAGS = [
+    {'artist': u'The Beatles', 'album': u'Abbey Road', 'title': u'Come Together',
+     'tracknumber': u'1/17', '__rating': 80.0, '__playcount': 3},
+    {'artist': u'The Beatles', 'album': u'Abbey Road', 'title': u'Something',
+     'tracknumber': u'2/17', '__rating': 60.0},
+    {'artist': [u'Björk', u'Thom Yorke'], 'album': u'Homogenic',
+     'title': u'Jóga', 'tracknumber': u'3', '__playcount': 10},
+    {'artist': u'Beat Happening', 'title': u'Indian Summer', '__rating': 100.0},
+    {'album': u'No Artist Here'},
+]
+
+_QUERIES = [
+    u'',
+    u'artist=beat',
+    u'artist="The Beatles"',
+    u'artist==beatles',
+    u'artist=="The Beatles"',
+    u'artist==__null__',
+    u'artist=bjork',
+    u'album="abbey road" title=some',
+    u'! artist=beat',
+    u'artist=beat | album=homo',
+    u'( artist=beat ) tracknumber==2',
+    u'__rating>70',
+    u'__rating<70',
+    u'__rating==80',
+    u'__playcount>2 ! __rating>70',
+    u'title~^[CS]o',
+    u'beat',
+    u'ogenic',
+    u'road together',
+]
+
+
+@pytest.fixture
+def db():
+    db = trackdb.TrackDB('test')
+    tracks = []
+    for i, tags in enumerate(_TAGS):
+        tr = track.Track('file:///index/%d.ogg' % i, scan=False)
+        for tag, value in tags.iteritems():
+            tr.set_tag_raw(tag, value)
+        tracks.append(tr)
+    db.add_tracks(tracks)
+    return db
+
+
+def _search(db, query, case_sensitive):
+    matcher = search.TracksMatcher(query, case_sensitive=case_sensitive,
+        keyword_tags=['artist', 'album', 'title'])
+    return search.search_tracks(db, [matcher])
+
+
+def _scan(db, query, case_sensitive):
+    matcher = search.TracksMatcher(query, case_sensitive=case_sensitive,
+        keyword_tags=['artist', 'album', 'title'])
+    return search._scan_tracks(list(db), [matcher])
+
+
+def _results(srtrs):
+    return dict((s.track, sorted(s.on_tags)) for s in srtrs)
+
+
+@pytest.mark.parametrize('case_sensitive', [True, False])
+@pytest.mark.parametrize('query', _QUERIES)
+def test_index_matches_scan(db, query, case_sensitive):
+    expected = _results(_scan(db, query, case_sensitive))
+    assert _results(_search(db, query, case_sensitive)) == expected
+
+
+def test_index_follows_tag_changes(db):
+    assert len(list(_search(db, u'artist=beat', False))) == 3
+    tr = db.get_track_by_loc('file:///index/3.ogg')
+    tr.set_tag_raw('artist', u'Calvin Johnson')
+    assert len(list(_search(db, u'artist=beat', False))) == 2
+    assert len(list(_search(db, u'albumartist=calvin', False))) == 1
+
+
+def test_index_follows_add_remove(db):
+    assert len(list(_search(db, u'title=something', False))) == 1
+    db.remove(db.get_track_by_loc('file:///index/1.ogg'))
+    assert len(list(_search(db, u'title=something', False))) == 0
+
+    tr = track.Track('file:///index/new.ogg', scan=False)
+    tr.set_tag_raw('title', u'Something New')
+    db.add(tr)
+    assert [s.track for s in _search(db, u'title=something', False)] == [tr]
+
+
+def test_index_list_matcher(db):
+    tracks = [db.get_track_by_loc('file:///index/0.ogg')]
+    matchers = [search.TracksInList(tracks),
+                search.TracksMatcher(u'album=abbey', case_sensitive=False)]
+    assert [s.track for s in search.search_tracks(db, matchers)] == tracks
+
+
+def test_index_unknown_matcher(db):
+    class RatedMatcher(object):
+        tag = None
+        def match(self, srtr):
+            return srtr.track.get_rating() > 3
+
+    matchers = [RatedMatcher(),
+                search.TracksMatcher(u'artist=beat', case_sensitive=False)]
+    results = set(s.track for s in search.search_tracks(db, matchers))
+    assert results == set(s.track for s in search._scan_tracks(db, matchers))
+    assert len(results) == 2
+
+
+def test_index_changes_during_search(db):
+    search_index = db.get_search_index()
+    assert len(list(_search(db, u'title=something', False))) == 1
+
+    # while a search holds the index on another thread, changes are
+    # queued instead of waiting for it
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with search_index._lock:
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+    try:
+        db.remove(db.get_track_by_loc('file:///index/1.ogg'))
+        assert search_index._pending
+    finally:
+        release.set()
+        thread.join()
+    assert len(list(_search(db, u'title=something', False))) == 0
+    assert not search_index._pending
+
+
+def test_index_search_cancelled(db):
+    matcher = search.TracksMatcher(u'artist=beat', case_sensitive=False)
+    with pytest.raises(index.SearchCancelled):
+        db.get_search_index().search([matcher], lambda: True)
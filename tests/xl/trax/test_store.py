@@ -0,0 +1,119 @@
+
+import os
+
+import pytest
+
+from xl.trax import store
+
+
+def _records():
+    return [
+        (u'file:///a.ogg', 0, {'__loc': u'file:///a.ogg',
+                               'artist': [u'foo'],
+                               'genre': [u'rock', u'pop'],
+                               '__basedir': '/',
+                               '__length': 12.5,
+                               '__compilation': (u'/', u'bar')}, {}),
+        (u'file:///b.ogg', 1, {'__loc': u'file:///b.ogg',
+                               'artist': [u'foo'],
+                               '__playcount': 3}, {'attr': 1}),
+    ]
+
+
+def _by_uri(records):
+    return dict((r[0], r) for r in records)
+
+
+@pytest.fixture
+def location(tmpdir):
+    return str(tmpdir.join('music.db'))
+
+
+def test_snapshot_roundtrip(location):
+    s = store.TrackStore(location)
+    assert not s.exists()
+    s.write_snapshot({'name': 'Collection'}, _records())
+    assert s.exists()
+
+    attrs, records = store.TrackStore(location).load()
+    assert attrs == {'name': 'Collection'}
+    assert _by_uri(records) == _by_uri(_records())
+
+
+def test_snapshot_interns_strings(location):
+    store.TrackStore(location).write_snapshot({}, _records())
+    attrs, records = store.TrackStore(location).load()
+    records = _by_uri(records)
+    a = records[u'file:///a.ogg'][2]['artist'][0]
+    b = records[u'file:///b.ogg'][2]['artist'][0]
+    assert a is b
+
+
+def test_snapshot_keeps_str_and_unicode(location):
+    store.TrackStore(location).write_snapshot({}, _records())
+    attrs, records = store.TrackStore(location).load()
+    tags = _by_uri(records)[u'file:///a.ogg'][2]
+    assert type(tags['__basedir']) is str
+    assert type(tags['artist'][0]) is unicode
+
+
+def test_log_replay(location):
+    s = store.TrackStore(location)
+    s.write_snapshot({'name': 'Collection'}, _records())
+    changed = (u'file:///a.ogg', 0, {'__loc': u'file:///a.ogg',
+                                     'artist': [u'baz']}, {})
+    added = (u'file:///c.ogg', 2, {'__loc': u'file:///c.ogg'}, {})
+    s.append({'name': 'Renamed'}, [changed, added], [u'file:///b.ogg'])
+
+    attrs, records = store.TrackStore(location).load()
+    assert attrs == {'name': 'Renamed'}
+    assert _by_uri(records) == _by_uri([changed, added])
+
+
+def test_log_truncated_record(location):
+    s = store.TrackStore(location)
+    s.write_snapshot({}, _records())
+    s.append(deletes=[u'file:///a.ogg'])
+    s.append(deletes=[u'file:///b.ogg'])
+    with open(s.log_location, 'r+b') as f:
+        f.truncate(os.path.getsize(s.log_location) - 1)
+
+    attrs, records = store.TrackStore(location).load()
+    assert [r[0] for r in records] == [u'file:///b.ogg']
+
+
+def test_compaction(location):
+    s = store.TrackStore(location)
+    s.write_snapshot({}, _records())
+    s.append(deletes=[u'file:///a.ogg'])
+
+    assert s.begin_compaction()
+    assert not s.begin_compaction()
+    # changes during the compaction go to a new log
+    s.append(deletes=[u'file:///b.ogg'])
+    s.write_snapshot({}, _records()[1:])
+
+    assert not os.path.exists(s.compact_log_location)
+    attrs, records = store.TrackStore(location).load()
+    assert records == []
+
+
+def test_interrupted_compaction(location):
+    s = store.TrackStore(location)
+    s.write_snapshot({}, _records())
+    s.append(deletes=[u'file:///a.ogg'])
+    assert s.begin_compaction()
+    s.append(deletes=[u'file:///b.ogg'])
+    # crash before the snapshot was written
+
+    attrs, records = store.TrackStore(location).load()
+    assert records == []
+
+
+def test_newer_version(location):
+    s = store.TrackStore(location)
+    s.write_snapshot({}, [])
+    with open(location, 'r+b') as f:
+        f.write(store._HEADER.pack(store.MAGIC, store.FORMAT_VERSION + 1, 0))
+    with pytest.raises(store.common.VersionError):
+        store.TrackStore(location).load()
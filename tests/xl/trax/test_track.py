@@ -109,6 +109,56 @@ class TestTrack(object):
             'artist': [u'bar']
             }
 
+    def test_pickles_multiple_values(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('genre', [u'rock', u'pop'])
+        tr.set_tag_raw('__length', 12.5)
+        tags = tr._pickles()
+        assert tags['genre'] == [u'rock', u'pop']
+        assert tags['__length'] == 12.5
+        tags['genre'].append(u'jazz')
+        assert tr.get_tag_raw('genre') == [u'rock', u'pop']
+
+    def test_tag_values_are_lists(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'bar')
+        tr.set_tag_raw('genre', [u'rock', u'pop'])
+        tr.set_tag_raw('__compilation', (u'/foo', u'bar'))
+        assert tr.get_tag_raw('artist') == [u'bar']
+        assert tr.get_tag_raw('genre') == [u'rock', u'pop']
+        assert tr.get_tag_raw('__compilation') == (u'/foo', u'bar')
+        # changing a returned value doesn't change the track
+        tr.get_tag_raw('artist').append(u'baz')
+        assert tr.get_tag_raw('artist') == [u'bar']
+
+    def test_tag_values_are_interned(self):
+        tr1 = track.Track('/foo')
+        tr2 = track.Track('/bar')
+        tr1.set_tag_raw('album', u'my' + u'album')
+        tr2.set_tag_raw('album', u'myalb' + u'um')
+        assert tr1.get_tag_raw('album')[0] is tr2.get_tag_raw('album')[0]
+
+    def test_interned_values_pruned(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('album', u'kept')
+        gone = track.Track('/bar')
+        gone.set_tag_raw('album', u'gone with the track')
+        tr.set_tag_raw('artist', u'replaced')
+        tr.set_tag_raw('artist', u'new')
+        del gone
+        track._prune_interned()
+        table = track._INTERN_TABLES[unicode]
+        assert u'kept' in table
+        assert u'new' in table
+        assert u'gone with the track' not in table
+        assert u'replaced' not in table
+
+    def test_internal_lists_are_copies(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('__list', [1, 2])
+        tr.get_tag_raw('__list').append(3)
+        assert tr.get_tag_raw('__list') == [1, 2]
+
     def test_unpickles(self):
         tr1 = track.Track(_unpickles={'artist': [u'my_artist'],
             '__loc': u'uri'})
@@ -315,6 +365,17 @@ class TestTrack(object):
         track.Track._the_cuts_cb(None, None, 'collection/strip_list')
         assert track.Track._Track__the_cuts == value
     
+    def test_cuts_cb_clears_sort_values(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'The Foo')
+        settings.set_option('collection/strip_list', [])
+        track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+        assert tr.get_tag_sort('artist') == u'the foo the foo The Foo The Foo'
+
+        settings.set_option('collection/strip_list', ['the'])
+        track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+        assert tr.get_tag_sort('artist') == u'foo the foo The Foo The Foo'
+
     def test_strip_marks(self):
         value = u'The Hëllò Wóþλdâ'
         retval = u'The Hello Woþλda The Hëllò Wóþλdâ'
@@ -328,6 +389,28 @@ class TestTrack(object):
         tr.set_tag_raw('artist', value)
         assert tr.get_tag_sort('artist', join=False) == retval
 
+    def test_get_sort_tag_changed(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'foo')
+        assert tr.get_tag_sort('artist') == u'foo foo foo foo'
+        tr.set_tag_raw('artist', u'bar')
+        assert tr.get_tag_sort('artist') == u'bar bar bar bar'
+        assert tr._get_sort_key(('artist',)) == (u'bar bar bar bar',)
+
+    def test_cached_values_bounded(self):
+        tr = track.Track('/foo')
+        calls = []
+        def compute(i):
+            calls.append(i)
+            return i
+        for i in range(track._TAG_CACHE_SIZE + 10):
+            assert tr.get_cached(('test', i), compute, i) == i
+        assert len(tr._Track__tag_cache) <= track._TAG_CACHE_SIZE
+        # recent values are still cached
+        del calls[:]
+        assert tr.get_cached(('test', i), compute, i) == i
+        assert calls == []
+
     def test_get_sort_tag_discnumber(self):
         tr = track.Track('/foo')
         value = '12/15'
@@ -0,0 +1,112 @@
+from xl.trax import track
+
+from xlgui.panel import collection
+
+
+ORDER = collection.Order('test', ('artist', 'album', 'title'))
+
+
+def make_track(name, artist, album):
+    tr = track.Track('file:///index/%s.ogg' % name, scan=False)
+    tr.set_tag_raw('artist', artist)
+    tr.set_tag_raw('album', album)
+    tr.set_tag_raw('title', name)
+    return tr
+
+
+def names(index, group):
+    """
+        Returns the displayed names of the children of group, or the
+        titles of its tracks at the last level
+    """
+    children = index.get_children(group)
+    if children and isinstance(children[0], track.Track):
+        return [tr.get_tag_raw('title', join=True) for tr in children]
+    return [child.display for child in children]
+
+
+def child(index, group, display):
+    return [c for c in index.get_children(group) if c.display == display][0]
+
+
+def test_groups():
+    a1 = make_track(u'a1', u'B artist', u'Second')
+    a2 = make_track(u'a2', u'B artist', u'First')
+    b1 = make_track(u'b1', u'A artist', u'Third')
+    index = collection._GroupIndex(ORDER, [a1, a2, b1])
+    assert names(index, index.root) == [u'A artist', u'B artist']
+    artist = child(index, index.root, u'B artist')
+    assert artist.tracks == set([a1, a2])
+    assert names(index, artist) == [u'First', u'Second']
+    assert names(index, child(index, artist, u'First')) == [u'a2']
+
+
+def test_children_built_when_asked():
+    tr = make_track(u'a1', u'Artist', u'Album')
+    index = collection._GroupIndex(ORDER, [tr])
+    artist = index.get_children(index.root)[0]
+    assert artist.children is None
+    assert index.tracks[tr.get_loc_for_io()] == (tr, artist)
+
+    album = index.get_children(artist)[0]
+    assert index.tracks[tr.get_loc_for_io()] == (tr, album)
+    # added tracks go down to the groups that exist
+    other = make_track(u'a2', u'Artist', u'Album')
+    index.add(other)
+    assert index.tracks[other.get_loc_for_io()] == (other, album)
+    assert names(index, album) == [u'a1', u'a2']
+
+
+def test_remove():
+    a1 = make_track(u'a1', u'Artist', u'Album')
+    a2 = make_track(u'a2', u'Artist', u'Other album')
+    b1 = make_track(u'b1', u'Other artist', u'Album')
+    index = collection._GroupIndex(ORDER, [a1, a2, b1])
+    artist = child(index, index.root, u'Artist')
+    assert names(index, artist) == [u'Album', u'Other album']
+
+    index.remove(a2.get_loc_for_io())
+    assert names(index, artist) == [u'Album']
+    assert artist.tracks == set([a1])
+
+    # empty groups are removed up to the root
+    index.remove(b1.get_loc_for_io())
+    assert names(index, index.root) == [u'Artist']
+    assert index.root.tracks == set([a1])
+    assert b1.get_loc_for_io() not in index.tracks
+
+    # unknown tracks are ignored
+    index.remove(b1.get_loc_for_io())
+    assert index.root.tracks == set([a1])
+
+
+def test_tags_changed():
+    a1 = make_track(u'a1', u'Artist', u'Album')
+    a2 = make_track(u'a2', u'Artist', u'Album')
+    index = collection._GroupIndex(ORDER, [a1, a2])
+    artist = child(index, index.root, u'Artist')
+    album = child(index, artist, u'Album')
+
+    a2.set_tag_raw('album', u'New album')
+    index.add(a2)
+    assert names(index, artist) == [u'Album', u'New album']
+    assert album.tracks == set([a1])
+    assert names(index, album) == [u'a1']
+
+    a2.set_tag_raw('artist', u'New artist')
+    index.add(a2)
+    assert names(index, index.root) == [u'Artist', u'New artist']
+    assert names(index, artist) == [u'Album']
+    assert artist.tracks == set([a1])
+    assert len(index.root.tracks) == 2
+    assert names(index, child(index, index.root, u'New artist')) == \
+        [u'New album']
+
+
+def test_tracks_added_once():
+    tr = make_track(u'a1', u'Artist', u'Album')
+    index = collection._GroupIndex(ORDER, [tr])
+    index.add(tr)
+    artist = index.get_children(index.root)[0]
+    assert len(index.get_children(artist)) == 1
+    assert names(index, index.get_children(artist)[0]) == [u'a1']
@@ -28,9 +28,13 @@ import datetime
 import os.path
 import pprint
 import shelve
+import sys
 
 import click
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from xl.trax.store import TrackStore
+
 
 exaile_db = os.path.join(os.path.expanduser('~'), '.local', 'share', 'exaile', 'music.db')
 
@@ -47,7 +51,15 @@ def cli(ctx, db):
     '''
         Tool that allows low-level exploration of an Exaile music database
     '''
-    ctx.obj = shelve.open(db, flag='r', protocol=2)
+    store = TrackStore(db)
+    if store.exists():
+        # present the store like the old shelve format
+        attrs, records = store.load()
+        ctx.obj = dict(attrs)
+        for uri, key, tags, holder_attrs in records:
+            ctx.obj['tracks-%s' % key] = (tags, key, holder_attrs)
+    else:
+        ctx.obj = shelve.open(db, flag='r', protocol=2)
 
 @cli.command()
 @click.pass_obj
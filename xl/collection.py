@@ -35,13 +35,17 @@ collection.
 """
 
 from collections import deque
+import cPickle as pickle
 from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gio
+import hashlib
 import logging
 import os
 import os.path
+import Queue
 import shutil
+import sys
 import threading
 import time
 
@@ -358,9 +362,40 @@ class Collection(trax.TrackDB):
             for prefix, lib in self.libraries.iteritems():
                 lib.delete(tr.get_loc_for_io())
 
+# Pending changes queued by LibraryMonitor
+_CHANGE_UPDATED = 0
+_CHANGE_REMOVED = 1
+
+def _read_inotify_limit():
+    try:
+        with open('/proc/sys/fs/inotify/max_user_watches') as f:
+            # leave room for other applications
+            return int(f.read()) // 2
+    except (IOError, ValueError):
+        return 8192
+
+_inotify_limit = _read_inotify_limit()
+
+def _get_monitor_limit():
+    """
+        Returns the maximum number of directory monitors to set up
+    """
+    limit = settings.get_option('collection/monitor_limit', 0)
+    if limit > 0:
+        return limit
+    return _inotify_limit
+
 class LibraryMonitor(GObject.GObject):
     """
         Monitors library locations for changes
+
+        Changes are not applied one by one. They are queued per location
+        until no more changes arrived for ``collection/monitor_delay``
+        milliseconds, and then applied to the collection in one go.
+
+        The number of directory monitors over all libraries is limited by
+        ``collection/monitor_limit``, which defaults to half of the
+        inotify watch limit.
     """
     __gproperties__ = {
         'monitored': (
@@ -383,6 +418,10 @@ class LibraryMonitor(GObject.GObject):
             [Gio.File]
         )
     }
+
+    # Number of directory monitors of all libraries
+    _monitor_count = 0
+    _monitor_count_lock = threading.Lock()
     
     def __init__(self, library):
         """
@@ -396,7 +435,9 @@ class LibraryMonitor(GObject.GObject):
         self.__monitored = False
         self.__monitors = {}
         self.__queue = {}
+        self.__queue_id = None
         self.__lock = threading.RLock()
+        self.__process_lock = threading.Lock()
 
     def do_get_property(self, property):
         """
@@ -420,6 +461,12 @@ class LibraryMonitor(GObject.GObject):
         else:
             raise AttributeError('unkown property %s' % property.name)
 
+    def get_monitor_count(self):
+        """
+            Returns the number of directories monitored for this library
+        """
+        return len(self.__monitors)
+
     def __update_monitors(self):
         """
             Sets up or removes library monitors
@@ -429,88 +476,254 @@ class LibraryMonitor(GObject.GObject):
                 logger.debug('Setting up library monitors')
 
                 for directory in common.walk_directories(self.__root):
-                    monitor = directory.monitor_directory(Gio.FileMonitorFlags.NONE, None)
-                    monitor.connect('changed', self.on_location_changed)
-                    self.__monitors[directory] = monitor
-
-                    self.emit('location-added', directory)
+                    if not self.__add_monitor(directory):
+                        break
             else:
                 logger.debug('Removing library monitors')
 
-                for directory, monitor in self.__monitors.iteritems():
-                    monitor.cancel()
+                for uri in self.__monitors.keys():
+                    self.__remove_monitor(uri)
 
-                    self.emit('location-removed', directory)
+    def __add_monitor(self, directory):
+        """
+            Starts monitoring a directory
 
-                self.__monitors = {}
-                
-    def __process_change_queue(self, gfile):
-        if gfile in self.__queue:
-            added_tracks = trax.util.get_tracks_from_uri(gfile.get_uri())
-            for tr in added_tracks:
-                tr.read_tags()
-            self.__library.collection.add_tracks(added_tracks)
-            del self.__queue[gfile]
+            :returns: False if the monitor limit has been reached
+        """
+        uri = directory.get_uri()
+        with self.__lock:
+            if uri in self.__monitors:
+                return True
+
+            with LibraryMonitor._monitor_count_lock:
+                if LibraryMonitor._monitor_count >= _get_monitor_limit():
+                    logger.warning('Not monitoring %s and below, the limit '
+                        'of %d monitored directories has been reached',
+                        directory.get_parse_name(), LibraryMonitor._monitor_count)
+                    return False
+                LibraryMonitor._monitor_count += 1
+
+            monitor = directory.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+            monitor.connect('changed', self.on_location_changed)
+            self.__monitors[uri] = (directory, monitor)
+
+        self.emit('location-added', directory)
+        return True
+
+    def __remove_monitor(self, uri):
+        """
+            Stops monitoring a directory
+        """
+        with self.__lock:
+            if uri not in self.__monitors:
+                return
+            directory, monitor = self.__monitors.pop(uri)
+            monitor.cancel()
+
+            with LibraryMonitor._monitor_count_lock:
+                LibraryMonitor._monitor_count -= 1
+
+        self.emit('location-removed', directory)
 
     def on_location_changed(self, monitor, gfile, other_gfile, event):
         """
-            Updates the library on changes of the location
+            Queues changes of the location
         """
-        
-        if event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
-            self.__process_change_queue(gfile)
+        if event == Gio.FileMonitorEvent.DELETED:
+            change = _CHANGE_REMOVED
         elif event == Gio.FileMonitorEvent.CREATED or \
-             event == Gio.FileMonitorEvent.CHANGED:
-            
-            # Enqueue tracks retrieval
-            if gfile not in self.__queue:
-                self.__queue[gfile] = True
-            
-                # File monitor only emits the DONE_HINT when using inotify,
-                # and only on single files. Give it some time, but don't 
-                # lose the change notification
-                GLib.timeout_add(500, self.__process_change_queue, gfile)
-            
-            # Set up new monitor if directory
-            fileinfo = gfile.query_info('standard::type', Gio.FileQueryInfoFlags.NONE, None)
+             event == Gio.FileMonitorEvent.CHANGED or \
+             event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+            change = _CHANGE_UPDATED
+        else:
+            return
 
-            if fileinfo.get_file_type() == Gio.FileType.DIRECTORY and \
-               gfile not in self.__monitors:
-                
-                for directory in common.walk_directories(gfile):
-                    monitor = directory.monitor_directory(Gio.FileMonitorFlags.NONE, None)
-                    monitor.connect('changed', self.on_location_changed)
-                    self.__monitors[directory] = monitor
+        with self.__lock:
+            # Only the last change matters: a file that is created and
+            # deleted again is removed, one that is deleted and created
+            # again (e.g. when replaced) is updated
+            self.__queue[gfile.get_uri()] = (gfile, change, time.time())
 
-                    self.emit('location-added', directory)
+            if self.__queue_id is None:
+                self.__queue_id = GLib.timeout_add(self.__get_delay(),
+                    self.__on_queue_timeout)
 
-        elif event == Gio.FileMonitorEvent.DELETED:
-            removed_tracks = []
+    def __get_delay(self):
+        return max(1, settings.get_option('collection/monitor_delay', 500))
 
-            track = trax.Track(gfile.get_uri())
+    def __on_queue_timeout(self):
+        """
+            Takes the changes that have settled from the queue and
+            applies them
+        """
+        settled = time.time() - self.__get_delay() / 1000.0
+        changes = {}
 
-            if track in self.__library.collection:
-                # Deleted file was a regular track
-                removed_tracks += [track]
-            else:
-                # Deleted file was most likely a directory
-                for track in self.__library.collection:
-                    track_gfile = Gio.File.new_for_uri(track.get_loc_for_io())
+        with self.__lock:
+            for uri, (gfile, change, changed) in self.__queue.items():
+                if changed <= settled:
+                    changes[gfile] = change
+                    del self.__queue[uri]
+
+            keep_running = len(self.__queue) > 0
+            if not keep_running:
+                self.__queue_id = None
+
+        if changes:
+            self.__process_changes(changes)
+
+        return keep_running
+
+    @common.threaded
+    def __process_changes(self, changes):
+        """
+            Applies a batch of changes to the collection
+
+            :param changes: the changes
+            :type changes: dict of :class:`Gio.File` -> change
+        """
+        with self.__process_lock:
+            library = self.__library
+            collection = library.collection
+            if collection is None:
+                return
+
+            added = {}
+            changed = {}
+            removed = {}
+            removed_locations = []
+
+            for gfile, change in changes.iteritems():
+                if change == _CHANGE_REMOVED:
+                    removed_locations.append(gfile)
+                    continue
+
+                try:
+                    fileinfo = gfile.query_info('standard::type,time::modified',
+                        Gio.FileQueryInfoFlags.NONE, None)
+                except GLib.Error:
+                    # gone again, the deletion will follow
+                    continue
+
+                if fileinfo.get_file_type() == Gio.FileType.DIRECTORY:
+                    # A new directory, its files won't be reported
+                    files = []
+                    for fil, info in common.walk_with_info(gfile):
+                        if info is None or \
+                                info.get_file_type() == Gio.FileType.DIRECTORY:
+                            self.__add_monitor(fil)
+                        else:
+                            files.append((fil, info, False))
+                elif fileinfo.get_file_type() == Gio.FileType.REGULAR:
+                    files = [(gfile, fileinfo, True)]
+                else:
+                    continue
 
-                    if track_gfile.has_prefix(gfile):
-                        removed_tracks += [track]
+                for fil, info, force_update in files:
+                    uri = fil.get_uri()
+                    if not uri or uri in added:
+                        continue
+                    try:
+                        tr, add = library._read_track(uri, _get_mtime(info),
+                            force_update)
+                    except Exception:
+                        logger.exception("Error while reading %s", uri)
+                        continue
+                    if add:
+                        added[uri] = tr
+                    elif tr is not None and collection.loc_is_member(uri):
+                        changed[uri] = tr
+
+            if removed_locations:
+                # Deleted locations are either tracks or directories
+                prefixes = []
+                for gfile in removed_locations:
+                    uri = gfile.get_uri()
+                    track = collection.get_track_by_loc(uri)
+                    if track is not None:
+                        removed[uri] = track
+                    else:
+                        prefixes.append(uri.rstrip('/') + '/')
+                prefixes = tuple(prefixes)
+                if prefixes:
+                    for loc, holder in collection.tracks.items():
+                        if loc.startswith(prefixes):
+                            removed[loc] = holder._track
+
+                # Remove obsolete monitors
+                uris = set(gfile.get_uri() for gfile in removed_locations)
+                with self.__lock:
+                    removed_directories = [uri for uri in self.__monitors
+                        if uri in uris or uri.startswith(prefixes)]
+                for uri in removed_directories:
+                    self.__remove_monitor(uri)
+
+            if added:
+                collection.add_tracks(added.values())
+            if removed:
+                collection.remove_tracks(removed.values())
+
+            if added or changed or removed:
+                logger.debug('%s: %d tracks added, %d changed, %d removed',
+                    library.location, len(added), len(changed), len(removed))
+
+def _get_mtime(fileinfo):
+    """
+        Returns the modification time from a :class:`Gio.FileInfo` in
+        the form stored in the ``__modified`` tag
+    """
+    mtime = fileinfo.get_modification_time()
+    return mtime.tv_sec + (mtime.tv_usec/100000.0)
 
-            self.__library.collection.remove_tracks(removed_tracks)
+def _get_directory_mtime(fileinfo):
+    """
+        Returns the exact modification time from a :class:`Gio.FileInfo`
+    """
+    mtime = fileinfo.get_modification_time()
+    return (mtime.tv_sec, mtime.tv_usec)
 
-            # Remove obsolete monitors
-            removed_directories = [d for d in self.__monitors \
-                if d == gfile or d.has_prefix(gfile)]
+# Items passed from the rescan workers to the committer
+_SCAN_FILE = 0
+_SCAN_DIRECTORY_DONE = 1
 
-            for directory in removed_directories:
-                self.__monitors[directory].cancel()
-                del self.__monitors[directory]
-                
-                self.emit('location-removed', directory)
+class _ScanDirectory(object):
+    """
+        Keeps track of the files of one directory during a rescan
+    """
+    __slots__ = ['tracks', 'submitted', 'received', 'closed', 'changed']
+
+    def __init__(self):
+        #: tracks for compilation detection, None if there are too many
+        self.tracks = []
+        #: number of files found, set by the enumerator
+        self.submitted = 0
+        #: number of files processed, counted by the committer
+        self.received = 0
+        self.closed = False
+        #: whether any tags were read, set by the enumerator
+        self.changed = False
+
+    def is_complete(self):
+        return self.closed and self.received == self.submitted
+
+class _ScanState(object):
+    """
+        What the enumerator of a rescan found
+    """
+    __slots__ = ['cache', 'directories', 'seen', 'failed', 'aborted']
+
+    def __init__(self, cache):
+        #: the directories found by the last rescan, or None
+        self.cache = cache
+        #: the directories found, uri -> (mtime, subdirectories, files)
+        self.directories = {}
+        #: uris of all files found
+        self.seen = set()
+        #: directories that could not be read
+        self.failed = []
+        #: whether the walk stopped on an unexpected error, in which case
+        #: what was found is incomplete
+        self.aborted = False
 
 class Library(object):
     """
@@ -531,6 +744,8 @@ class Library(object):
         5
         >>>
     """
+    _directory_cache_version = 1
+
     def __init__(self, location, monitored=False, scan_interval=0, startup_scan=False):
         """
             Sets up the Library
@@ -547,6 +762,8 @@ class Library(object):
         self.scan_interval = scan_interval
         self.scan_id = None
         self.scanning = False
+        #: files per second processed by the last or current rescan
+        self.scan_rate = 0.0
         self._startup_scan = startup_scan
         self.monitor = LibraryMonitor(self)
         self.monitor.props.monitored = monitored
@@ -629,10 +846,83 @@ class Library(object):
     
     startup_scan = property(get_startup_scan, set_startup_scan)
 
+    def get_directory_cache_location(self):
+        """
+            Gets the location of the file remembering the directories
+            seen by the last rescan, or None if there is none because
+            the collection is not saved.
+        """
+        if self.collection is None or not self.collection.location:
+            return None
+        location = self.location
+        if isinstance(location, unicode):
+            location = location.encode('utf-8')
+        return os.path.join(xdg.get_cache_dir(), 'collection',
+            hashlib.md5(location).hexdigest())
+
+    def _load_directory_cache(self, header_only=False):
+        """
+            Loads the directory cache written by the last completed
+            rescan, see :meth:`_save_directory_cache`
+
+            :returns: the header if header_only is set, else a dict of
+                directory uri -> (mtime, subdirectory uris, file uris).
+                None if there is no usable cache.
+        """
+        location = self.get_directory_cache_location()
+        if location is None or not os.path.exists(location):
+            return None
+        try:
+            with open(location, 'rb') as f:
+                header = pickle.load(f)
+                if header.get('version') != self._directory_cache_version or \
+                        header.get('location') != self.location:
+                    return None
+                if header_only:
+                    return header
+                return pickle.load(f)
+        except Exception:
+            logger.exception("Could not load directory cache of %s", self.location)
+            return None
+
+    def _save_directory_cache(self, directories):
+        """
+            Saves the directories seen by a rescan. The file holds a small
+            header, so that the file count can be read without loading
+            the directories.
+        """
+        location = self.get_directory_cache_location()
+        if location is None:
+            return
+        count = 0
+        for mtime, subdirs, files in directories.itervalues():
+            count += len(files)
+        header = {
+            'version': self._directory_cache_version,
+            'location': self.location,
+            'count': count
+        }
+        try:
+            dirname = os.path.dirname(location)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with open(location + '.tmp', 'wb') as f:
+                pickle.dump(header, f, common.PICKLE_PROTOCOL)
+                pickle.dump(directories, f, common.PICKLE_PROTOCOL)
+            if sys.platform == 'win32' and os.path.exists(location):
+                os.remove(location)
+            os.rename(location + '.tmp', location)
+        except Exception:
+            logger.exception("Could not save directory cache of %s", self.location)
+
     def _count_files(self):
         """
             Counts the number of files present in this directory
         """
+        header = self._load_directory_cache(header_only=True)
+        if header is not None:
+            return header['count']
+
         count = 0
         for file in common.walk(Gio.File.new_for_uri(self.location)):
             if self.collection:
@@ -712,30 +1002,77 @@ class Library(object):
         uri = gloc.get_uri()
         if not uri: # we get segfaults if this check is removed
             return None
-        mtime = gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None).get_modification_time()
-        mtime = mtime.tv_sec + (mtime.tv_usec/100000.0)
+        mtime = _get_mtime(gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None))
+        tr, add = self._read_track(uri, mtime, force_update)
+        if add:
+            self.collection.add(tr)
+        return tr
+
+    def _read_track(self, uri, mtime, force_update):
+        """
+            Reads the tags of the track at uri if it is new or has
+            changed. Does not add it to the collection.
+
+            :returns: (track, whether the track should be added to the
+                collection)
+        """
         tr = self.collection.get_track_by_loc(uri)
         if tr:
             if force_update or tr.get_tag_raw('__modified') < mtime:
                 tr.read_tags()
                 tr.set_tag_raw('__modified', mtime)
-        else:
-            tr = trax.Track(uri)
-            if tr._scan_valid == True:
-                tr.set_tag_raw('__date_added', time.time())
-                self.collection.add(tr)
-                tr.set_tag_raw('__modified', mtime)
+            return tr, False
 
-            # Track already existed. This fixes trax.get_tracks_from_uri
-            # on windows, unknown why fix isnt needed on linux.
-            elif not tr._init:
-                self.collection.add(tr)
-        return tr
+        tr = trax.Track(uri)
+        if tr._scan_valid == True:
+            tr.set_tag_raw('__date_added', time.time())
+            tr.set_tag_raw('__modified', mtime)
+            return tr, True
+
+        # Track already existed. This fixes trax.get_tracks_from_uri
+        # on windows, unknown why fix isnt needed on linux.
+        elif not tr._init:
+            return tr, True
+        return tr, False
+
+    def _detect_compilations(self, dirtracks):
+        """
+            Marks the tracks of a single directory that are part of
+            a compilation
+        """
+        compilations = deque()
+        ccheck = {}
+        for tr in dirtracks:
+            self._check_compilation(ccheck, compilations, tr)
+        for (basedir, album) in compilations:
+            base = basedir.replace('"', '\\"')
+            alb = album.replace('"', '\\"')
+            items = [ tr for tr in dirtracks if \
+                    tr.get_tag_raw('__basedir') == base and \
+                    # FIXME: this is ugly
+                    alb in "".join(
+                        tr.get_tag_raw('album') or []).lower()
+                    ]
+            for item in items:
+                item.set_tag_raw('__compilation', (basedir, album))
 
     def rescan(self, notify_interval=None, force_update=False):
         """
             Rescan the associated folder and add the contained files
             to the Collection
+
+            The rescan is a pipeline: one thread walks the directory tree,
+            a pool of ``collection/scan_workers`` threads reads the tags
+            of new and changed files, and the calling thread adds the
+            results to the collection in batches.
+
+            Directories are remembered between rescans, together with
+            their modification time. Unless force_update is set, the
+            contents of directories that have not been modified since
+            the last rescan are taken from there, and only tracks that
+            are new to the collection are looked at. Files that can't be
+            tracks are not remembered, so they are only seen again once
+            their directory changes.
         """
         # TODO: use gio's cancellable support
         
@@ -747,74 +1084,60 @@ class Library(object):
 
         logger.info("Scanning library: %s", self.location)
         self.scanning = True
-        db = self.collection
         libloc = Gio.File.new_for_uri(self.location)
 
-        count = 0
-        dirtracks = deque()
-        compilations = deque()
-        ccheck = {}
-        for fil in common.walk(libloc):
-            count += 1
-            type = fil.query_info("standard::type", Gio.FileQueryInfoFlags.NONE, None).get_file_type()
-            if type == Gio.FileType.DIRECTORY:
-                if dirtracks:
-                    for tr in dirtracks:
-                        self._check_compilation(ccheck, compilations, tr)
-                    for (basedir, album) in compilations:
-                        base = basedir.replace('"', '\\"')
-                        alb = album.replace('"', '\\"')
-                        items = [ tr for tr in dirtracks if \
-                                tr.get_tag_raw('__basedir') == base and \
-                                # FIXME: this is ugly
-                                alb in "".join(
-                                    tr.get_tag_raw('album') or []).lower()
-                                ]
-                        for item in items:
-                            item.set_tag_raw('__compilation', (basedir, album))
-                dirtracks = deque()
-                compilations = deque()
-                ccheck = {}
-            elif type == Gio.FileType.REGULAR:
-                tr = self.update_track(fil, force_update=force_update)
-                if not tr:
-                    continue
+        cache = None
+        if not force_update:
+            cache = self._load_directory_cache()
+        scan = _ScanState(cache)
+
+        num_workers = max(1, settings.get_option('collection/scan_workers', 4))
+        jobs = Queue.Queue(maxsize=num_workers * 32)
+        results = Queue.Queue()
+
+        enumerator = threading.Thread(target=self._scan_enumerate,
+                args=(libloc, jobs, results, force_update, scan),
+                name='LibraryScanEnumerator')
+        workers = [threading.Thread(target=self._scan_read,
+                args=(jobs, results, force_update),
+                name='LibraryScanWorker-%d' % i)
+            for i in range(num_workers)]
+        for thread in [enumerator] + workers:
+            thread.daemon = True
+            thread.start()
 
-                if dirtracks is not None:
-                    dirtracks.append(tr)
-                    # do this so that if we have, say, a 4000-song folder
-                    # we dont get bogged down trying to keep track of them
-                    # for compilation detection. Most albums have far fewer
-                    # than 110 tracks anyway, so it is unlikely that this
-                    # restriction will affect the heuristic's accuracy.
-                    # 110 was chosen to accomodate "top 100"-style
-                    # compilations.
-                    if len(dirtracks) > 110:
-                        logger.info("Too many files, skipping "
-                                "compilation detection heuristic.")
-                        dirtracks = None
-
-            if self.collection and self.collection._scan_stopped:
-                self.scanning = False
-                logger.info("Scan canceled")
-                return
-
-            # progress update
-            if notify_interval is not None and count % notify_interval == 0:
-                event.log_event('tracks_scanned', self, count)
+        try:
+            count = self._scan_commit(results, notify_interval)
+        finally:
+            enumerator.join()
+            for worker in workers:
+                jobs.put(None)
+            for worker in workers:
+                worker.join()
+
+        if count is None:
+            self.scanning = False
+            logger.info("Scan canceled")
+            return
 
         # final progress update
         if notify_interval is not None:
             event.log_event('tracks_scanned', self, count)
 
+        if scan.aborted:
+            # what wasn't seen may well still be there
+            logger.warning("Scan of %s incomplete, not removing missing "
+                "tracks", self.location)
+            self.scanning = False
+            return
 
-
+        # Tracks that were not seen are gone, unless they are in a
+        # directory that could not be read.
         removals = deque()
-        for tr in self.collection.tracks.itervalues():
-            tr = tr._track
-            loc = tr.get_loc_for_io()
-            if not loc:
+        for loc, holder in self.collection.tracks.iteritems():
+            if not loc or loc in scan.seen:
                 continue
+            tr = holder._track
             gloc = Gio.File.new_for_uri(loc)
             try:
                 if not gloc.has_prefix(libloc):
@@ -823,16 +1146,205 @@ class Library(object):
                 logger.exception("Error decoding file location")
                 continue
 
-            if not gloc.query_exists(None):
-                removals.append(tr)
+            if scan.failed and any(gloc.has_prefix(f) for f in scan.failed):
+                if gloc.query_exists(None):
+                    continue
+            removals.append(tr)
 
         for tr in removals:
             logger.debug(u"Removing %s"%unicode(tr))
             self.collection.remove(tr)
+
+        self._save_directory_cache(scan.directories)
             
-        logger.info("Scan completed: %s", self.location)
+        logger.info("Scan completed: %s (%d files, %.1f files/s)",
+                self.location, count, self.scan_rate)
         self.scanning = False
 
+    def _scan_enumerate(self, libloc, jobs, results, force_update, scan):
+        """
+            Rescan stage 1: walks the library, passing unchanged tracks
+            straight to the committer and everything else to the workers
+        """
+        cache = scan.cache or {}
+        queue = deque()
+        queue.append((libloc, None))
+        try:
+            while len(queue) > 0:
+                if self.collection._scan_stopped:
+                    break
+
+                dir, dirinfo = queue.pop()
+                directory = _ScanDirectory()
+                try:
+                    if dirinfo is None:
+                        dirinfo = dir.query_info("time::modified",
+                                Gio.FileQueryInfoFlags.NONE, None)
+                    uri = dir.get_uri()
+                    mtime = _get_directory_mtime(dirinfo)
+                    cached = cache.get(uri)
+
+                    if cached is not None and cached[0] == mtime:
+                        subdirs = cached[1]
+                        files = [fileuri for fileuri in cached[2]
+                            if self._scan_file(directory, fileuri, None,
+                                    jobs, results, force_update, scan)]
+                        for subdir in subdirs:
+                            queue.append((Gio.File.new_for_uri(subdir), None))
+                    else:
+                        subdirs, files = [], []
+                        for fil, fileinfo in common.walk_children(dir, libloc):
+                            fileuri = fil.get_uri()
+                            if not fileuri:
+                                continue
+                            if fileinfo.get_file_type() == Gio.FileType.DIRECTORY:
+                                subdirs.append(fileuri)
+                                queue.append((fil, fileinfo))
+                            elif self._scan_file(directory, fileuri,
+                                    fileinfo, jobs, results, force_update,
+                                    scan):
+                                files.append(fileuri)
+
+                    scan.directories[uri] = (mtime, subdirs, files)
+                except GLib.Error:
+                    logger.exception("Unhandled exception while walking on %s.", dir)
+                    scan.failed.append(dir)
+                finally:
+                    results.put((_SCAN_DIRECTORY_DONE, directory, None, False))
+        except Exception:
+            logger.exception("Error while walking %s", self.location)
+            scan.aborted = True
+        finally:
+            results.put(None)
+
+    def _scan_file(self, directory, uri, fileinfo, jobs, results, force_update, scan):
+        """
+            Passes a file found by :meth:`_scan_enumerate` on to the
+            committer if its track is up to date, or else to the workers.
+            fileinfo is None for files of unmodified directories.
+
+            :returns: False if the file can't be a track, in which case
+                it is left out of the directory cache
+        """
+        tr = self.collection.get_track_by_loc(uri)
+        if tr is None and not trax.is_valid_track(uri):
+            # covers, playlists, ... are not looked at again until
+            # their directory changes
+            return False
+        scan.seen.add(uri)
+        if tr and not force_update:
+            if fileinfo is None or \
+                    not tr.get_tag_raw('__modified') < _get_mtime(fileinfo):
+                directory.submitted += 1
+                results.put((_SCAN_FILE, directory, tr, False))
+                return True
+
+        if fileinfo is None:
+            try:
+                fileinfo = Gio.File.new_for_uri(uri).query_info(
+                        "time::modified", Gio.FileQueryInfoFlags.NONE, None)
+            except GLib.Error:
+                logger.exception("Could not read modification time of %s", uri)
+                return True
+        directory.submitted += 1
+        directory.changed = True
+        jobs.put((directory, uri, _get_mtime(fileinfo)))
+        return True
+
+    def _scan_read(self, jobs, results, force_update):
+        """
+            Rescan stage 2: reads tags of new and changed files
+        """
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            directory, uri, mtime = job
+            tr, add = None, False
+            if not self.collection._scan_stopped:
+                try:
+                    tr, add = self._read_track(uri, mtime, force_update)
+                except Exception:
+                    logger.exception("Error while scanning %s", uri)
+            results.put((_SCAN_FILE, directory, tr, add))
+
+    def _scan_commit(self, results, notify_interval, batch_size=200):
+        """
+            Rescan stage 3: adds new tracks to the collection in batches
+            and runs compilation detection on each completed directory
+
+            :returns: the number of files processed, or None if the scan
+                was stopped
+        """
+        count = 0
+        start = time.time()
+        self.scan_rate = 0.0
+        new_tracks = []
+        incomplete = set()
+        enumerated = False
+
+        while not enumerated or incomplete:
+            item = results.get()
+            if self.collection._scan_stopped:
+                # keep draining, so that the other stages can finish
+                if item is None:
+                    enumerated = True
+                incomplete.clear()
+                continue
+
+            if item is None:
+                enumerated = True
+                continue
+
+            kind, directory, tr, add = item
+            if kind == _SCAN_DIRECTORY_DONE:
+                directory.closed = True
+            else:
+                count += 1
+                directory.received += 1
+                if add:
+                    new_tracks.append(tr)
+                if tr is not None and directory.tracks is not None:
+                    directory.tracks.append(tr)
+                    # do this so that if we have, say, a 4000-song folder
+                    # we dont get bogged down trying to keep track of them
+                    # for compilation detection. Most albums have far fewer
+                    # than 110 tracks anyway, so it is unlikely that this
+                    # restriction will affect the heuristic's accuracy.
+                    # 110 was chosen to accomodate "top 100"-style
+                    # compilations.
+                    if len(directory.tracks) > 110:
+                        logger.info("Too many files, skipping "
+                                "compilation detection heuristic.")
+                        directory.tracks = None
+
+            if len(new_tracks) >= batch_size:
+                self.collection.add_tracks(new_tracks)
+                new_tracks = []
+
+            if directory.is_complete():
+                incomplete.discard(directory)
+                if directory.changed and directory.tracks:
+                    if new_tracks:
+                        self.collection.add_tracks(new_tracks)
+                        new_tracks = []
+                    self._detect_compilations(directory.tracks)
+            else:
+                incomplete.add(directory)
+
+            # progress update
+            if notify_interval is not None and kind == _SCAN_FILE and \
+                    count % notify_interval == 0:
+                self.scan_rate = count / max(time.time() - start, 0.001)
+                event.log_event('tracks_scanned', self, count)
+
+        if new_tracks:
+            self.collection.add_tracks(new_tracks)
+        if self.collection._scan_stopped:
+            return None
+        self.scan_rate = count / max(time.time() - start, 0.001)
+        return count
+
     def add(self, loc, move=False):
         """
             Copies (or moves) a file into the library and adds it to the
@@ -36,11 +36,16 @@ import os
 import subprocess
 import sys
 import threading
+import time
 import urllib2
 import urlparse
 from functools import wraps, partial
 from collections import deque
 from UserDict import DictMixin
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 logger = logging.getLogger(__name__)
 
@@ -417,6 +422,229 @@ class cached(object):
         """Support instance methods."""
         return partial(self.__call__, obj)
 
+class PersistentCache(object):
+    """
+        Dict-like cache stored in a file, whose entries can expire
+
+        All entries are kept in memory, so reading doesn't lock or touch
+        the disk. Changes are appended to the file in batches, after
+        batch_size changes or sync_delay seconds, whichever comes first,
+        and the file is written again once it mostly holds outdated
+        changes.
+
+        When there are more than max_entries entries, the ones that
+        were least recently used are removed.
+    """
+    def __init__(self, location, ttl=None, max_entries=None, batch_size=50,
+            sync_delay=5):
+        """
+            :param location: the file to store the cache in
+            :param ttl: default time in seconds after which entries
+                expire, None to keep them
+            :param max_entries: maximum number of entries, None for no
+                limit
+            :param batch_size: number of changes after which they are
+                written to the file
+            :param sync_delay: time in seconds after which changes are
+                written to the file
+        """
+        self.location = location
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.sync_delay = sync_delay
+        # key -> [expiry time or None, value, last use]
+        self._entries = {}
+        # changes not written yet, (key, expiry, value) or (key,) for
+        # removed entries
+        self._pending = []
+        # number of changes in the file
+        self._written = 0
+        # whether the file must be written again before appending to it
+        self._damaged = False
+        self._lock = threading.Lock()
+        self._timer = None
+        self._load()
+
+    def _load(self):
+        try:
+            f = open(self.location, 'rb')
+        except IOError:
+            return
+        now = time.time()
+        entries = self._entries
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            while f.tell() < size:
+                offset = f.tell()
+                try:
+                    record = pickle.load(f)
+                except Exception:
+                    logger.warning("Ignoring damaged end of %s",
+                        self.location)
+                    try:
+                        with open(self.location, 'r+b') as damaged:
+                            damaged.truncate(offset)
+                    except IOError:
+                        pass
+                    break
+                self._written += 1
+                if len(record) == 1:
+                    entries.pop(record[0], None)
+                    continue
+                key, expires, value = record
+                if expires is not None and expires <= now:
+                    entries.pop(key, None)
+                else:
+                    # older changes count as less recently used
+                    entries[key] = [expires, value, self._written]
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] is not None and entry[0] <= time.time():
+            return default
+        entry[2] = time.time()
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """
+            Sets an entry
+
+            :param ttl: time in seconds after which the entry expires,
+                defaults to the ttl of the cache
+        """
+        now = time.time()
+        if ttl is None:
+            ttl = self.ttl
+        expires = None if ttl is None else now + ttl
+        with self._lock:
+            self._entries[key] = [expires, value, now]
+            self._pending.append((key, expires, value))
+            if self.max_entries is not None and \
+                    len(self._entries) > self.max_entries:
+                self._shrink(now)
+            self._schedule_flush()
+
+    def _shrink(self, now):
+        """
+            Removes expired entries, then the least recently used ones
+            until the cache is a tenth below max_entries
+        """
+        entries = self._entries
+        removed = [k for k, e in entries.iteritems()
+            if e[0] is not None and e[0] <= now]
+        target = self.max_entries - self.max_entries // 10
+        remaining = len(entries) - len(removed)
+        if remaining > target:
+            removed = set(removed)
+            by_use = sorted((e[2], k) for k, e in entries.iteritems()
+                if k not in removed)
+            removed.update(k for used, k in by_use[:remaining - target])
+        for key in removed:
+            del entries[key]
+            self._pending.append((key,))
+
+    def _schedule_flush(self):
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        else:
+            self._start_timer()
+
+    def _start_timer(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.sync_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+            Writes pending changes to the file
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        if self._damaged or \
+                self._written > 2 * len(self._entries) + self.batch_size:
+            written = self._rewrite()
+        else:
+            written = self._append()
+        if written:
+            self._pending = []
+        else:
+            # keep the changes and try again later
+            self._start_timer()
+
+    def _append(self):
+        try:
+            with open(self.location, 'ab') as f:
+                for record in self._pending:
+                    pickle.dump(record, f, PICKLE_PROTOCOL)
+        except (IOError, OSError):
+            logger.exception("Could not write to %s", self.location)
+            # part of a record may have been written, appending after
+            # it would make the following changes unreadable
+            self._damaged = True
+            return False
+        self._written += len(self._pending)
+        return True
+
+    def _rewrite(self):
+        now = time.time()
+        entries = [(e[2], k, e[0], e[1])
+            for k, e in self._entries.iteritems()
+            if e[0] is None or e[0] > now]
+        # keep the order of use, it is restored from it
+        entries.sort()
+        try:
+            with open(self.location + '.new', 'wb') as f:
+                for used, key, expires, value in entries:
+                    pickle.dump((key, expires, value), f, PICKLE_PROTOCOL)
+            os.rename(self.location + '.new', self.location)
+        except (IOError, OSError):
+            logger.exception("Could not write %s", self.location)
+            return False
+        self._written = len(entries)
+        self._damaged = False
+        return True
+
+    def __getitem__(self, key):
+        missing = self._entries
+        value = self.get(key, missing)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._entries[key]
+            self._pending.append((key,))
+            self._schedule_flush()
+
+    def __contains__(self, key):
+        return self.get(key, self._entries) is not self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
 def walk(root):
     """
         Walk through a Gio directory, yielding each file
@@ -432,36 +660,59 @@ def walk(root):
         :returns: a generator object
         :rtype: :class:`Gio.File`
     """
+    for fil, fileinfo in walk_with_info(root):
+        yield fil
+
+def walk_with_info(root):
+    """
+        Same as :func:`walk`, but yields (:class:`Gio.File`,
+        :class:`Gio.FileInfo`) tuples. The file info holds the
+        ``standard::type`` and ``time::modified`` attributes of the
+        file, and is None for root.
+    """
     queue = deque()
-    queue.append(root)
+    queue.append((root, None))
 
     while len(queue) > 0:
-        dir = queue.pop()
-        yield dir
+        dir, dirinfo = queue.pop()
+        yield dir, dirinfo
         try:
-            for fileinfo in dir.enumerate_children("standard::type,"
-                    "standard::is-symlink,standard::name,"
-                    "standard::symlink-target,time::modified",
-                    Gio.FileQueryInfoFlags.NONE, None):
-                fil = dir.get_child(fileinfo.get_name())
-                # FIXME: recursive symlinks could cause an infinite loop
-                if fileinfo.get_is_symlink():
-                    target = fileinfo.get_symlink_target()
-                    if not "://" in target and not os.path.isabs(target):
-                        fil2 = dir.get_child(target)
-                    else:
-                        fil2 = Gio.File.new_for_uri(target)
-                    # already in the collection, we'll get it anyway
-                    if fil2.has_prefix(root):
-                        continue
-                type = fileinfo.get_file_type()
-                if type == Gio.FileType.DIRECTORY:
-                    queue.append(fil)
-                elif type == Gio.FileType.REGULAR:
-                    yield fil
+            for fil, fileinfo in walk_children(dir, root):
+                if fileinfo.get_file_type() == Gio.FileType.DIRECTORY:
+                    queue.append((fil, fileinfo))
+                else:
+                    yield fil, fileinfo
         except GLib.Error: # why doesnt gio offer more-specific errors?
             logger.exception("Unhandled exception while walking on %s.", dir)
 
+def walk_children(dir, root):
+    """
+        Yields the directories and regular files directly inside dir as
+        (:class:`Gio.File`, :class:`Gio.FileInfo`) tuples, like
+        :func:`walk_with_info` does while walking root. Symlinks to
+        locations inside root are skipped.
+
+        :raises: :class:`GLib.Error` if dir cannot be enumerated
+    """
+    for fileinfo in dir.enumerate_children("standard::type,"
+            "standard::is-symlink,standard::name,"
+            "standard::symlink-target,time::modified",
+            Gio.FileQueryInfoFlags.NONE, None):
+        fil = dir.get_child(fileinfo.get_name())
+        # FIXME: recursive symlinks could cause an infinite loop
+        if fileinfo.get_is_symlink():
+            target = fileinfo.get_symlink_target()
+            if not "://" in target and not os.path.isabs(target):
+                fil2 = dir.get_child(target)
+            else:
+                fil2 = Gio.File.new_for_uri(target)
+            # already in the collection, we'll get it anyway
+            if fil2.has_prefix(root):
+                continue
+        type = fileinfo.get_file_type()
+        if type == Gio.FileType.DIRECTORY or type == Gio.FileType.REGULAR:
+            yield fil, fileinfo
+
 def walk_directories(root):
     """
         Walk through a Gio directory, yielding each subdirectory
@@ -29,11 +29,13 @@ Provides the base for obtaining and storing covers, also known
 as album art.
 """
 
+from collections import OrderedDict
 from gi.repository import GLib
 from gi.repository import Gio
 import logging
 import hashlib
 import os
+import threading
 try:
     import cPickle as pickle
 except ImportError:
@@ -51,6 +53,10 @@ from xl import (
 
 logger = logging.getLogger(__name__)
 
+#: Sizes of the scaled down covers kept by :class:`CoverManager`, see
+#: :meth:`CoverManager.get_thumbnail_data`
+THUMBNAIL_SIZES = (32, 64, 128, 256)
+
 
 # TODO: maybe this could go into common.py instead? could be
 # useful in other areas.
@@ -61,46 +67,205 @@ class Cacher(object):
         Note that as entries are stored as
         individual files, the data being stored should be of significant
         size (several KB) or a lot of disk space will likely be wasted.
+
+        The total size of the entries can be bounded, in which case the
+        least recently used entries are removed when it is exceeded.
+        Modification times of the files are used to remember the order
+        in which entries were used between runs. Pinned entries are never
+        removed that way and don't count towards the size.
     """
-    def __init__(self, cache_dir):
+    def __init__(self, cache_dir, max_size=None, on_removed=None):
         """
             :param cache_dir: directory to use for the cache. will be
                 created if it does not exist.
+            :param max_size: maximum total size of the entries in bytes,
+                or None for no limit
+            :param on_removed: called with a list of keys when entries
+                are removed to stay below max_size
         """
         try:
             os.makedirs(cache_dir)
         except OSError:
             pass
         self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.on_removed = on_removed
+        self._sync_lock = threading.RLock()
+        # key -> size of the entries, least recently used first. Only
+        # read from the cache directory once it is needed.
+        self.__sizes = None
+        self.__total = 0
+        self.__pinned_path = cache_dir.rstrip(os.sep) + '.pinned'
+        self.__pinned = None
+
+    def __get_pinned(self):
+        if self.__pinned is None:
+            try:
+                with open(self.__pinned_path, 'rb') as f:
+                    self.__pinned = set(f.read().split())
+            except IOError:
+                self.__pinned = set()
+        return self.__pinned
+
+    def __save_pinned(self):
+        try:
+            with open(self.__pinned_path + '.new', 'wb') as f:
+                f.write(''.join('%s\n' % key for key in self.__pinned))
+            os.rename(self.__pinned_path + '.new', self.__pinned_path)
+        except (IOError, OSError):
+            logger.exception("Could not save %s", self.__pinned_path)
+
+    def __get_sizes(self):
+        if self.__sizes is None:
+            entries = []
+            try:
+                names = os.listdir(self.cache_dir)
+            except OSError:
+                names = []
+            for name in names:
+                try:
+                    st = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name, st.st_size))
+            entries.sort()
+            pinned = self.__get_pinned()
+            entries = [e for e in entries if e[1] not in pinned]
+            self.__sizes = OrderedDict(
+                (name, size) for mtime, name, size in entries)
+            self.__total = sum(self.__sizes.itervalues())
+        return self.__sizes
+
+    def __touch(self, key, size):
+        """
+            Marks key as the most recently used entry
+        """
+        sizes = self.__get_sizes()
+        if key in self.__get_pinned():
+            return
+        self.__total -= sizes.pop(key, 0)
+        sizes[key] = size
+        self.__total += size
+
+    def __discard(self, key):
+        sizes = self.__get_sizes()
+        self.__total -= sizes.pop(key, 0)
+        pinned = self.__get_pinned()
+        if key in pinned:
+            pinned.discard(key)
+            self.__save_pinned()
+        try:
+            os.remove(os.path.join(self.cache_dir, key))
+        except OSError:
+            pass
+
+    def is_pinned(self, key):
+        """
+            Returns whether an entry is pinned
+        """
+        with self._sync_lock:
+            return key in self.__get_pinned()
+
+    def pin(self, key):
+        """
+            Keeps an entry from being removed to stay below the maximum
+            size, until :meth:`unpin` is called for it
+        """
+        with self._sync_lock:
+            sizes = self.__get_sizes()
+            pinned = self.__get_pinned()
+            if key in pinned:
+                return
+            self.__total -= sizes.pop(key, 0)
+            pinned.add(key)
+            self.__save_pinned()
+
+    def unpin(self, key):
+        """
+            Lets an entry be removed to stay below the maximum size again.
+            It is the first to be removed then, as it is likely not used
+            anymore.
+        """
+        with self._sync_lock:
+            pinned = self.__get_pinned()
+            if key not in pinned:
+                return
+            pinned.discard(key)
+            self.__save_pinned()
+            try:
+                size = os.path.getsize(os.path.join(self.cache_dir, key))
+            except OSError:
+                return
+            sizes = self.__get_sizes()
+            self.__sizes = OrderedDict([(key, size)] + sizes.items())
+            self.__total += size
+        self.__shrink()
+
+    def set_max_size(self, max_size):
+        """
+            Changes the maximum total size, removing entries if needed
+
+            :param max_size: the size in bytes, or None for no limit
+        """
+        self.max_size = max_size
+        self.__shrink()
 
-    def add(self, data):
+    def __shrink(self, keep=None):
+        if self.max_size is None:
+            return
+        removed = []
+        with self._sync_lock:
+            sizes = self.__get_sizes()
+            for key in list(sizes):
+                if self.__total <= self.max_size:
+                    break
+                if key == keep:
+                    continue
+                self.__discard(key)
+                removed.append(key)
+        # on_removed is called without holding the lock, it will likely
+        # want to lock its owner
+        if removed:
+            logger.debug("Removed %d entries from %s", len(removed),
+                self.cache_dir)
+            if self.on_removed is not None:
+                self.on_removed(removed)
+
+    def add(self, data, key=None, pinned=False):
         """
             Adds an entry to the cache.  Returns a key that can be used
             to retrieve the data from the cache.
 
             :param data: The data to store, as a bytestring.
-        """
-        # FIXME: this doesnt handle hash collisions at all. with
-        # 2^256 possible keys its unlikely that we'll have a collision,
-        # but we should handle it anyway.
-        h = hashlib.sha256()
-        h.update(data)
-        key = h.hexdigest()
+            :param key: The key to store the data under. Defaults to
+                the hash of the data.
+            :param pinned: Whether to pin the entry, see :meth:`pin`
+        """
+        if key is None:
+            # FIXME: this doesnt handle hash collisions at all. with
+            # 2^256 possible keys its unlikely that we'll have a collision,
+            # but we should handle it anyway.
+            h = hashlib.sha256()
+            h.update(data)
+            key = h.hexdigest()
         path = os.path.join(self.cache_dir, key)
-        open(path, "wb").write(data)
+        with open(path, "wb") as f:
+            f.write(data)
+        if pinned:
+            self.pin(key)
+        with self._sync_lock:
+            self.__touch(key, len(data))
+        self.__shrink(keep=key)
         return key
 
+    @common.synchronized
     def remove(self, key):
         """
             Remove an entry from the cache.
 
             :param key: The key to remove data for.
         """
-        path = os.path.join(self.cache_dir, key)
-        try:
-            os.remove(path)
-        except OSError:
-            pass
+        self.__discard(key)
 
     def get(self, key):
         """
@@ -110,9 +275,18 @@ class Cacher(object):
             :param key: The key to retrieve data for.
         """
         path = os.path.join(self.cache_dir, key)
-        if os.path.exists(path):
-            return open(path, "rb").read()
-        return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except IOError:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._sync_lock:
+            self.__touch(key, len(data))
+        return data
 
 
 class CoverManager(providers.ProviderHandler):
@@ -124,12 +298,24 @@ class CoverManager(providers.ProviderHandler):
             :param location: The directory to load and store data in.
         """
         providers.ProviderHandler.__init__(self, "covers")
-        self.__cache = Cacher(os.path.join(location, 'cache'))
+        cache_size = self.__get_cache_size()
+        self.__cache = Cacher(os.path.join(location, 'cache'), cache_size,
+            self._on_cache_removed)
+        self.__thumbnails = Cacher(os.path.join(location, 'thumbnails'),
+            self.__get_thumbnails_size(cache_size))
         self.location = location
         self.methods = {}
         self.order = settings.get_option(
                 'covers/preferred_order', [])
         self.db = {}
+        # Entries of db changed since the last save, None for removed ones
+        self.__changes = OrderedDict()
+        self.__db_lock = threading.RLock()
+        self.__search = providers.ConcurrentSearch()
+        # results of the last few searches, so that asking again for the
+        # same track right away doesn't search again
+        self.__found = common.LimitedCache(5)
+        self.__found_lock = threading.Lock()
         self.load()
         for method in self.get_providers():
             self.on_provider_added(method)
@@ -159,7 +345,70 @@ class CoverManager(providers.ProviderHandler):
                 providers.register('covers', self.localfile_fetcher)
             else:
                 providers.unregister('covers', self.localfile_fetcher)
+        elif data == "covers/cache_size":
+            cache_size = self.__get_cache_size()
+            self.__cache.set_max_size(cache_size)
+            self.__thumbnails.set_max_size(
+                self.__get_thumbnails_size(cache_size))
 
+    def __get_cache_size(self):
+        """
+            Returns the maximum size of the cover cache in bytes
+        """
+        size = settings.get_option('covers/cache_size', 200)
+        if size is None or size <= 0:
+            return None
+        return int(size * 1024 * 1024)
+
+    def __get_thumbnails_size(self, cache_size):
+        if cache_size is None:
+            return None
+        return cache_size // 4
+
+    def __set_entry(self, key, db_string):
+        """
+            Changes the db entry for key, None removes it
+        """
+        with self.__db_lock:
+            old = self.db.get(key)
+            if db_string is None:
+                self.db.pop(key, None)
+            else:
+                self.db[key] = db_string
+            self.__changes.pop(key, None)
+            self.__changes[key] = db_string
+        if old is not None and old != db_string:
+            self.remove_thumbnails(old)
+            self.__unpin_unused(old)
+        return old
+
+    def __unpin_unused(self, db_string):
+        """
+            Lets a cover chosen by the user be removed from the cache
+            once no album uses it anymore
+        """
+        source, key = db_string.split(":", 1)
+        if source != "cache" or not self.__cache.is_pinned(key):
+            return
+        with self.__db_lock:
+            if db_string in self.db.itervalues():
+                return
+        self.__cache.unpin(key)
+
+    def _on_cache_removed(self, keys):
+        """
+            Called when cached covers were removed to stay within the
+            cache size, forgets about the albums using them
+        """
+        removed = set("cache:%s" % k for k in keys)
+        with self.__db_lock:
+            albums = [k for k, v in self.db.iteritems() if v in removed]
+        for key in albums:
+            self.__set_entry(key, None)
+        for db_string in removed:
+            self.remove_thumbnails(db_string)
+        if albums:
+            self.timeout_save()
 
     def _get_methods(self, fixed=False):
         """
@@ -224,31 +473,47 @@ class CoverManager(providers.ProviderHandler):
 
         return self.db.get(key)
 
-    @common.synchronized
-    @common.cached(5)
-    def find_covers(self, track, limit=-1, local_only=False):
+    def find_covers(self, track, limit=-1, local_only=False, refresh=False):
         """
             Find all covers for a track
 
+            Local sources are searched first, the others are searched
+            concurrently, see :class:`xl.providers.ConcurrentSearch`.
+
             :param track: The track to find covers for
             :param limit: maximum number of covers to return. -1=unlimited.
             :param local_only: If True, will only return results from local
                     sources.
+            :param refresh: If True, search again even if the last search
+                    for the album found nothing.
         """
         if track is None:
             return
-        covers = []
-        for method in self._get_methods(fixed=True):
-            if local_only and method.use_cache:
-                continue
-            new = method.find_covers(track, limit=limit)
-            new = ["%s:%s"%(method.name, x) for x in new]
-            covers.extend(new)
-            if limit != -1 and len(covers) >= limit:
-                break
-        return covers
-
-    def set_cover(self, track, db_string, data=None):
+        key = (track, limit, local_only)
+        if not refresh:
+            with self.__found_lock:
+                found = self.__found.get(key)
+            if found is not None:
+                return list(found)
+
+        methods = self._get_methods(fixed=True)
+        if local_only:
+            methods = [m for m in methods if not m.use_cache]
+
+        def query(method):
+            return ["%s:%s" % (method.name, x)
+                for x in method.find_covers(track, limit=limit)]
+
+        album = self._get_track_key(track)
+        if album is None:
+            album = track.get_loc_for_io()
+        found = self.__search.search((album, limit, local_only), methods,
+            query, limit, lambda m: not m.use_cache, refresh)
+        with self.__found_lock:
+            self.__found[key] = found
+        return list(found)
+
+    def set_cover(self, track, db_string, data=None, automatic=False):
         """
             Sets the cover for a track. This will overwrite any existing
             entry.
@@ -258,14 +523,18 @@ class CoverManager(providers.ProviderHandler):
                     cover, in "method:key" format.
             :param data: The raw cover data to store for the track.  Will
                     only be stored if the method has use_cache=True
+            :param automatic: Whether the cover was found by a search
+                    rather than chosen by the user. Only those are
+                    forgotten when the cache gets too large.
         """
         name = db_string.split(":", 1)[0]
         method = self.methods.get(name)
         if method and method.use_cache and data:
-            db_string = "cache:%s"%self.__cache.add(data)
+            db_string = "cache:%s" % self.__cache.add(data,
+                pinned=not automatic)
         key = self._get_track_key(track)
         if key:
-            self.db[key] = db_string
+            self.__set_entry(key, db_string)
             self.timeout_save()
             event.log_event('cover_set', self, track)
 
@@ -278,8 +547,11 @@ class CoverManager(providers.ProviderHandler):
         key = self._get_track_key(track)
         db_string = self.db.get(key)
         if db_string:
-            del self.db[key]
-            self.__cache.remove(db_string)
+            self.__set_entry(key, None)
+            source, data = db_string.split(":", 1)
+            # cached covers are shared by all albums having the same image
+            if source == "cache" and db_string not in self.db.values():
+                self.__cache.remove(data)
             self.timeout_save()
             event.log_event('cover_removed', self, track)
 
@@ -313,7 +585,7 @@ class CoverManager(providers.ProviderHandler):
             cover = covers[0]
             data = self.get_cover_data(cover, use_default=use_default)
             if save_cover and data != self.get_default_cover():
-                self.set_cover(track, cover, data)
+                self.set_cover(track, cover, data, automatic=True)
             return data
 
         return self.get_default_cover() if use_default else None
@@ -338,6 +610,43 @@ class CoverManager(providers.ProviderHandler):
             ret = self.get_default_cover()
         return ret
 
+    def __get_thumbnail_key(self, db_string, size):
+        h = hashlib.sha256()
+        h.update(db_string.encode('utf-8')
+            if isinstance(db_string, unicode) else db_string)
+        return "%s-%d" % (h.hexdigest(), size)
+
+    def get_thumbnail_data(self, db_string, size):
+        """
+            Get the image data of a thumbnail previously stored with
+            :meth:`set_thumbnail_data`.
+
+            :param db_string: The db_string identifying the cover.
+            :param size: One of :data:`THUMBNAIL_SIZES`.
+            :returns: the data, or None if there is no such thumbnail
+        """
+        return self.__thumbnails.get(
+            self.__get_thumbnail_key(db_string, size))
+
+    def set_thumbnail_data(self, db_string, size, data):
+        """
+            Store a scaled down version of a cover, so that it doesn't
+            need to be decoded at full size again.
+
+            :param db_string: The db_string identifying the cover.
+            :param size: One of :data:`THUMBNAIL_SIZES`, the larger side
+                    of the thumbnail
+            :param data: The image data of the thumbnail.
+        """
+        self.__thumbnails.add(data, self.__get_thumbnail_key(db_string, size))
+
+    def remove_thumbnails(self, db_string):
+        """
+            Remove all stored thumbnails of a cover.
+        """
+        for size in THUMBNAIL_SIZES:
+            self.__thumbnails.remove(self.__get_thumbnail_key(db_string, size))
+
     def get_default_cover(self):
         """
             Get the raw image data for the cover to show if there is no
@@ -349,6 +658,9 @@ class CoverManager(providers.ProviderHandler):
     def load(self):
         """
             Load the saved db
+
+            The db is stored as a pickled dict, followed by a log of the
+            changes made since it was written.
         """
         path = os.path.join(self.location, 'covers.db')
         data = None
@@ -369,6 +681,33 @@ class CoverManager(providers.ProviderHandler):
         if data:
             self.db = data
 
+        try:
+            f = open(path + ".log", 'rb')
+        except IOError:
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            while True:
+                offset = f.tell()
+                if offset >= size:
+                    break
+                try:
+                    key, db_string = pickle.load(f)
+                except Exception:
+                    # an incomplete change at the end, drop it so that
+                    # new changes can be appended after the good ones
+                    logger.warning("Ignoring damaged end of %s.log", path)
+                    try:
+                        with open(path + ".log", 'r+b') as log:
+                            log.truncate(offset)
+                    except IOError:
+                        pass
+                    break
+                if db_string is None:
+                    self.db.pop(key, None)
+                else:
+                    self.db[key] = db_string
+
     @common.glib_wait_seconds(60)
     def timeout_save(self):
         self.save()
@@ -376,28 +715,63 @@ class CoverManager(providers.ProviderHandler):
     def save(self):
         """
             Save the db
+
+            Changes are appended to the log, until it gets larger than
+            the saved dict. The whole db is written again then.
         """
         path = os.path.join(self.location, 'covers.db')
-        try:
-            f = open(path + ".new", 'wb')
-            pickle.dump(self.db, f, common.PICKLE_PROTOCOL)
-            f.close()
-        except IOError:
-            return
-        try:
-            os.rename(path, path + ".old")
-        except OSError:
-            pass # if it doesn'texist we don't care
-        os.rename(path + ".new", path)
-        try:
-            os.remove(path + ".old")
-        except OSError:
-            pass
+        with self.__db_lock:
+            changes = self.__changes
+            self.__changes = OrderedDict()
+            if changes:
+                try:
+                    with open(path + ".log", 'ab') as f:
+                        for item in changes.iteritems():
+                            pickle.dump(item, f, common.PICKLE_PROTOCOL)
+                except IOError:
+                    self.__changes = changes
+                    return
+            elif os.path.exists(path):
+                return
+
+            try:
+                log_size = os.path.getsize(path + ".log")
+            except OSError:
+                log_size = 0
+            try:
+                db_size = os.path.getsize(path)
+            except OSError:
+                db_size = 0
+            if db_size and log_size <= max(db_size, 64 * 1024):
+                return
+
+            # The log already contains every change, so replaying it
+            # after the new db is in place does no harm if we don't get
+            # to remove it.
+            try:
+                f = open(path + ".new", 'wb')
+                pickle.dump(self.db, f, common.PICKLE_PROTOCOL)
+                f.close()
+            except IOError:
+                return
+            try:
+                os.rename(path, path + ".old")
+            except OSError:
+                pass # if it doesn'texist we don't care
+            os.rename(path + ".new", path)
+            for loc in [path + ".old", path + ".log"]:
+                try:
+                    os.remove(loc)
+                except OSError:
+                    pass
 
     def on_provider_added(self, provider):
         self.methods[provider.name] = provider
         if provider.name not in self.order:
             self.order.append(provider.name)
+        self.__search.forget()
+        with self.__found_lock:
+            self.__found.clear()
 
     def on_provider_removed(self, provider):
         try:
@@ -429,6 +803,9 @@ class CoverSearchMethod(object):
     """
     #: If true, cover results will be cached for faster lookup
     use_cache = True
+    #: Seconds to wait for results of this method in a search, None for
+    #: the default
+    search_timeout = None
     #: A name uniquely identifing the search method.
     name = "base"
     #: Whether the backend should have a fixed priority instead of being
@@ -27,6 +27,7 @@
 import logging
 import os
 import random
+import shutil
 import time
 
 from xl.nls import gettext as _
@@ -43,9 +44,15 @@ class DynamicManager(providers.ProviderHandler):
         providers.ProviderHandler.__init__(self, "dynamic_playlists")
         self.buffersize = settings.get_option("playback/dynamic_buffer", 5)
         self.collection = collection
-        self.cachedir = os.path.join(xdg.get_cache_dir(), 'dynamic')
-        if not os.path.exists(self.cachedir):
-            os.makedirs(self.cachedir)
+        # artists -> (time of the query, similar artists), outdated
+        # results are still used if the sources can't be reached
+        self.cache = common.PersistentCache(
+            os.path.join(xdg.get_cache_dir(), 'dynamic.db'),
+            ttl=4 * 604800, max_entries=2000)
+        # results used to be kept in one file per artist
+        shutil.rmtree(os.path.join(xdg.get_cache_dir(), 'dynamic'),
+            ignore_errors=True)
+        event.add_callback(self.on_quit_application, 'quit_application')
 
     def find_similar_tracks(self, track, limit=-1, exclude=[]):
         """
@@ -105,39 +112,28 @@ class DynamicManager(providers.ProviderHandler):
     def _load_saved_info(self, track):
         artist = track.get_tag_raw('artist')
         if not artist: return []
-        filename = os.path.join(self.cachedir, ','.join(artist))
-        if not os.path.exists(filename):
+        saved = self.cache.get(','.join(artist))
+        if saved is None:
             return []
-        f = open(filename)
-        line = f.readline()
-        if line == '':
-            return []
-        last_update = float(line)
+        last_update, info = saved
         if 604800 < time.time() - last_update: # one week
-            info = self._query_sources(track)
-            if info != []:
-                self._save_info(track, info)
-                return info
-        info = []
-        for line in f:
-            try:
-                rel, artist = line.strip().split(" ",1)
-                info.append((rel, artist))
-            except Exception:
-                pass
-        f.close()
-        return info
+            new_info = self._query_sources(track)
+            if new_info != []:
+                self._save_info(track, new_info)
+                return new_info
+        return list(info)
 
     def _save_info(self, track, info):
         if info == []:
             return
-        filename = os.path.join(self.cachedir,
-                track.get_tag_raw('artist', join=True))
-        f = open(filename, 'w')
-        f.write("%s\n"%time.time())
-        for item in info:
-            f.write("%.2f %s\n"%item)
-        f.close()
+        artist = track.get_tag_raw('artist')
+        self.cache[','.join(artist)] = (time.time(), info)
+
+    def on_quit_application(self, e, exaile, nothing):
+        """
+            Writes the changes to the cache
+        """
+        self.cache.flush()
 
     def populate_playlist(self, playlist):
         """
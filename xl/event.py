@@ -35,8 +35,13 @@ be listened for by ANY object.
 
 Events should be emitted AFTER the given event has taken place. Often the
 most appropriate spot is immediately before a return statement.
+
+Listeners that can get many events in a row, e.g. `track_tags_changed`
+during a rescan, can use :func:`add_batch_callback` to get the events
+of a main loop iteration in a single call.
 """
 
+from collections import Counter, OrderedDict
 from inspect import ismethod
 import logging
 import re
@@ -129,6 +134,36 @@ def add_ui_callback(function, evty=None, obj=None, *args, **kwargs):
     global EVENT_MANAGER
     return EVENT_MANAGER.add_callback(function, evty, obj, args, kwargs, ui=True)
 
+def add_batch_callback(function, evty=None, obj=None, coalesce=False,
+        *args, **kwargs):
+    """
+        Adds a callback that is called on the UI thread, once per main
+        loop iteration, with the events sent since the last call.
+
+        The callback is called with a list of (type, object, data) tuples
+        in the order the events were sent, followed by any additional
+        parameters.
+
+        :param function: the function to call when events happen
+        :type function: callable
+        :param evty: the *type* or *name* of the event to listen for.
+                Defaults to any event if not specified.
+        :type evty: string
+        :param obj: the object to listen to events from. Defaults to any
+                object if not specified.
+        :type obj: object
+        :param coalesce: if True, only the last event of each type and
+                object is passed, at the place of the first one. Use this
+                if the callback does not depend on the data of the events
+                it would miss.
+        :type coalesce: bool
+
+        :returns: a convenience function that you can call to remove the callback.
+    """
+    global EVENT_MANAGER
+    return EVENT_MANAGER.add_callback(function, evty, obj, args, kwargs,
+            batch=True, coalesce=coalesce)
+
 def remove_callback(function, evty=None, obj=None):
     """
         Removes a callback. Can remove both ui and non-ui callbacks.
@@ -177,6 +212,17 @@ class Callback(object):
     def __repr__(self):
         return '<Callback %s>' % self.wfunction()
 
+class BatchCallback(Callback):
+    """
+        Represents a callback getting events in batches
+    """
+
+    __slots__ = ['coalesce']
+
+    def __init__(self, function, time, args, kwargs, coalesce):
+        Callback.__init__(self, function, time, args, kwargs)
+        self.coalesce = coalesce
+
 class _WeakMethod(object):
     """Represent a weak bound method, i.e. a method doesn't keep alive the
     object that it is bound to. It uses WeakRef which, used on its own,
@@ -253,6 +299,7 @@ class EventManager(object):
         self.all_callbacks = {}
         self.callbacks = {}
         self.ui_callbacks = {}
+        self.batch_callbacks = {}
         self.use_logger = use_logger
         self.use_verbose_logger = verbose
         self.logger_filter = logger_filter
@@ -264,6 +311,21 @@ class EventManager(object):
         self.pending_ui = []
         self.pending_ui_lock = threading.Lock()
 
+        # BatchCallback -> events not delivered yet, a list or, if the
+        # callback coalesces, an OrderedDict keyed by type and object
+        self.pending_batches = {}
+
+        # (id of callback table, event type) -> (callbacks for any
+        # object, tables of callbacks by object), see _get_callbacks
+        self.lookup_cache = {}
+
+        #: Number of events sent, by type
+        self.emitted = Counter()
+        #: Number of callback calls made, by event type. A batch
+        #: callback call counts once per event it gets.
+        self.dispatched = Counter()
+        # Both counters are only updated under lock
+
     def emit(self, event):
         """
             Emits an Event, calling any registered callbacks.
@@ -275,6 +337,12 @@ class EventManager(object):
                    re.search(self.logger_filter, event.type))
         emit_verbose = emit_logmsg and self.use_verbose_logger
         
+        with self.lock:
+            self.emitted[event.type] += 1
+
+        if self.batch_callbacks:
+            self._queue_batches(event)
+
         global _UiThread
         is_ui_thread = (threading.current_thread() == _UiThread)
         
@@ -302,19 +370,47 @@ class EventManager(object):
         for event in events:
             self._emit(*event)
     
-    def _emit(self, event, exc_callbacks, emit_logmsg, emit_verbose):
-        
-        # Accumulate in this set to ensure callbacks only get called once
-        callbacks = set()
-        
-        with self.lock:
-            for tcall in [_NONE, event.type]:
-                tcb = exc_callbacks.get(tcall)
-                if tcb is not None:
-                    for ocall in [_NONE, event.object]:
-                        ocb = tcb.get(ocall)
+    def _get_callbacks(self, event, exc_callbacks):
+        """
+            Returns the callbacks in exc_callbacks registered for event
+
+            The callbacks registered for any object are kept by event
+            type, until callbacks are added or removed, so that only
+            the callbacks registered for specific objects have to be
+            looked up under the lock.
+        """
+        key = (id(exc_callbacks), event.type)
+        entry = self.lookup_cache.get(key)
+        if entry is None:
+            # Accumulate in this set to ensure callbacks only get called once
+            callbacks = set()
+            tables = []
+            with self.lock:
+                for tcall in [_NONE, event.type]:
+                    tcb = exc_callbacks.get(tcall)
+                    if tcb is not None:
+                        ocb = tcb.get(_NONE)
                         if ocb is not None:
                             callbacks.update(ocb)
+                        if len(tcb) > (ocb is not None):
+                            tables.append(tcb)
+                entry = self.lookup_cache[key] = (frozenset(callbacks),
+                        tuple(tables))
+
+        callbacks, tables = entry
+        if tables:
+            callbacks = set(callbacks)
+            with self.lock:
+                for tcb in tables:
+                    ocb = tcb.get(event.object)
+                    if ocb is not None:
+                        callbacks.update(ocb)
+        return callbacks
+
+    def _emit(self, event, exc_callbacks, emit_logmsg, emit_verbose):
+        
+        callbacks = self._get_callbacks(event, exc_callbacks)
+        dispatched = 0
         
         # However, do not actually call the callbacks from within the lock
         # -> Otherwise non-ui threads could accidentally block the UI if
@@ -332,6 +428,7 @@ class EventManager(object):
                             exc_callbacks[event.type][event.object].remove(cb)
                         except (KeyError, ValueError):
                             pass
+                        self.lookup_cache.clear()
                 elif event.time >= cb.time:
                     if emit_verbose:
                         logger.debug("Attempting to call "
@@ -339,12 +436,17 @@ class EventManager(object):
                                 "to %(event)s." % {
                                     'function': fn,
                                     'event': event.type})
+                    dispatched += 1
                     fn.__call__(event.type, event.object,
                                 event.data, *cb.args, **cb.kwargs)
                 fn = None
             except Exception:
                 # something went wrong inside the function we're calling
                 logger.exception("Event callback exception caught!")
+
+        if dispatched:
+            with self.lock:
+                self.dispatched[event.type] += dispatched
         
         if emit_logmsg:
             logger.debug("Sent '%(type)s' event from "
@@ -352,13 +454,61 @@ class EventManager(object):
                         {'type' : event.type, 'object' : repr(event.object),
                         'data' : repr(event.data)})
 
+    def _queue_batches(self, event):
+        """
+            Queues event for the batch callbacks registered for it
+        """
+        callbacks = self._get_callbacks(event, self.batch_callbacks)
+        if not callbacks:
+            return
+
+        with self.pending_ui_lock:
+            do_emit = not self.pending_batches
+            for cb in callbacks:
+                if event.time < cb.time:
+                    continue
+                events = self.pending_batches.get(cb)
+                if cb.coalesce:
+                    if events is None:
+                        events = self.pending_batches[cb] = OrderedDict()
+                    events[(event.type, id(event.object))] = event
+                else:
+                    if events is None:
+                        events = self.pending_batches[cb] = []
+                    events.append(event)
+
+        if do_emit and self.pending_batches:
+            GLib.idle_add(self._emit_batches)
+
+    def _emit_batches(self):
+        with self.pending_ui_lock:
+            batches = self.pending_batches
+            self.pending_batches = {}
+
+        for cb, events in batches.iteritems():
+            if cb.coalesce:
+                events = events.values()
+            try:
+                fn = cb.wfunction()
+                if fn is None:
+                    continue
+                with self.lock:
+                    for event in events:
+                        self.dispatched[event.type] += 1
+                fn.__call__([(e.type, e.object, e.data) for e in events],
+                            *cb.args, **cb.kwargs)
+                fn = None
+            except Exception:
+                logger.exception("Event callback exception caught!")
+
     def emit_async(self, event):
         """
             Same as emit(), but does not block.
         """
         GLib.idle_add(self.emit, event)
 
-    def add_callback(self, function, evty, obj, args, kwargs, ui=False):
+    def add_callback(self, function, evty, obj, args, kwargs, ui=False,
+            batch=False, coalesce=False):
         """
             Registers a callback.
             You should always specify at least one of event type or object.
@@ -368,18 +518,29 @@ class EventManager(object):
                 to any. [string]
             @param obj: The object to listen to events from. Defaults
                 to any. [string]
+            @param batch: Whether to call the function with the events
+                of a main loop iteration, see add_batch_callback [bool]
+            @param coalesce: Whether a batch only needs the last event
+                of each type and object [bool]
                 
             Returns a convenience function that you can call to 
             remove the callback.
         """
         
-        if ui:
+        if batch:
+            all_cbs = [self.batch_callbacks]
+        elif ui:
             all_cbs = [self.ui_callbacks, self.all_callbacks]
         else:
             all_cbs = [self.callbacks, self.all_callbacks] 
         
         with self.lock:
-            cb = Callback(function, time.time(), args, kwargs)
+            if batch:
+                cb = BatchCallback(function, time.time(), args, kwargs,
+                        coalesce)
+            else:
+                cb = Callback(function, time.time(), args, kwargs)
+            self.lookup_cache.clear()
             
             # add the specified categories if needed.
             for cbs in all_cbs:
@@ -413,7 +574,9 @@ class EventManager(object):
             obj = _NONE
         
         with self.lock:
-            for cbs in [self.callbacks, self.all_callbacks, self.ui_callbacks]:
+            self.lookup_cache.clear()
+            for cbs in [self.callbacks, self.all_callbacks, self.ui_callbacks,
+                    self.batch_callbacks]:
                 remove = []
                 try:
                     callbacks = cbs[evty][obj]
@@ -427,6 +590,9 @@ class EventManager(object):
     
                 for cb in remove:
                     callbacks.remove(cb)
+                    if cbs is self.batch_callbacks:
+                        with self.pending_ui_lock:
+                            self.pending_batches.pop(cb, None)
                 
                 if len(callbacks) == 0:
                     del cbs[evty][obj]
@@ -189,6 +189,7 @@ class Formatter(GObject.GObject):
 
         self._template = ParameterTemplate(format)
         self._substitutions = {}
+        self._compiled = None
 
     def do_get_property(self, property):
         """
@@ -227,49 +228,106 @@ class Formatter(GObject.GObject):
             :returns: the extractions
             :rtype: dict
         """
-        matches = self._template.pattern.finditer(self._template.template)
         extractions = {}
 
-        # Extract list of identifiers and parameters from the format string
-        for match in matches:
-            groups = match.groupdict()
+        for segment in self._get_segments():
+            if isinstance(segment, tuple):
+                needle, identifier, parameters, text = segment
+                extractions[needle] = (identifier, dict(parameters))
+
+        return extractions
+
+    def _get_segments(self):
+        """
+            Returns the format string split into literal text and
+            identifiers, which are tuples of the substitution needle,
+            the identifier, its parameters and the text to leave in
+            place if there is no substitution.
+
+            The result is kept until the format string changes.
+        """
+        template = self._template.template
+        compiled = self._compiled
+
+        if compiled is None or compiled[0] != template:
+            compiled = self._compiled = (template, self._compile(template))
+
+        return compiled[1]
 
-            # We only care about braced and named, not escaped and invalid
+    def _compile(self, template):
+        """
+            Splits a format string into segments, see :meth:`_get_segments`
+        """
+        delimiter = self._template.delimiter
+        segments = []
+        literal = []
+        position = 0
+
+        for match in self._template.pattern.finditer(template):
+            literal.append(template[position:match.start()])
+            position = match.end()
+            groups = match.groupdict()
             identifier = groups['braced'] or groups['named']
 
+            # Escaped and invalid delimiters become a plain delimiter
             if identifier is None:
+                literal.append(delimiter)
                 continue
 
             identifier_parts = [identifier]
             parameters = {}
 
             if groups['parameters'] is not None:
-                # Split parameters on unescaped comma
-                parameters = [p.lstrip() \
-                    for p in re.split(r'(?<!\\),', groups['parameters'])]
-                # Split arguments on unescaped equals sign
-                parameters = [(re.split(r'(?<!\\)=', p, 1) + [True])[:2] \
-                    for p in parameters]
-                # Turn list of lists into a proper dictionary
-                parameters = dict(parameters)
-
-                # Remove now obsolete escapes
-                for p in parameters:
-                    argument = parameters[p]
-
-                    if type(argument) is not bool:
-                        argument = argument.replace(r'\,', ',')
-                        argument = argument.replace(r'\}', '}')
-                        argument = argument.replace(r'\=', '=')
-                        parameters[p] = argument
-
+                parameters = self._parse_parameters(groups['parameters'])
                 identifier_parts += [groups['parameters']]
 
             # Required to make multiple occurences of the same
             # identifier with different parameters work
-            extractions[':'.join(identifier_parts)] = (identifier, parameters)
+            needle = ':'.join(identifier_parts)
 
-        return extractions
+            if groups['braced'] is not None:
+                text = delimiter + '{' + needle + '}'
+            else:
+                text = delimiter + needle
+
+            literal = ''.join(literal)
+            if literal:
+                segments.append(literal)
+            literal = []
+            segments.append((needle, identifier, parameters, text))
+
+        literal.append(template[position:])
+        literal = ''.join(literal)
+        if literal:
+            segments.append(literal)
+
+        return segments
+
+    @staticmethod
+    def _parse_parameters(parameters):
+        """
+            Turns the parameters of an identifier into a dictionary
+        """
+        # Split parameters on unescaped comma
+        parameters = [p.lstrip() \
+            for p in re.split(r'(?<!\\),', parameters)]
+        # Split arguments on unescaped equals sign
+        parameters = [(re.split(r'(?<!\\)=', p, 1) + [True])[:2] \
+            for p in parameters]
+        # Turn list of lists into a proper dictionary
+        parameters = dict(parameters)
+
+        # Remove now obsolete escapes
+        for p in parameters:
+            argument = parameters[p]
+
+            if type(argument) is not bool:
+                argument = argument.replace(r'\,', ',')
+                argument = argument.replace(r'\}', '}')
+                argument = argument.replace(r'\=', '=')
+                parameters[p] = argument
+
+        return parameters
 
     def format(self, *args):
         """
@@ -279,43 +337,59 @@ class Formatter(GObject.GObject):
             :returns: the formatted text
             :rtype: string
         """
-        extractions = self.extract()
-        substitutions = {}
+        return self._render(self._substitutions, args)
 
-        for needle, (identifier, parameters) in extractions.iteritems():
+    def _render(self, substitutions, args=()):
+        """
+            Fills the substitutions into the format string
+        """
+        parts = []
+
+        for segment in self._get_segments():
+            if not isinstance(segment, tuple):
+                parts.append(segment)
+                continue
+
+            needle, identifier, parameters, text = segment
             substitute = None
 
-            if needle in self._substitutions:
-                substitute = self._substitutions[needle]
-            elif identifier in self._substitutions:
-                substitute = self._substitutions[identifier]
+            if needle in substitutions:
+                substitute = substitutions[needle]
+            elif identifier in substitutions:
+                substitute = substitutions[identifier]
+
+            if substitute is None:
+                parts.append(text)
+                continue
 
-            if substitute is not None:
-                prefix = parameters.pop('prefix', '')
-                suffix = parameters.pop('suffix', '')
-                pad = int(parameters.pop('pad', 0))
-                padstring = parameters.pop('padstring', '')
+            parameters = dict(parameters)
+            prefix = parameters.pop('prefix', '')
+            suffix = parameters.pop('suffix', '')
+            pad = int(parameters.pop('pad', 0))
+            padstring = parameters.pop('padstring', '')
 
-                if callable(substitute):
-                    substitute = substitute(*args, **parameters)
+            if callable(substitute):
+                substitute = substitute(*args, **parameters)
 
-                if pad > 0 and padstring:
-                    # Decrease pad length by value length
-                    pad = max(0, pad - len(substitute))
-                    # Retrieve the maximum multiplier for the pad string
-                    padcount = pad / len(padstring) + 1
-                    # Generate pad string
-                    padstring = padcount * padstring
-                    # Clamp pad string
-                    padstring = padstring[0:pad]
-                    substitute = '%s%s' % (padstring, substitute)
+            if pad > 0 and padstring:
+                # Decrease pad length by value length
+                pad = max(0, pad - len(substitute))
+                # Retrieve the maximum multiplier for the pad string
+                padcount = pad / len(padstring) + 1
+                # Generate pad string
+                padstring = padcount * padstring
+                # Clamp pad string
+                padstring = padstring[0:pad]
+                substitute = '%s%s' % (padstring, substitute)
 
-                if substitute:
-                    substitute = '%s%s%s' % (prefix, substitute, suffix)
+            if substitute:
+                substitute = '%s%s%s' % (prefix, substitute, suffix)
 
-                substitutions[needle] = substitute
+            # We use this idiom instead of str() because the latter
+            # will fail if val is a Unicode containing non-ASCII
+            parts.append('%s' % (substitute,))
 
-        return self._template.safe_substitute(substitutions)
+        return ''.join(parts)
 
 class ProgressTextFormatter(Formatter):
     """
@@ -375,6 +449,58 @@ class TrackFormatter(Formatter):
     """
         A formatter for track data
     """
+    def __init__(self, format, cache=False):
+        """
+            :param format: the initial format, see the documentation
+                of :class:`string.Template` for details
+            :type format: string
+            :param cache: whether to remember the formatted text of each
+                track until its tags change
+            :type cache: bool
+        """
+        Formatter.__init__(self, format)
+
+        self._cache = cache
+        self._tag_segments = None
+
+    def _get_tag_segments(self):
+        """
+            Returns the identifiers of the format string with the function
+            formatting each of them, and whether all of them only depend on
+            the tags of the track
+        """
+        segments = self._get_segments()
+        compiled = self._tag_segments
+
+        if compiled is None or compiled[0] is not segments \
+                or compiled[1] != _TAG_PROVIDERS_VERSION:
+            tag_segments = []
+            needles = set()
+            cacheable = True
+
+            for segment in segments:
+                if not isinstance(segment, tuple) or segment[0] in needles:
+                    continue
+
+                needle, tag, parameters, text = segment
+                needles.add(needle)
+                provider = providers.get_provider('tag-formatting', tag)
+
+                if provider is None:
+                    function = lambda track, parameters, tag=tag: \
+                        track.get_tag_display(tag)
+                else:
+                    function = provider.format
+                    cacheable = cacheable and \
+                        getattr(provider, 'cacheable', False)
+
+                tag_segments.append((needle, function, parameters))
+
+            compiled = self._tag_segments = (segments,
+                _TAG_PROVIDERS_VERSION, tag_segments, cacheable)
+
+        return compiled[2], compiled[3]
+
     def format(self, track, markup_escape=False):
         """
             Returns a string for places where
@@ -392,28 +518,51 @@ class TrackFormatter(Formatter):
             raise TypeError('First argument to format() needs '
                             'to be of type xl.trax.Track')
 
-        extractions = self.extract()
-        self._substitutions = {}
+        tag_segments, cacheable = self._get_tag_segments()
 
-        for identifier, (tag, parameters) in extractions.iteritems():
-            provider = providers.get_provider('tag-formatting', tag)
+        if self._cache and cacheable:
+            key = ('format', self, self._template.template, markup_escape,
+                _TAG_PROVIDERS_VERSION)
+            return track.get_cached(key, self._format, track, tag_segments,
+                markup_escape)
 
-            if provider is None:
-                substitute = track.get_tag_display(tag)
-            else:
-                substitute = provider.format(track, parameters)
+        return self._format(track, tag_segments, markup_escape)
+
+    def _format(self, track, tag_segments, markup_escape):
+        substitutions = {}
+
+        for needle, function, parameters in tag_segments:
+            substitute = function(track, dict(parameters))
 
             if markup_escape:
                 substitute = GLib.markup_escape_text(substitute).decode('utf-8')
 
-            self._substitutions[identifier] = substitute
+            substitutions[needle] = substitute
 
-        return Formatter.format(self)
+        return self._render(substitutions)
+
+# Incremented whenever tag formatters are added or removed, so that
+# track formatters look them up again
+_TAG_PROVIDERS_VERSION = 0
+
+def _on_tag_providers_changed(type, manager, data):
+    global _TAG_PROVIDERS_VERSION
+    _TAG_PROVIDERS_VERSION += 1
+
+event.add_callback(_on_tag_providers_changed,
+    'tag-formatting_provider_added')
+event.add_callback(_on_tag_providers_changed,
+    'tag-formatting_provider_removed')
 
 class TagFormatter(object):
     """
         A formatter provider for a tag of a track
     """
+    #: Whether the formatted value only depends on the tags of the track,
+    #: which allows :class:`TrackFormatter` to cache it. Providers that
+    #: can't tell, e.g. because they read settings, must leave it unset
+    cacheable = False
+
     def __init__(self, name):
         """
             :param name: the name of the tag
@@ -442,6 +591,8 @@ class NumberTagFormatter(TagFormatter):
         
         Removes count values, e.g. "b" in "a/b"
     """
+    cacheable = True
+
     def __init__(self, name):
         """
             :param name: the name of the tag
@@ -500,6 +651,8 @@ class ArtistTagFormatter(TagFormatter):
     """
         A formatter for the artist of a track
     """
+    cacheable = True
+
     def __init__(self):
         TagFormatter.__init__(self, 'artist')
 
@@ -530,6 +683,8 @@ class TimeTagFormatter(TagFormatter):
     """
         A formatter for a time period
     """
+    cacheable = True
+
     def format(self, track, parameters):
         """
             Formats a raw tag value
@@ -640,6 +795,9 @@ class RatingTagFormatter(TagFormatter):
         
         Will return glyphs representing the rating like ★★★☆☆
     """
+    # Depends on the rating/maximum setting
+    cacheable = False
+
     def __init__(self):
         TagFormatter.__init__(self, '__rating')
 
@@ -667,6 +825,8 @@ class YearTagFormatter(TagFormatter):
     """
         A pseudo-tag that computes the year from the date column 
     """
+    cacheable = True
+
     def __init__(self):
         TagFormatter.__init__(self, 'year')
         
@@ -689,6 +849,9 @@ class DateTagFormatter(TagFormatter):
         Will return the localized string for *Today*, *Yesterday*
         or the respective localized date for earlier dates
     """
+    # Depends on the current date
+    cacheable = False
+
     def __init__(self, name):
         """
             :param name: the name of the tag
@@ -750,6 +913,8 @@ class LocationTagFormatter(TagFormatter):
         A formatter for the location of a track,
         properly sanitized if necessary
     """
+    cacheable = True
+
     def __init__(self):
         TagFormatter.__init__(self, '__loc')
 
@@ -774,6 +939,10 @@ class CommentTagFormatter(TagFormatter):
     """
         A formatter for comments embedded in tracks
     """
+    # Read from the file, which changes the tags of the track when it is
+    # read again (at least __modified)
+    cacheable = True
+
     def __init__(self):
         TagFormatter.__init__(self, 'comment')
 
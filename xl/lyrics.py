@@ -28,10 +28,9 @@ from datetime import (
     datetime,
     timedelta
 )
+import glob
 import os
-import shelve
 import zlib
-import threading
 
 from xl.nls import gettext as _
 from xl import (
@@ -45,66 +44,6 @@ from xl import (
 class LyricsNotFoundException(Exception):
     pass
 
-class LyricsCache:
-    '''
-        Basically just a thread-safe shelf for convinience.  
-        Supports container syntax.
-    '''
-    def __init__(self, location, default=None):
-        '''
-            @param location: specify the shelve file location
-            
-            @param default: can specify a default to return from getter when
-                there is nothing in the shelve
-        '''
-        self.location = location
-        try:
-            self.db = shelve.open(location, flag='c', protocol=common.PICKLE_PROTOCOL, writeback=False)
-        except ImportError:
-            import bsddb3 # ArchLinux disabled bsddb in python2, so we have to use the external module
-            _db = bsddb3.hashopen(location, 'c')
-            self.db = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
-        self.lock = threading.Lock()
-        self.default = default
-
-    def keys(self):
-        '''
-            Return the shelve keys
-        '''
-        return self.db.keys()
-        
-    def _get(self, key, default=None):
-        with self.lock:
-            try:
-                return self.db[key]
-            except Exception:
-                return default if default is not None else self.default
-                
-    def _set(self, key, value):
-        with self.lock:
-            self.db[key] = value
-            # force save, wasn't auto-saving...
-            self.db.sync()
-                
-    def __getitem__(self, key):
-        return self._get(key)
-        
-    def __setitem__(self, key, value):
-        self._set(key, value)
-        
-    def __contains__(self, key):
-        return key in self.db
-
-    def __delitem__(self, key):
-        with self.lock:
-            del self.db[key]
-
-    def __iter__(self):
-        return self.db.__iter__()
-        
-    def __len__(self):
-        return len(self.db)
-
 class LyricsManager(providers.ProviderHandler):
     """
         Lyrics Manager
@@ -116,9 +55,20 @@ class LyricsManager(providers.ProviderHandler):
         providers.ProviderHandler.__init__(self, "lyrics")
         self.preferred_order = settings.get_option(
                 'lyrics/preferred_order', [])
-        self.cache = LyricsCache(os.path.join(xdg.get_cache_dir(), 'lyrics.cache'))
+        self.cache = common.PersistentCache(
+            os.path.join(xdg.get_cache_dir(), 'lyrics.db'),
+            max_entries=5000)
+        # the cache used to be a shelve, its entries are fetched again
+        for filename in glob.glob(
+                os.path.join(xdg.get_cache_dir(), 'lyrics.cache*')):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        self.__search = providers.ConcurrentSearch()
 
         event.add_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.add_callback(self.on_quit_application, 'quit_application')
 
     def __get_cache_key(self, track, provider):
         """
@@ -168,20 +118,11 @@ class LyricsManager(providers.ProviderHandler):
             :raise LyricsNotFoundException: when lyrics are not
                 found
         """
-        lyrics = None
-        source = None
-        url = None
-
-        for method in self.get_providers():
-            try:
-                (lyrics, source, url) = self._find_cached_lyrics(method, track, refresh)
-            except LyricsNotFoundException:
-                continue
-            break
-        else:
-            # This only happens if all providers raised LyricsNotFoundException.
+        found = self.__search_lyrics(track, 1, refresh)
+        if not found:
             raise LyricsNotFoundException()
 
+        (method, lyrics, source, url) = found[0]
         lyrics = lyrics.strip()
 
         return (lyrics, source, url)
@@ -203,24 +144,42 @@ class LyricsManager(providers.ProviderHandler):
             :raise LyricsNotFoundException: when lyrics are not
                 found from all sources.
         """
-        lyrics_found=[]
-
-        for method in self.get_providers():
-            lyrics = None
-            source = None
-            url = None
-            try:
-                (lyrics, source, url) = self._find_cached_lyrics(method, track, refresh)
-            except LyricsNotFoundException:
-                continue
-            lyrics = lyrics.strip()
-            lyrics_found.append((method.display_name, lyrics, source, url))
+        lyrics_found = [(method.display_name, lyrics.strip(), source, url)
+            for (method, lyrics, source, url)
+            in self.__search_lyrics(track, -1, refresh)]
 
         if not lyrics_found:
             # no lyrics were found, raise an exception
             raise LyricsNotFoundException()
 
         return lyrics_found
+
+    def __search_lyrics(self, track, limit, refresh):
+        """
+            Asks the providers for lyrics, the local ones first and the
+            others concurrently.
+
+            :return: list of tuples of the provider, lyrics, source and url
+        """
+        def query(method):
+            try:
+                (lyrics, source, url) = self._find_cached_lyrics(method,
+                    track, refresh)
+            except LyricsNotFoundException:
+                return []
+            return [(method, lyrics, source, url)]
+
+        return self.__search.search(self.__get_search_key(track, limit),
+            self.get_providers(), query, limit,
+            lambda m: isinstance(m, LocalLyricSearch), refresh)
+
+    def __get_search_key(self, track, limit):
+        return (
+            track.get_loc_for_io(),
+            track.get_tag_display('artist'),
+            track.get_tag_display('title'),
+            limit,
+        )
         
     def _find_cached_lyrics(self, method, track, refresh=False):
         """
@@ -248,8 +207,9 @@ class LyricsManager(providers.ProviderHandler):
         key = self.__get_cache_key(track, method)
 
         # check cache for lyrics
-        if key in self.cache:
-            (lyrics, source, url, time) = self.cache[key]
+        cached = self.cache.get(key)
+        if cached is not None:
+            (lyrics, source, url, time) = cached
             # return if they are not expired
             now = datetime.now()
             if (now-time < timedelta(hours=cache_time) and not refresh):
@@ -264,7 +224,9 @@ class LyricsManager(providers.ProviderHandler):
 
         # update cache
         time = datetime.now()
-        self.cache[key] = (zlib.compress(lyrics.encode('utf-8')), source, url, time)
+        self.cache.set(key,
+            (zlib.compress(lyrics.encode('utf-8')), source, url, time),
+            ttl=cache_time * 3600)
 
         return (lyrics, source, url)
 
@@ -280,11 +242,23 @@ class LyricsManager(providers.ProviderHandler):
         except (ValueError, AttributeError):
             pass
 
+    def on_provider_added(self, provider):
+        """
+            Forgets about searches that found nothing, the new provider
+            may find something.
+
+            :param provider: the provider instance being added.
+        """
+        self.__search.forget()
+
     def on_track_tags_changed(self, e, track, tag):
         """
             Updates the internal cache upon lyric tag changes
         """
         if tag == 'lyrics':
+            self.__search.forget(self.__get_search_key(track, 1))
+            self.__search.forget(self.__get_search_key(track, -1))
+
             local_provider = self.get_provider('__local')
 
             # If the local tag provider was removed, don't bother
@@ -299,12 +273,21 @@ class LyricsManager(providers.ProviderHandler):
             except KeyError:
                 pass
 
+    def on_quit_application(self, e, exaile, nothing):
+        """
+            Writes the changes to the cache
+        """
+        self.cache.flush()
+
 MANAGER = LyricsManager()
 
 class LyricSearchMethod(object):
     """
         Lyrics plugins will subclass this
     """
+    #: Seconds to wait for results of this method in a search, None for
+    #: the default
+    search_timeout = None
 
     def find_lyrics(self, track):
         """
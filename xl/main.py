@@ -216,9 +216,31 @@ def create_argument_parser():
         default=True, help=_("Disable D-Bus support"))
     group.add_argument('--no-hal', dest='Hal', action='store_false',
         default=True, help=_("Disable HAL support."))
+    group.add_argument('--startup-profile', dest='StartupProfile',
+        action='store_true', default=False, help=_("Log how long each"
+        " step of starting up takes"))
 
     return p
 
+class _StartupAttribute(object):
+    """
+        An attribute set by a startup step under its name with a leading
+        underscore. Using it runs the step, or waits for it, the first
+        time; the value is then kept on the instance, where it is found
+        before this descriptor.
+    """
+    def __init__(self, step, name):
+        self.step = step
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        obj.startup.require(self.step)
+        value = getattr(obj, '_' + self.name)
+        obj.__dict__[self.name] = value
+        return value
+
 class Exaile(object):
     _exaile = None
 
@@ -238,10 +260,20 @@ class Exaile(object):
     queue = property(__get_queue)
     lyrics = property(__get_lyrics)
 
+    # Loaded by the startup steps, the first use waits for them
+    collection = _StartupAttribute('collection', 'collection')
+    devices = _StartupAttribute('devices', 'devices')
+    smart_playlists = _StartupAttribute('smart_playlists', 'smart_playlists')
+    stations = _StartupAttribute('radio', 'stations')
+    radio = _StartupAttribute('radio', 'radio')
+
     def __init__(self):
         """
             Initializes Exaile.
         """
+        from xl.startup import StartupScheduler
+        self.startup = StartupScheduler()
+
         self.quitting = False
         self.loading = True
 
@@ -390,6 +422,102 @@ class Exaile(object):
 
         firstrun = settings.get_option("general/first_run", True)
 
+        # Slow steps that don't depend on each other run at the same
+        # time: the collection is loaded while GStreamer and the plugins
+        # are, and devices are probed for while the player, the playlists
+        # and the interface are set up, without the window waiting for
+        # them. The radio and smart playlists are only loaded when
+        # needed, which the panels do once the window is shown.
+        self.udisks2 = None
+        self.udisks = None
+        self.hal = None
+
+        startup = self.startup
+        startup.add('migrations', lambda: self.__migrate(firstrun))
+        startup.add('collection', self.__load_collection,
+            depends=['migrations'], threaded=True)
+        startup.add('gstreamer', self.__init_gstreamer)
+        startup.add('plugins', self.__load_plugins,
+            depends=['migrations', 'gstreamer'])
+        startup.add('player', self.__load_player,
+            depends=['plugins', 'collection'])
+        startup.add('playlists', self.__load_playlists,
+            depends=['collection', 'player'])
+        startup.add('devices', self.__load_devices,
+            depends=['plugins'])
+        startup.add('device_discovery', self.__discover_devices,
+            depends=['devices'], background=True)
+        startup.add('smart_playlists', self.__load_smart_playlists,
+            depends=['playlists'], deferred=True)
+        startup.add('radio', self.__load_radio,
+            depends=['playlists'], deferred=True)
+        startup.run()
+
+        from xl import event, player
+
+        if firstrun:
+            self._add_default_playlists()
+
+        self.gui = None
+        # Setup GUI
+        if self.options.StartGui:
+            logger.info("Loading interface...")
+
+            import xlgui
+            self.gui = xlgui.Main(self)
+            self.gui.main.window.show_all()
+            self.startup.mark('window shown')
+            event.log_event("gui_loaded", self, None)
+
+            if splash is not None:
+                splash.destroy()
+
+        self.startup.wait()
+
+        if firstrun:
+            settings.set_option("general/first_run", False)
+
+        self.loading = False
+        Exaile._exaile = self
+        event.log_event("exaile_loaded", self, None)
+        self.startup.mark('exaile loaded')
+
+        restore = True
+
+        if self.gui:
+            # Find out if the user just passed in a list of songs
+            # TODO: find a better place to put this
+            
+            songs = [ Gio.File.new_for_path(arg).get_uri() for arg in self.options.locs ]
+            if len(songs) > 0:
+                restore = False
+                self.gui.open_uri(songs[0], play=True)
+                for arg in songs[1:]:
+                    self.gui.open_uri(arg)
+            
+            # kick off autoscan of libraries
+            # -> don't do it in command line mode, since that isn't expected
+            self.gui.rescan_collection_with_progress(True)
+
+        if restore:
+            player.QUEUE._restore_player_state(
+                    os.path.join(xdg.get_data_dir(), 'player.state'))
+
+        # load what hasn't been needed yet once the window is up
+        if self.gui:
+            from gi.repository import GLib
+            GLib.idle_add(self.__startup_done)
+        else:
+            self.__startup_done()
+
+        # pylint: enable-msg=W0201
+
+    def __startup_done(self):
+        self.startup.run_deferred()
+        if self.options.StartupProfile:
+            logger.info(self.startup.report())
+
+    def __migrate(self, firstrun):
         if not self.options.NoImport and \
                 (firstrun or self.options.ForceImport):
             try:
@@ -412,7 +540,8 @@ class Exaile(object):
         # Migrate engines
         from xl.migrations.settings import engine
         engine.migrate()
-        
+
+    def __init_gstreamer(self):
         # TODO: enable audio plugins separately from normal
         #       plugins? What about plugins that use the player?
         
@@ -422,6 +551,7 @@ class Exaile(object):
         from gi.repository import Gst
         Gst.init(None)
 
+    def __load_plugins(self):
         # Initialize plugin manager
         from xl import plugins
         self.plugins = plugins.PluginsManager(self)
@@ -432,110 +562,69 @@ class Exaile(object):
         else:
             logger.info("Safe mode enabled, not loading plugins.")
 
+    def __load_collection(self):
         # Initialize the collection
         logger.info("Loading collection...")
         from xl import collection
         try:
-            self.collection = collection.Collection("Collection",
+            self._collection = collection.Collection("Collection",
                     location=os.path.join(xdg.get_data_dir(), 'music.db'))
         except common.VersionError:
             logger.exception("VersionError loading collection")
             sys.exit(1)
 
+    def __load_player(self):
         from xl import event
         # Set up the player and playback queue
         from xl import player
         event.log_event("player_loaded", player.PLAYER, None)
 
+    def __load_playlists(self):
+        from xl import event
         # Initalize playlist manager
         from xl import playlist
         self.playlists = playlist.PlaylistManager()
-        self.smart_playlists = playlist.SmartPlaylistManager('smart_playlists',
-            collection=self.collection)
-        if firstrun:
-            self._add_default_playlists()
         event.log_event("playlists_loaded", self, None)
 
         # Initialize dynamic playlist support
         from xl import dynamic
         dynamic.MANAGER.collection = self.collection
 
+    def __load_smart_playlists(self):
+        from xl import playlist
+        self._smart_playlists = playlist.SmartPlaylistManager(
+            'smart_playlists', collection=self.collection)
+
+    def __load_devices(self):
+        from xl import event
         # Initalize device manager
         logger.info("Loading devices...")
         from xl import devices
-        self.devices = devices.DeviceManager()
+        self._devices = devices.DeviceManager()
         event.log_event("device_manager_ready", self, None)
 
+    def __discover_devices(self):
         # Initialize dynamic device discovery interface
         # -> if initialized and connected, then the object is not None
-        
-        self.udisks2 = None
-        self.udisks = None
-        self.hal = None
-        
         if self.options.Hal:
             from xl import hal
                 
-            udisks2 = hal.UDisks2(self.devices)
+            udisks2 = hal.UDisks2(self._devices)
             if udisks2.connect():
                 self.udisks2 = udisks2
             else:
-                udisks = hal.UDisks(self.devices)
+                udisks = hal.UDisks(self._devices)
                 if udisks.connect():
                     self.udisks = udisks
                 else:
-                    self.hal = hal.HAL(self.devices)
+                    self.hal = hal.HAL(self._devices)
                     self.hal.connect()
-        else:
-            self.hal = None
 
+    def __load_radio(self):
         # Radio Manager
-        from xl import radio
-        self.stations = playlist.PlaylistManager('radio_stations')
-        self.radio = radio.RadioManager()
-
-        self.gui = None
-        # Setup GUI
-        if self.options.StartGui:
-            logger.info("Loading interface...")
-
-            import xlgui
-            self.gui = xlgui.Main(self)
-            self.gui.main.window.show_all()
-            event.log_event("gui_loaded", self, None)
-
-            if splash is not None:
-                splash.destroy()
-
-        if firstrun:
-            settings.set_option("general/first_run", False)
-
-        self.loading = False
-        Exaile._exaile = self
-        event.log_event("exaile_loaded", self, None)
-
-        restore = True
-
-        if self.gui:
-            # Find out if the user just passed in a list of songs
-            # TODO: find a better place to put this
-            
-            songs = [ Gio.File.new_for_path(arg).get_uri() for arg in self.options.locs ]
-            if len(songs) > 0:
-                restore = False
-                self.gui.open_uri(songs[0], play=True)
-                for arg in songs[1:]:
-                    self.gui.open_uri(arg)
-            
-            # kick off autoscan of libraries
-            # -> don't do it in command line mode, since that isn't expected
-            self.gui.rescan_collection_with_progress(True)
-
-        if restore:
-            player.QUEUE._restore_player_state(
-                    os.path.join(xdg.get_data_dir(), 'player.state'))
-
-        # pylint: enable-msg=W0201
+        from xl import playlist, radio
+        self._stations = playlist.PlaylistManager('radio_stations')
+        self._radio = radio.RadioManager()
 
     def version(self):
         from xl.version import __version__
@@ -689,7 +778,8 @@ class Exaile(object):
 
         # Save order of custom playlists
         self.playlists.save_order()
-        self.stations.save_order()
+        if self.startup.is_done('radio'):
+            self.stations.save_order()
 
         # save player, queue
         from xl import player
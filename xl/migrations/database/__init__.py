@@ -29,13 +29,27 @@ import os
 from xl import common
 
 
-def handle_migration(db, pdata, oldversion, newversion):
-    if oldversion == 1 and newversion == 2:
-        migrator = imp.load_source("from1to2",
-                os.path.join(os.path.dirname(__file__), "from1to2.py"))
-        migrator.migrate(db, pdata, oldversion, newversion)
-    else:
+def handle_migration(db, pdata, oldversion, newversion, location=None):
+    """
+        Upgrades the music database in pdata from oldversion to
+        newversion, one version at a time.
+
+        :param location: where the database was loaded from. Needed
+            for upgrades to version 3 and above, which change the
+            on-disk format.
+    """
+    oldversion = int(oldversion)
+    newversion = int(newversion)
+    if not 1 <= oldversion < newversion <= 3:
         raise common.VersionError("Don't know how to handle upgrade from " \
                 "music database version %s to %s."%(oldversion, newversion))
 
+    for version in range(oldversion, newversion):
+        name = "from%dto%d" % (version, version + 1)
+        migrator = imp.load_source(name,
+                os.path.join(os.path.dirname(__file__), name + ".py"))
+        if version + 1 >= 3:
+            migrator.migrate(db, pdata, version, version + 1, location)
+        else:
+            migrator.migrate(db, pdata, version, version + 1)
 
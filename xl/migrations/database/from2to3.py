@@ -0,0 +1,61 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Converts the shelve-based music database into the columnar store
+    used by :class:`xl.trax.TrackDB` (see :mod:`xl.trax.store`).
+"""
+
+import logging
+
+from xl.trax.store import TrackStore
+
+logger = logging.getLogger(__name__)
+
+def migrate(db, pdata, oldversion, newversion, location):
+    attrs = {}
+    records = []
+    locs = set()
+    for k in pdata.keys():
+        if k.startswith("tracks-"):
+            tags, key, holder_attrs = pdata[k]
+            loc = tags.get('__loc')
+            if not loc:
+                continue
+            if loc in locs:
+                logger.warning("Duplicate track found: %s" % loc)
+                continue
+            locs.add(loc)
+            records.append((loc, key, tags, holder_attrs))
+        else:
+            attrs[k] = pdata[k]
+    attrs['_dbversion'] = newversion
+
+    # The store replaces the shelve file, so the shelve must not be
+    # touched anymore
+    pdata.close()
+
+    TrackStore(location).write_snapshot(attrs, records)
@@ -29,6 +29,7 @@ Provides the fundamental objects for handling a list of tracks contained
 in playlists as well as methods to import and export from various file formats.
 """
 
+from bisect import bisect_left, insort
 import cgi
 from collections import namedtuple
 from datetime import datetime, timedelta
@@ -36,6 +37,8 @@ from gi.repository import Gio
 import logging
 import os
 import random
+import struct
+import threading
 import time
 import urlparse
 import urllib
@@ -857,6 +860,313 @@ class XSPFConverter(FormatConverter):
         return playlist
 providers.register('playlist-format-converter', XSPFConverter())
 
+# Playlists are saved as _PLAYLIST_MAGIC followed by records: a kind,
+# the length of the payload and the pickled payload. Changes made after
+# a save are appended as further records, see Playlist.save_to_location
+_PLAYLIST_MAGIC = 'EXAILE_PLAYLIST\n'
+_RECORD_HEADER = struct.Struct('!cI')
+#: (position, [(uri, tags), ...]), tracks inserted at position
+_RECORD_TRACKS = 'T'
+#: (start, end), tracks removed
+_RECORD_REMOVE = 'R'
+#: {attribute: value}, replaces the attributes of earlier records
+_RECORD_ATTRS = 'A'
+#: tags saved with each track, for tracks that can't be read on load
+_SAVED_TAGS = ('artist', 'album', 'tracknumber', 'title', 'genre', 'date')
+
+def _get_track_entry(track):
+    tags = {}
+    for tag in _SAVED_TAGS:
+        value = track.get_tag_raw(tag)
+        if value is not None:
+            tags[tag] = value
+    return track.get_loc_for_io(), tags
+
+def _encode_record(kind, data):
+    payload = pickle.dumps(data, common.PICKLE_PROTOCOL)
+    return _RECORD_HEADER.pack(kind, len(payload)) + payload
+
+def _read_records(f):
+    """
+        Yields (kind, data) for the records of a playlist file up to
+        its end or up to the first incomplete record, e.g. from a save
+        that was interrupted. The file is left at the end of the last
+        complete record.
+    """
+    while True:
+        start = f.tell()
+        header = f.read(_RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) == _RECORD_HEADER.size:
+            kind, length = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) == length:
+                try:
+                    data = pickle.loads(payload)
+                except Exception:
+                    pass
+                else:
+                    yield kind, data
+                    continue
+        logger.warning("Ignoring incomplete record at the end of %s", f.name)
+        f.seek(start)
+        return
+
+def _get_tracks(entries):
+    """
+        Returns the tracks for saved (uri, tags) entries. Tracks that
+        are already known, e.g. from the collection, are used as they
+        are. Other tracks get the saved tags, and local ones have their
+        tags read from their files in the background.
+    """
+    tracks = []
+    unknown = []
+    for uri, tags in entries:
+        track = trax.Track(uri=uri, scan=False)
+        if track._init: # just created, see Track.__new__
+            for tag, value in tags.iteritems():
+                track.set_tag_raw(tag, value, notify_changed=False)
+            if track.is_local():
+                unknown.append(track)
+        tracks.append(track)
+    if unknown:
+        _read_tags(unknown)
+    return tracks
+
+@common.threaded
+def _read_tags(tracks):
+    for track in tracks:
+        track.read_tags()
+
+def _get_file_size(location):
+    try:
+        return os.path.getsize(location)
+    except OSError:
+        return -1
+
+class _RandomSet(object):
+    """
+        A set that can return a random item in constant time
+    """
+    __slots__ = ['__items', '__indices']
+
+    def __init__(self, items=()):
+        self.__items = []
+        self.__indices = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, item):
+        return item in self.__indices
+
+    def __iter__(self):
+        return iter(self.__items)
+
+    def add(self, item):
+        if item not in self.__indices:
+            self.__indices[item] = len(self.__items)
+            self.__items.append(item)
+
+    def discard(self, item):
+        index = self.__indices.pop(item, None)
+        if index is None:
+            return
+        last = self.__items.pop()
+        if index < len(self.__items):
+            self.__items[index] = last
+            self.__indices[last] = index
+
+    def choice(self):
+        """
+            :raises: IndexError if the set is empty
+        """
+        return random.choice(self.__items)
+
+class _ShuffleIndex(object):
+    """
+        What a playlist needs to pick the next track in a shuffle run
+        without looking at all its tracks: the positions that have not
+        been played yet, the positions that have, in ascending order,
+        and, for album shuffle, the positions of each album.
+
+        Mirrors the "playlist_shuffle_history" metadata of the tracks.
+    """
+    def __init__(self, tracks):
+        """
+            :param tracks: the tracks of the playlist
+            :type tracks: :class:`xl.common.MetadataList`
+        """
+        self.tracks = tracks
+        self.unplayed = _RandomSet()
+        #: positions of the played tracks, ascending
+        self.played = []
+        for i, meta in enumerate(tracks.metadata):
+            if meta and meta.get('playlist_shuffle_history'):
+                self.played.append(i)
+            else:
+                self.unplayed.add(i)
+        self.__albums = None
+        self.__album_unplayed = None
+        self.__album_choices = None
+
+    def __get_album(self, position):
+        album = self.tracks[position].get_tag_raw('album')
+        return tuple(album) if album else None
+
+    def __build_albums(self):
+        albums = {}
+        for position in xrange(len(self.tracks)):
+            albums.setdefault(self.__get_album(position), []).append(position)
+        self.__albums = albums
+        self.__album_unplayed = dict((album, 0) for album in albums)
+        self.__album_choices = _RandomSet()
+        for position in self.unplayed:
+            self.__add_album_unplayed(self.__get_album(position))
+
+    def __add_album_unplayed(self, album):
+        self.__album_unplayed[album] += 1
+        if album is not None:
+            self.__album_choices.add(album)
+
+    def __remove_album_unplayed(self, album):
+        self.__album_unplayed[album] -= 1
+        if not self.__album_unplayed[album]:
+            self.__album_choices.discard(album)
+
+    def reset_albums(self):
+        """
+            Forgets the albums, e.g. after album tags have changed
+        """
+        self.__albums = None
+
+    def __remap(self, move):
+        """
+            Moves the stored positions
+
+            :param move: called with each position, returns the new
+                position or None if the track is gone
+        """
+        if self.__albums is not None:
+            for album, positions in self.__albums.items():
+                kept = []
+                for position in positions:
+                    new = move(position)
+                    if new is not None:
+                        kept.append(new)
+                    elif position in self.unplayed:
+                        self.__remove_album_unplayed(album)
+                if kept:
+                    self.__albums[album] = kept
+                else:
+                    del self.__albums[album]
+                    del self.__album_unplayed[album]
+        unplayed = (move(position) for position in self.unplayed)
+        self.unplayed = _RandomSet(p for p in unplayed if p is not None)
+        # moving keeps the order of the positions
+        played = (move(position) for position in self.played)
+        self.played = [p for p in played if p is not None]
+
+    def insert(self, start, count):
+        """
+            Adds the positions of tracks inserted into the playlist
+
+            :param start: the position of the first inserted track
+            :param count: the number of inserted tracks
+        """
+        if start < len(self.tracks) - count:
+            self.__remap(lambda i: i + count if i >= start else i)
+        for position in xrange(start, start + count):
+            meta = self.tracks.metadata[position]
+            counter = meta.get('playlist_shuffle_history') if meta else None
+            if counter:
+                insort(self.played, position)
+            else:
+                self.unplayed.add(position)
+            if self.__albums is not None:
+                album = self.__get_album(position)
+                self.__albums.setdefault(album, []).append(position)
+                self.__album_unplayed.setdefault(album, 0)
+                if not counter:
+                    self.__add_album_unplayed(album)
+
+    def remove(self, positions):
+        """
+            Forgets the positions of tracks removed from the playlist
+
+            :param positions: the positions the tracks had, ascending
+        """
+        positions = list(positions)
+        gone = set(positions)
+        self.__remap(lambda i: None if i in gone
+            else i - bisect_left(positions, i))
+
+    def mark_played(self, position):
+        if position not in self.unplayed:
+            return
+        self.unplayed.discard(position)
+        insort(self.played, position)
+        if self.__albums is not None:
+            self.__remove_album_unplayed(self.__get_album(position))
+
+    def pop_played(self):
+        """
+            Marks the played position closest to the end of the
+            playlist as unplayed again
+
+            :returns: the position
+            :raises: IndexError if no position was played
+        """
+        position = self.played.pop()
+        self.unplayed.add(position)
+        if self.__albums is not None:
+            self.__add_album_unplayed(self.__get_album(position))
+        return position
+
+    def random_unplayed(self):
+        """
+            :returns: a random unplayed position, or -1
+        """
+        try:
+            return self.unplayed.choice()
+        except IndexError:
+            return -1
+
+    def __first(self, positions, fields):
+        tracks = self.tracks
+        return min(positions,
+            key=lambda i: (tracks[i]._get_sort_key(fields), i))
+
+    def next_on_album(self, position):
+        """
+            :returns: the position of the first track by disc and track
+                number of the album of the track at position, among the
+                tracks after position, or -1
+        """
+        if self.__albums is None:
+            self.__build_albums()
+        positions = [i for i in self.__albums[self.__get_album(position)]
+            if i > position]
+        if not positions:
+            return -1
+        return self.__first(positions, ('discnumber', 'tracknumber'))
+
+    def random_album(self):
+        """
+            :returns: the position of the first track by track number of
+                a random album that has unplayed tracks, or -1
+        """
+        if self.__albums is None:
+            self.__build_albums()
+        try:
+            album = self.__album_choices.choice()
+        except IndexError:
+            return -1
+        return self.__first(self.__albums[album], ('tracknumber',))
+
 class Playlist(object):
     # TODO: how do we document events in sphinx?
     """
@@ -889,7 +1199,7 @@ class Playlist(object):
     dynamic_mode_names = [_('Dynamic _Off'), _('Dynamic by Similar _Artists')]
     save_attrs = ['shuffle_mode', 'repeat_mode', 'dynamic_mode',
             'current_position', 'name']
-    __playlist_format_version = [2, 0]
+    __playlist_format_version = [3, 0]
 
     def __init__(self, name, initial_tracks=[]):
         """
@@ -920,8 +1230,18 @@ class Playlist(object):
         self.__spat_position = -1
         self.__shuffle_history_counter = 1 # start positive so we can
                                 # just do an if directly on the value
+        # built when needed, see __get_shuffle_index
+        self.__shuffle_index = None
+        # changes since the last save as (kind, data) records, None if
+        # the playlist has to be written out in full
+        self.__journal = None
+        # (location, size, size of the last full write, attributes)
+        # of the last save
+        self.__saved = None
         event.add_callback(self.on_playback_track_start,
                 "playback_track_start")
+        event.add_callback(self.on_track_tags_changed,
+                "track_tags_changed")
 
     ### playlist-specific API ###
 
@@ -1039,11 +1359,32 @@ class Playlist(object):
             Clear the history of played
             tracks from a shuffle run
         """
-        for i in xrange(len(self)):
+        if self.__shuffle_index is not None:
+            positions = self.__shuffle_index.played
+        else:
+            positions = xrange(len(self))
+        for i in positions:
             try:
                 self.__tracks.del_meta_key(i, "playlist_shuffle_history")
             except Exception:
                 pass
+        self.__shuffle_index = None
+
+    def __get_shuffle_index(self):
+        if self.__shuffle_index is None:
+            self.__shuffle_index = _ShuffleIndex(self.__tracks)
+        return self.__shuffle_index
+
+    def __add_shuffle_history(self, position):
+        """
+            Marks the track at position as played in the shuffle run
+        """
+        counter = self.__shuffle_history_counter
+        self.__shuffle_history_counter += 1
+        self.__tracks.set_meta_key(position,
+                "playlist_shuffle_history", counter)
+        if self.__shuffle_index is not None:
+            self.__shuffle_index.mark_played(position)
 
     @common.threaded
     def __fetch_dynamic_tracks(self):
@@ -1054,46 +1395,24 @@ class Playlist(object):
             Returns a valid next track if shuffle is activated based
             on random_mode
         """
+        index = self.__get_shuffle_index()
         if mode == "album":
-            # TODO: we really need proper album-level operations in
-            # xl.trax for this
-            try:
-                # Try and get the next track on the album
-                # NB If the user starts the playlist from the middle
-                # of the album some tracks of the album remain off the
-                # tracks_history, and the album can be selected again
-                # randomly from its first track
-                if current_position == -1:
-                    raise IndexError
-                curr = self[current_position]
-                t = [ x for i, x in enumerate(self) \
-                    if x.get_tag_raw('album') == curr.get_tag_raw('album') \
-                    and i > current_position ]
-                t = trax.sort_tracks(['discnumber', 'tracknumber'], t)
-                return self.__tracks.index(t[0]), t[0]
-
-            except IndexError: #Pick a new album
-                hist = set(self.get_shuffle_history())
-                albums = set()
-                for i, x in enumerate(self):
-                    if (i, x) in hist:
-                        continue
-                    alb = x.get_tag_raw('album')
-                    if alb:
-                        albums.add(tuple(alb))
-                if not albums:
-                    return -1, None
-                album = list(random.choice(list(albums)))
-                t = [ x for x in self if x.get_tag_raw('album') == album ]
-                t = trax.sort_tracks(['tracknumber'], t)
-                return self.__tracks.index(t[0]), t[0]
+            # Try and get the next track on the album
+            # NB If the user starts the playlist from the middle
+            # of the album some tracks of the album remain off the
+            # tracks_history, and the album can be selected again
+            # randomly from its first track
+            position = -1
+            if current_position != -1:
+                position = index.next_on_album(current_position)
+            if position == -1: # Pick a new album
+                position = index.random_album()
         else:
-            hist = { i for i, tr in self.get_shuffle_history() }
-            try:
-                return random.choice([ (i, self.__tracks[i]) for i, tr in enumerate(self.__tracks)
-                        if i not in hist])
-            except IndexError: # no more tracks
-                return -1, None
+            position = index.random_unplayed()
+
+        if position == -1: # no more tracks
+            return -1, None
+        return position, self.__tracks[position]
                 
     
     def __get_next(self, current_position):
@@ -1116,9 +1435,7 @@ class Playlist(object):
         
         if shuffle_mode != 'disabled':
             if self.current is not None:
-                self.__tracks.set_meta_key(current_position,
-                        "playlist_shuffle_history", self.__shuffle_history_counter)
-                self.__shuffle_history_counter += 1
+                self.__add_shuffle_history(current_position)
             next_index, next = self.__next_random_track(current_position, shuffle_mode)
             if next is not None:
                 self.__next_data = (None, next_index)
@@ -1198,7 +1515,7 @@ class Playlist(object):
 
         if shuffle_mode != 'disabled':
             try:
-                prev_index, prev = max(self.get_shuffle_history())
+                prev_index = self.__get_shuffle_index().pop_played()
             except IndexError:
                 return self.get_current()
             self.__tracks.del_meta_key(prev_index, 'playlist_shuffle_history')
@@ -1356,56 +1673,73 @@ class Playlist(object):
         l.metadata = [x[1] for x in data]
         self[:] = l
 
-    # TODO[0.4?]: drop our custom disk playlist format in favor of an
-    # extended XSPF playlist (using xml namespaces?).
+    def __get_save_attrs(self):
+        attrs = dict((item, getattr(self, item)) for item in self.save_attrs)
+        attrs['__playlist_format_version'] = self.__playlist_format_version
+        return attrs
 
-    # TODO: add timeout saving support. 5-10 seconds after last change,
-    # perhaps?
+    def __journal_change(self, start, removed, added):
+        """
+            Records that the tracks from start to start + removed were
+            replaced with the added tracks
+        """
+        if self.__journal is None:
+            return
+        if removed:
+            self.__journal.append((_RECORD_REMOVE, (start, start + removed)))
+        if added:
+            self.__journal.append((_RECORD_TRACKS, (start, added)))
 
     def save_to_location(self, location):
         """
             Writes the content of the playlist to a given location
 
+            If the playlist was last saved to or loaded from the same
+            location, only the changes since then are appended to the
+            file, unless that would make it more than twice as large as
+            a full write.
+
             :param location: the location to save to
             :type location: string
         """
-        if os.path.exists(location):
-            f = open(location + ".new", "w")
+        attrs = self.__get_save_attrs()
+        saved = self.__saved
+        data = None
+        if self.__journal is not None and saved is not None \
+                and saved[0] == location \
+                and _get_file_size(location) == saved[1]:
+            records = []
+            for kind, value in self.__journal:
+                if kind == _RECORD_TRACKS:
+                    value = (value[0], [_get_track_entry(tr) for tr in value[1]])
+                records.append(_encode_record(kind, value))
+            if attrs != saved[3]:
+                records.append(_encode_record(_RECORD_ATTRS, attrs))
+            data = ''.join(records)
+            if saved[1] + len(data) > 2 * saved[2]:
+                data = None
+
+        if data is not None:
+            with open(location, 'ab') as f:
+                f.write(data)
+            size, full_size = saved[1] + len(data), saved[2]
         else:
-            f = open(location, "w")
-        for track in self.__tracks:
-            buffer = track.get_loc_for_io()
-            # write track metadata
-            meta = {}
-            items = ('artist', 'album', 'tracknumber',
-                    'title', 'genre', 'date')
-            for item in items:
-                value = track.get_tag_raw(item)
-                if value is not None:
-                    # FIXME: This should join multiple values.
-                    v = value[0]
-                    if isinstance(v, unicode):
-                        v = v.encode('utf-8')
-                    meta[item] = v
-            buffer += '\t%s\n' % urllib.urlencode(meta)
-            try:
-                f.write(buffer.encode('utf-8'))
-            except UnicodeDecodeError:
-                continue
-
-        f.write("EOF\n")
-        for item in self.save_attrs:
-            val = getattr(self, item)
-            try:
-                strn = settings.MANAGER._val_to_str(val)
-            except ValueError:
-                strn = ""
+            entries = [_get_track_entry(tr) for tr in self.__tracks]
+            if os.path.exists(location):
+                f = open(location + ".new", "wb")
+            else:
+                f = open(location, "wb")
+            f.write(_PLAYLIST_MAGIC)
+            f.write(_encode_record(_RECORD_TRACKS, (0, entries)))
+            f.write(_encode_record(_RECORD_ATTRS, attrs))
+            size = full_size = f.tell()
+            f.close()
+            if os.path.exists(location + ".new"):
+                os.remove(location)
+                os.rename(location + ".new", location)
 
-            f.write("%s=%s\n"%(item,strn))
-        f.close()
-        if os.path.exists(location + ".new"):
-            os.remove(location)
-            os.rename(location + ".new", location)
+        self.__journal = []
+        self.__saved = (location, size, full_size, attrs)
         self.__needs_save = self.__dirty = False
 
     def load_from_location(self, location):
@@ -1421,12 +1755,70 @@ class Playlist(object):
         f = None
         for loc in [location, location+".new"]:
             try:
-                f = open(loc, 'r')
+                f = open(loc, 'rb')
                 break
             except Exception:
                 pass
         if not f:
             return
+
+        saved = None
+        if f.read(len(_PLAYLIST_MAGIC)) == _PLAYLIST_MAGIC:
+            entries = []
+            items = None
+            full_size = None
+            for kind, data in _read_records(f):
+                if kind == _RECORD_TRACKS:
+                    entries[data[0]:data[0]] = data[1]
+                elif kind == _RECORD_REMOVE:
+                    del entries[data[0]:data[1]]
+                elif kind == _RECORD_ATTRS:
+                    if items is None:
+                        # a full write ends with the first attributes
+                        full_size = f.tell()
+                    items = data
+            if items is None:
+                items = {}
+            elif loc == location:
+                saved = (location, f.tell(), full_size, items)
+        else:
+            f.seek(0)
+            entries, items = self.__load_text(f)
+        f.close()
+
+        ver = items.get("__playlist_format_version", [1])
+        if ver[0] == 1:
+            if items.get("repeat_mode") == "playlist":
+                items['repeat_mode'] = "all"
+        elif ver[0] > self.__playlist_format_version[0]:
+            raise IOError("Cannot load playlist, unknown format")
+        elif ver > self.__playlist_format_version:
+            logger.warning("Playlist created on a newer Exaile version, some attributes may not be handled.")
+
+        self.__tracks[:] = _get_tracks(entries)
+
+        for item, val in items.iteritems():
+            if item in self.save_attrs:
+                try:
+                    setattr(self, item, val)
+                except TypeError: # don't bail if we try to set an invalid mode
+                    logger.debug("Got a TypeError when trying to set attribute %s to %s during playlist restore." % (item, val))
+
+        # appending to a file that is not in the current format or that
+        # has an incomplete record at its end would lose the changes
+        if saved is not None and saved[1] == _get_file_size(location):
+            self.__journal = []
+            self.__saved = saved
+        else:
+            self.__journal = self.__saved = None
+
+    def __load_text(self, f):
+        """
+            Reads a playlist in the format used before version 3
+
+            :returns: the (uri, tags) entries of the tracks and the
+                attributes
+        """
         locs = []
         while True:
             line = f.readline()
@@ -1447,46 +1839,16 @@ class Playlist(object):
             val = settings.MANAGER._str_to_val(strn)
             items[item] = val
 
-        ver = items.get("__playlist_format_version", [1])
-        if ver[0] == 1:
-            if items.get("repeat_mode") == "playlist":
-                items['repeat_mode'] = "all"
-        elif ver[0] > self.__playlist_format_version[0]:
-            raise IOError("Cannot load playlist, unknown format")
-        elif ver > self.__playlist_format_version:
-            logger.warning("Playlist created on a newer Exaile version, some attributes may not be handled.")
-        f.close()
-
-        trs = []
-
+        entries = []
         for loc in locs:
-            meta = None
+            tags = {}
             if loc.find('\t') > -1:
                 splitted = loc.split('\t')
                 loc = "\t".join(splitted[:-1])
-                meta = splitted[-1]
-
-            track = None
-            track = trax.Track(uri=loc)
-
-            # readd meta
-            if not track: continue
-            if not track.is_local() and meta is not None:
-                meta = cgi.parse_qs(meta)
-                for k, v in meta.iteritems():
-                    track.set_tag_raw(k, v[0].decode('utf-8'), notify_changed=False)
-
-            trs.append(track)
-
-        self.__tracks[:] = trs
-
-
-        for item, val in items.iteritems():
-            if item in self.save_attrs:
-                try:
-                    setattr(self, item, val)
-                except TypeError: # don't bail if we try to set an invalid mode
-                    logger.debug("Got a TypeError when trying to set attribute %s to %s during playlist restore." % (item, val))
+                for k, v in cgi.parse_qs(splitted[-1]).iteritems():
+                    tags[k] = v[0].decode('utf-8')
+            entries.append((loc, tags))
+        return entries, items
 
     def reverse(self):
         # reverses current view
@@ -1529,6 +1891,7 @@ class Playlist(object):
         removed = MetadataList()
         added = MetadataList()
         oldpos = self.current_position
+        length = len(self)
 
         if isinstance(i, slice):
             for x in value:
@@ -1545,7 +1908,10 @@ class Playlist(object):
             if step != 1:
                 if len(value) != len(oldtracks):
                     raise ValueError("Extended slice assignment must match sizes.")
+                self.__journal = None
             self.__tracks.__setitem__(i, value)
+            if step == 1:
+                self.__journal_change(start, len(oldtracks), list(value))
             removed = MetadataList(zip(range(start, end, step), oldtracks),
                     oldtracks.metadata)
             if step == 1:
@@ -1558,6 +1924,18 @@ class Playlist(object):
             self.__tracks[i] = value
             removed = [(i, oldtracks)]
             added = [(i, value)]
+            self.__journal_change(i % length, 1, [value])
+
+        if self.__shuffle_index is not None:
+            if not isinstance(i, slice):
+                changes = [(i % length, 1, 1)]
+            elif step == 1:
+                changes = [(start, len(oldtracks), len(value))]
+            else:
+                changes = [(pos, 1, 1) for pos in xrange(start, end, step)]
+            for pos, old_count, new_count in changes:
+                self.__shuffle_index.remove(xrange(pos, pos + old_count))
+                self.__shuffle_index.insert(pos, new_count)
 
         self.on_tracks_changed()
 
@@ -1574,15 +1952,27 @@ class Playlist(object):
             (start, end, step) = self.__tuple_from_slice(i)
         oldtracks = self.__getitem__(i)
         oldpos = self.current_position
+        length = len(self)
         self.__tracks.__delitem__(i)
         removed = MetadataList()
 
         if isinstance(i, slice):
             removed = MetadataList(zip(xrange(start, end, step), oldtracks),
                     oldtracks.metadata)
+            if step == 1:
+                self.__journal_change(start, len(oldtracks), None)
+            else:
+                self.__journal = None
         else:
             removed = [(i, oldtracks)]
+            self.__journal_change(i % length, 1, None)
 
+        if self.__shuffle_index is not None:
+            if isinstance(i, slice):
+                positions = sorted(xrange(start, end, step))
+            else:
+                positions = [i % length]
+            self.__shuffle_index.remove(positions)
         self.on_tracks_changed()
         event.log_event('playlist_tracks_removed', self, removed)
         self.__adjust_current_pos(oldpos, removed, [])
@@ -1644,6 +2034,10 @@ class Playlist(object):
             if self.dynamic_mode != 'disabled':
                 self.__fetch_dynamic_tracks()
 
+    def on_track_tags_changed(self, event_type, track, tag):
+        if tag == 'album' and self.__shuffle_index is not None:
+            self.__shuffle_index.reset_albums()
+
     def on_tracks_changed(self, *args):
         for idx in xrange(len(self.__tracks)):
             if self.__tracks.get_meta_key(idx, "playlist_current_position"):
@@ -1660,6 +2054,99 @@ class Playlist(object):
 
 
 
+def _is_timestamp(tag):
+    data = tag_data.get(tag)
+    return data is not None and data.type == 'timestamp'
+
+class _SmartPlaylistView(object):
+    """
+        The tracks of a collection matching a smart playlist, in sort
+        order. The collection is searched once, after which the tracks
+        are kept up to date by matching only the tracks that are added,
+        removed or changed.
+    """
+    def __init__(self, collection, search_string, sort_fields):
+        self.collection = collection
+        self.search_string = search_string
+        self.sort_fields = sort_fields
+        self.matcher = trax.TracksMatcher(search_string, case_sensitive=False)
+        self.lock = threading.Lock()
+        #: (sort key, location) of the tracks, in order
+        self.entries = []
+        #: location -> ((sort key, location), track)
+        self.tracks = {}
+        # changes made during the search, location -> track or None
+        self.pending = {}
+
+        event.add_callback(self.on_tracks_added, 'tracks_added', collection)
+        event.add_callback(self.on_tracks_removed, 'tracks_removed',
+                collection)
+        event.add_callback(self.on_track_tags_changed, 'track_tags_changed')
+
+        # Not under the lock: the collection sends its events while
+        # holding its own lock, which searching takes as well
+        results = list(trax.search_tracks(collection, [self.matcher]))
+        with self.lock:
+            for srtr in results:
+                track = srtr.track
+                loc = track.get_loc_for_io()
+                entry = (track._get_sort_key(sort_fields), loc)
+                self.entries.append(entry)
+                self.tracks[loc] = (entry, track)
+            self.entries.sort()
+            pending, self.pending = self.pending, None
+        for loc, track in pending.iteritems():
+            self.__update(loc, track)
+
+    def get_tracks(self):
+        with self.lock:
+            tracks = self.tracks
+            return [tracks[loc][1] for key, loc in self.entries]
+
+    def close(self):
+        """
+            Stops following the changes of the collection
+        """
+        event.remove_callback(self.on_tracks_added, 'tracks_added',
+                self.collection)
+        event.remove_callback(self.on_tracks_removed, 'tracks_removed',
+                self.collection)
+        event.remove_callback(self.on_track_tags_changed,
+                'track_tags_changed')
+
+    def __update(self, loc, track):
+        """
+            Matches the track at loc again, track is None if it was
+            removed from the collection
+        """
+        with self.lock:
+            if self.pending is not None:
+                self.pending[loc] = track
+                return
+            old = self.tracks.pop(loc, None)
+            if old is not None:
+                del self.entries[bisect_left(self.entries, old[0])]
+            if track is not None and \
+                    self.matcher.match(trax.SearchResultTrack(track)):
+                entry = (track._get_sort_key(self.sort_fields), loc)
+                insort(self.entries, entry)
+                self.tracks[loc] = (entry, track)
+
+    def on_tracks_added(self, type, collection, locs):
+        for loc in locs:
+            track = collection.get_track_by_loc(loc)
+            if track is not None:
+                self.__update(loc, track)
+
+    def on_tracks_removed(self, type, collection, locs):
+        for loc in locs:
+            self.__update(loc, None)
+
+    def on_track_tags_changed(self, type, track, tag):
+        loc = track.get_loc_for_io()
+        if self.collection.get_track_by_loc(loc) is track:
+            self.__update(loc, track)
+
 class SmartPlaylist(object):
     """
         Represents a Smart Playlist.
@@ -1691,6 +2178,7 @@ class SmartPlaylist(object):
         self.track_count = -1
         self.random_sort = False
         self.name = name
+        self._view = None
 
     def set_location(self, location):
         pass
@@ -1809,21 +2297,38 @@ class SmartPlaylist(object):
             return
 
         search_string, matchers = self._create_search_data(collection)
+        sort_field = ('artist', 'date', 'album', 'discnumber',
+                'tracknumber', 'title')
+        # searches relative to the current time have a different search
+        # string each time
+        relative = any(type(param) != str and _is_timestamp(param[0])
+            for param in self.search_params)
+
+        if matchers or relative:
+            # the tracks depend on other playlists or on the time, which
+            # can't be followed like the collection
+            self.__set_view(None)
+            matcher = trax.TracksMatcher(search_string, case_sensitive=False)
+
+            # prepend for now, since it is likely to remove more tracks, and
+            # smart playlists don't support mixed and/or expressions yet
+            for m in matchers:
+                matcher.prepend_matcher(m, self.or_match)
+
+            trs = [ t.track for t in trax.search_tracks(collection, [matcher]) ]
+            if not self.random_sort:
+                trs = trax.sort_tracks(sort_field, trs)
+        else:
+            view = self._view
+            if view is None or view.collection is not collection \
+                    or view.search_string != search_string:
+                view = _SmartPlaylistView(collection, search_string,
+                        sort_field)
+                self.__set_view(view)
+            trs = view.get_tracks()
 
-        matcher = trax.TracksMatcher(search_string, case_sensitive=False)
-        
-        # prepend for now, since it is likely to remove more tracks, and
-        # smart playlists don't support mixed and/or expressions yet
-        for m in matchers:
-            matcher.prepend_matcher(m, self.or_match)
-        
-        trs = [ t.track for t in trax.search_tracks(collection, [matcher]) ]
         if self.random_sort:
             random.shuffle(trs)
-        else:
-            sort_field = ('artist', 'date', 'album', 'discnumber',
-                    'tracknumber', 'title')
-            trs = trax.sort_tracks(sort_field, trs)
         if self.track_count > 0 and len(trs) > self.track_count:
             trs=trs[:self.track_count]
 
@@ -1833,6 +2338,11 @@ class SmartPlaylist(object):
 
         return pl
 
+    def __set_view(self, view):
+        if self._view is not None:
+            self._view.close()
+        self._view = view
+
     def _create_search_data(self, collection):
         """
             Creates a search string + matchers based on the internal params
@@ -1873,7 +2383,7 @@ class SmartPlaylist(object):
                 else:
                     matchers.append(trax.TracksNotInList(pl))
                 continue
-            elif tag_data.get(field) == 'timestamp':
+            elif _is_timestamp(field):
                 duration, unit = value
                 delta = durations[unit](duration)
                 point = datetime.now() - delta
@@ -32,6 +32,9 @@
 
 from xl import event
 import logging
+import Queue
+import threading
+import time
 logger = logging.getLogger(__name__)
 
 class ProviderManager(object):
@@ -258,6 +261,240 @@ class ProviderHandler(object):
         """
         return MANAGER.get_provider(self.servicename, providername, self.target)
 
+class _PendingSearch(object):
+    """
+        A search being run, shared by everyone asking for it
+    """
+    __slots__ = ['done', 'results', 'error']
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class ConcurrentSearch(object):
+    """
+        Searches a list of providers for something, such as the covers
+        or lyrics of a track.
+
+        Local providers are asked first, one after the other. If they
+        don't find enough, the remote providers are asked a few at a
+        time, in a small pool of threads shared by all searches, and no
+        more of them are asked once there are enough results. Results
+        are still returned in the order of the providers: the search
+        waits for the preferred providers, but no longer than their
+        timeout. A provider can set its own timeout in seconds with a
+        ``search_timeout`` attribute.
+
+        Searches made while an identical one is running wait for it
+        instead of asking the providers again. Searches that found
+        nothing are remembered for a while.
+    """
+    #: Searches that found nothing remembered at most, before the
+    #: expired ones are dropped
+    max_misses = 10000
+
+    #: Remote providers asked at the same time by a search
+    max_parallel = 2
+
+    #: Threads asking remote providers, for all searches
+    max_workers = 4
+
+    #: Time in seconds after which a thread without work stops
+    worker_idle_time = 5
+
+    def __init__(self, timeout=10, miss_ttl=300):
+        """
+            :param timeout: default time in seconds to wait for each
+                remote provider
+            :param miss_ttl: time in seconds to remember that a search
+                found nothing
+        """
+        self.timeout = timeout
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._misses = {}
+        self._jobs = Queue.Queue()
+        self._workers = 0
+
+    def search(self, key, providers, query, limit=-1, is_local=None,
+            refresh=False):
+        """
+            Searches providers
+
+            :param key: identifies the search; identical searches need
+                to have equal keys, and the key must be hashable
+            :param providers: the providers, in order of preference
+            :param query: called with a provider, returns a list of
+                results. Exceptions are logged and count as no results.
+            :param limit: the number of results after which no more
+                providers are waited for; -1 to get all results
+            :param is_local: called with a provider, returns whether it is
+                fast to ask. By default, all providers are remote.
+            :param refresh: if True, don't use a remembered miss
+            :returns: the list of results
+        """
+        with self._lock:
+            if not refresh:
+                expires = self._misses.get(key)
+                if expires is not None:
+                    if expires > time.time():
+                        return []
+                    del self._misses[key]
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = _PendingSearch()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return list(pending.results)
+
+        try:
+            results = self._search(providers, query, limit, is_local)
+        except Exception as e:
+            pending.error = e
+            raise
+        else:
+            pending.results = results
+        finally:
+            with self._lock:
+                del self._pending[key]
+                if pending.error is None and not pending.results:
+                    self._add_miss(key)
+            pending.done.set()
+        return list(results)
+
+    def forget(self, key=None):
+        """
+            Forgets that a search found nothing
+
+            :param key: the search, or None for all searches
+        """
+        with self._lock:
+            if key is None:
+                self._misses.clear()
+            else:
+                self._misses.pop(key, None)
+
+    def _add_miss(self, key):
+        now = time.time()
+        misses = self._misses
+        if len(misses) >= self.max_misses:
+            for k, expires in misses.items():
+                if expires <= now:
+                    del misses[k]
+            if len(misses) >= self.max_misses:
+                misses.clear()
+        misses[key] = now + self.miss_ttl
+
+    def _query(self, provider, query):
+        try:
+            return query(provider) or []
+        except Exception:
+            logger.exception("Error while searching %r", provider)
+            return []
+
+    def _search(self, providers, query, limit, is_local):
+        results = []
+        remote = []
+        for provider in providers:
+            if is_local is None or not is_local(provider):
+                remote.append(provider)
+                continue
+            results.extend(self._query(provider, query))
+            if limit != -1 and len(results) >= limit:
+                return results[:limit]
+
+        if not remote:
+            return results
+
+        # Results of the remote providers, None while they are running
+        found = [None] * len(remote)
+        deadlines = [None] * len(remote)
+        condition = threading.Condition()
+        finished = threading.Event()
+
+        def run(i, provider):
+            # not worth asking once the search is over
+            ret = [] if finished.is_set() else self._query(provider, query)
+            with condition:
+                found[i] = ret
+                condition.notify()
+
+        asked = 0
+        try:
+            with condition:
+                while True:
+                    now = time.time()
+
+                    # ask the next providers while few are running
+                    running = sum(1 for i in xrange(asked)
+                        if found[i] is None and deadlines[i] > now)
+                    while asked < len(remote) and \
+                            running < self.max_parallel:
+                        provider = remote[asked]
+                        timeout = getattr(provider, 'search_timeout', None)
+                        deadlines[asked] = now + (timeout or self.timeout)
+                        self._submit(run, asked, provider)
+                        asked += 1
+                        running += 1
+
+                    collected = list(results)
+                    # deadline of the first provider still running, whose
+                    # results have to come before the ones of the others
+                    waiting = None
+                    for i in xrange(asked):
+                        ret = found[i]
+                        if ret is None:
+                            if deadlines[i] > now:
+                                waiting = deadlines[i]
+                                break
+                            continue
+                        collected.extend(ret)
+                        if limit != -1 and len(collected) >= limit:
+                            return collected[:limit]
+                    if waiting is None:
+                        if asked < len(remote):
+                            continue
+                        for i, ret in enumerate(found):
+                            if ret is None:
+                                logger.debug("Gave up waiting for %r",
+                                    remote[i])
+                        return collected
+                    condition.wait(waiting - now)
+        finally:
+            finished.set()
+
+    def _submit(self, func, *args):
+        """
+            Runs func in the worker pool
+        """
+        with self._lock:
+            self._jobs.put((func, args))
+            if self._workers < self.max_workers:
+                self._workers += 1
+                thread = threading.Thread(target=self._work,
+                    name='ConcurrentSearch')
+                thread.daemon = True
+                thread.start()
+
+    def _work(self):
+        while True:
+            try:
+                func, args = self._jobs.get(timeout=self.worker_idle_time)
+            except Queue.Empty:
+                with self._lock:
+                    if self._jobs.empty():
+                        self._workers -= 1
+                        return
+                continue
+            func(*args)
+
 class MultiProviderHandler(object):
     '''
         This is useful for listening to multiple provider types
@@ -33,9 +33,12 @@ from ConfigParser import (
     NoSectionError,
     NoOptionError
 )
+import copy
 import logging
 import os
 import sys
+import threading
+import weakref
 
 from gi.repository import GLib
 
@@ -57,6 +60,40 @@ TYPE_MAPPING = {
 
 MANAGER = None
 
+# Marks values that are not in the value cache yet
+_UNSET = object()
+
+class OptionHandle(object):
+    """
+        A live view of the value of an option, kept up to date by the
+        settings manager. Get one with :meth:`SettingsManager.subscribe`.
+
+        The value is shared by everyone using the handle, so lists
+        and dicts must not be modified in place.
+    """
+    __slots__ = ['manager', 'option', 'default', '_value', '__weakref__']
+
+    def __init__(self, manager, option, default=None):
+        self.manager = manager
+        self.option = option
+        self.default = default
+        self._value = _UNSET
+
+    @property
+    def value(self):
+        """
+            The current value of the option, or the default
+        """
+        value = self._value
+        if value is _UNSET:
+            with self.manager._cache_lock:
+                value = self._value = self.manager.get_option(self.option,
+                    self.default)
+        return value
+
+    def _invalidate(self):
+        self._value = _UNSET
+
 class SettingsManager(RawConfigParser):
     """
         Manages Exaile's settings
@@ -78,6 +115,11 @@ class SettingsManager(RawConfigParser):
         """
         RawConfigParser.__init__(self)
 
+        # parsed values by option path, and handles by option path
+        self._cache = {}
+        self._cache_lock = threading.RLock()
+        self._handles = {}
+
         self.location = location
         self._saving = False
         self._dirty = False
@@ -152,6 +194,7 @@ class SettingsManager(RawConfigParser):
             self.add_section(section)
             self.set(section, key, value)
 
+        self._invalidate(section, key)
         self._dirty = True
         
         if save:
@@ -174,18 +217,54 @@ class SettingsManager(RawConfigParser):
             :returns: the option value or *default*
             :rtype: any
         """
+        value = self._cache.get(option, _UNSET)
+
+        if value is _UNSET:
+            splitvals = option.split('/')
+            section, key = "/".join(splitvals[:-1]), splitvals[-1]
+
+            # The value is stored under the lock, so that it can't
+            # overwrite the invalidation of a concurrent set_option.
+            # Options spelled differently than they are stored aren't
+            # cached, as they wouldn't be invalidated.
+            with self._cache_lock:
+                try:
+                    value = self._str_to_val(self.get(section, key))
+                except (NoSectionError, NoOptionError):
+                    value = None
+                if key == self.optionxform(key):
+                    self._cache[option] = value
+
+        if value is None:
+            return default
+        if isinstance(value, (list, dict)):
+            # don't let callers modify the cached value
+            return copy.deepcopy(value)
+        return value
+
+    def subscribe(self, option, default=None):
+        """
+            Returns a handle on an option (in ``section/key`` syntax),
+            for code reading it often. Its value attribute always holds
+            the current value of the option, or *default*.
+
+            :param option: the full path to an option
+            :type option: string
+            :param default: a default value to use as fallback
+            :type default: any
+            :rtype: :class:`OptionHandle`
+        """
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
+        path = '%s/%s' % (section, self.optionxform(key))
 
-        try:
-            value = self.get(section, key)
-            value = self._str_to_val(value)
-        except NoSectionError:
-            value = default
-        except NoOptionError:
-            value = default
-
-        return value
+        handle = OptionHandle(self, option, default)
+        with self._cache_lock:
+            handles = self._handles.get(path)
+            if handles is None:
+                handles = self._handles[path] = weakref.WeakSet()
+            handles.add(handle)
+        return handle
 
     def has_option(self, option):
         """
@@ -214,6 +293,19 @@ class SettingsManager(RawConfigParser):
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
         RawConfigParser.remove_option(self, section, key)
+        self._invalidate(section, key)
+
+    def _invalidate(self, section, key):
+        """
+            Forgets the cached value of an option after it has changed
+        """
+        option = '%s/%s' % (section, self.optionxform(key))
+        with self._cache_lock:
+            self._cache.pop(option, None)
+            handles = self._handles.get(option)
+            if handles is not None:
+                for handle in list(handles):
+                    handle._invalidate()
 
     def _set_direct(self, option, value):
         """
@@ -234,6 +326,7 @@ class SettingsManager(RawConfigParser):
             self.add_section(section)
             self.set(section, key, value)
 
+        self._invalidate(section, key)
         event.log_event('option_set', self, option)
 
     def _val_to_str(self, value):
@@ -344,5 +437,6 @@ MANAGER = SettingsManager(
 
 get_option = MANAGER.get_option
 set_option = MANAGER.set_option
+subscribe = MANAGER.subscribe
 
 # vim: et sts=4 sw=4
@@ -0,0 +1,224 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Runs the steps of starting up Exaile in the order their dependencies
+    require, and keeps track of how long each of them took
+"""
+
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+WAITING, RUNNING, DONE = range(3)
+
+class _Step(object):
+    __slots__ = ['name', 'func', 'depends', 'threaded', 'deferred',
+        'background', 'state', 'result', 'error', 'start', 'duration',
+        'thread', 'runner']
+
+    def __init__(self, name, func, depends, threaded, deferred, background):
+        self.name = name
+        self.func = func
+        self.depends = depends
+        self.threaded = threaded or background
+        self.deferred = deferred
+        self.background = background
+        self.state = WAITING
+        self.result = None
+        self.error = None
+        self.start = None
+        self.duration = None
+        self.thread = None
+        self.runner = None
+
+class StartupScheduler(object):
+    """
+        Runs startup steps once their dependencies are done.
+
+        Threaded steps are started on their own thread as soon as they
+        can be, so that slow steps which don't depend on each other run
+        at the same time. The other steps run on the thread asking for
+        them. Deferred steps only run when something needs their result,
+        or when :meth:`run_deferred` is called. Background steps are
+        threaded steps that startup doesn't wait for.
+    """
+    def __init__(self):
+        self._steps = OrderedDict()
+        self._cond = threading.Condition()
+        self._start = time.time()
+        self._marks = []
+
+    def add(self, name, func, depends=(), threaded=False, deferred=False,
+            background=False):
+        """
+            Adds a step
+
+            :param name: the name of the step
+            :param func: called without arguments to run the step, its
+                return value is the result of the step
+            :param depends: the names of the steps to run before
+            :param threaded: whether to run the step on its own thread
+            :param deferred: whether to wait until the result is needed
+            :param background: whether to run the step on its own thread
+                without :meth:`wait` waiting for it
+        """
+        with self._cond:
+            self._steps[name] = _Step(name, func, tuple(depends), threaded,
+                deferred, background)
+
+    def run(self):
+        """
+            Runs the steps that are not deferred. Threaded steps may
+            still be running afterwards, see :meth:`wait`.
+        """
+        self._start_ready()
+        for step in self._steps.values():
+            if not step.deferred and not step.threaded:
+                self.require(step.name)
+
+    def wait(self):
+        """
+            Waits for all steps that are not deferred or in the
+            background to be done
+        """
+        for step in self._steps.values():
+            if not step.deferred and not step.background:
+                self.require(step.name)
+
+    def run_deferred(self):
+        """
+            Runs the deferred steps that haven't run yet
+        """
+        for step in self._steps.values():
+            if step.deferred:
+                self.require(step.name)
+        return False
+
+    def require(self, name):
+        """
+            Runs a step if it hasn't run yet, or waits for it to be done
+
+            :returns: the result of the step
+            :raises: the exception raised by the step, if any
+        """
+        step = self._steps[name]
+        for depend in step.depends:
+            self.require(depend)
+
+        run_here = False
+        with self._cond:
+            if step.state == WAITING:
+                step.state = RUNNING
+                if step.threaded:
+                    self._start_thread(step)
+                else:
+                    run_here = True
+            if not run_here:
+                if step.state != DONE and \
+                        step.runner is threading.current_thread():
+                    raise RuntimeError('Startup step %s needs itself' % name)
+                while step.state != DONE:
+                    self._cond.wait()
+
+        if run_here:
+            self._run(step)
+
+        if step.error is not None:
+            raise step.error
+        return step.result
+
+    def is_done(self, name):
+        """
+            Returns whether a step has run
+        """
+        return self._steps[name].state == DONE
+
+    def mark(self, name):
+        """
+            Records the time at which something happened, such as the
+            main window being shown
+        """
+        self._marks.append((name, time.time() - self._start))
+
+    def report(self):
+        """
+            Returns a description of when each step started and how long
+            it took, relative to the creation of the scheduler
+        """
+        entries = []
+        with self._cond:
+            for step in self._steps.itervalues():
+                if step.state == DONE:
+                    entries.append((step.start, step.name,
+                        '%6.3fs  %s' % (step.duration, step.thread)))
+        entries.extend((offset, name, '') for name, offset in self._marks)
+        entries.sort()
+
+        lines = ['Startup profile:']
+        for start, name, details in entries:
+            lines.append('  +%6.3fs  %-16s %s' % (start, name, details))
+        return '\n'.join(lines)
+
+    def _start_ready(self):
+        """
+            Starts the threaded steps whose dependencies are done
+        """
+        with self._cond:
+            for step in self._steps.itervalues():
+                if step.threaded and not step.deferred and \
+                        step.state == WAITING and \
+                        all(self._steps[depend].state == DONE
+                            for depend in step.depends):
+                    step.state = RUNNING
+                    self._start_thread(step)
+
+    def _start_thread(self, step):
+        thread = threading.Thread(target=self._run, args=(step,),
+            name='startup-%s' % step.name)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, step):
+        step.runner = threading.current_thread()
+        start = time.time()
+        try:
+            step.result = step.func()
+        except BaseException:
+            # raised again in the threads requiring the step, which for
+            # steps on their own thread is the only way to report it
+            step.error = sys.exc_info()[1]
+        finally:
+            with self._cond:
+                step.start = start - self._start
+                step.duration = time.time() - start
+                step.thread = threading.current_thread().name
+                step.state = DONE
+                self._cond.notify_all()
+        self._start_ready()
+
+# vim: et sts=4 sw=4
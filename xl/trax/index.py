@@ -0,0 +1,505 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+Inverted tag index used to answer searches on a :class:`xl.trax.TrackDB`
+without looking at every track.
+
+For every tag that has been searched on, the index maps each distinct
+search value (see :func:`xl.trax.search.get_search_values`) to the set
+of tracks having it. Matchers are then evaluated once per distinct value
+instead of once per track, and the index narrows down which values need
+to be looked at:
+
+* substring and equality matches only test values sharing a word with
+  the search term, found through a word -> values map
+* numeric comparisons use a sorted array of the values that are numbers
+* everything else (e.g. regular expressions) tests all distinct values
+
+Boolean combinations are then plain set operations.
+"""
+
+from bisect import bisect_left, bisect_right
+import threading
+
+from xl.trax.search import (
+    get_search_values,
+    SearchResultTrack,
+    TracksMatcher,
+    TracksInList,
+    TracksNotInList,
+    _Matcher,
+    _ExactMatcher,
+    _InMatcher,
+    _GtMatcher,
+    _LtMatcher,
+    _NotMetaMatcher,
+    _OrMetaMatcher,
+    _MultiMetaMatcher,
+    _ManyMultiMetaMatcher
+)
+
+__all__ = ['SearchIndex', 'SearchCancelled']
+
+# Search values of the key tags are derived from the tags listed here,
+# see Track.get_tag_search
+_DERIVED_TAGS = {
+    'artist': ('albumartist',),
+    '__loc': ('__basename',),
+}
+
+
+def _to_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if number != number:
+        # nan doesn't compare to anything, so it can't be sorted
+        return None
+    return number
+
+
+class _TagIndex(object):
+    """
+        Index of the search values of a single tag
+    """
+    __slots__ = ['tag', 'values_by_track', 'tracks_by_value',
+                 'values_by_word', '_numeric', '_word_cache']
+
+    def __init__(self, tag, tracks):
+        self.tag = tag
+        self.values_by_track = {}
+        self.tracks_by_value = {}
+        self.values_by_word = {}
+        self._numeric = None
+        self._word_cache = None
+        for track in tracks:
+            self.add(track)
+
+    def add(self, track):
+        values = tuple(get_search_values(track, self.tag))
+        self.values_by_track[track] = values
+        for value in values:
+            tracks = self.tracks_by_value.get(value)
+            if tracks is None:
+                tracks = self.tracks_by_value[value] = set()
+                self._add_value(value)
+            tracks.add(track)
+
+    def remove(self, track):
+        values = self.values_by_track.pop(track, ())
+        for value in values:
+            tracks = self.tracks_by_value.get(value)
+            if tracks is None:
+                continue
+            tracks.discard(track)
+            if not tracks:
+                del self.tracks_by_value[value]
+                self._remove_value(value)
+
+    def update(self, track):
+        if track in self.values_by_track:
+            self.remove(track)
+            self.add(track)
+
+    def _add_value(self, value):
+        self._numeric = None
+        if value is None:
+            return
+        for word in set(value.lower().split()):
+            values = self.values_by_word.get(word)
+            if values is None:
+                values = self.values_by_word[word] = set()
+                self._word_cache = None
+            values.add(value)
+
+    def _remove_value(self, value):
+        self._numeric = None
+        if value is None:
+            return
+        for word in set(value.lower().split()):
+            values = self.values_by_word.get(word)
+            if values is not None:
+                values.discard(value)
+                if not values:
+                    del self.values_by_word[word]
+
+    # Candidate values. Each of these returns a superset of the values
+    # that can match, or None if all values need to be tested.
+
+    def _words_containing(self, part):
+        """
+            Returns the words that contain part. The last result is kept,
+            so that narrowing down a search while it is being typed only
+            looks at the words that matched before.
+        """
+        cache = self._word_cache
+        if cache is not None and cache[0] in part:
+            words = cache[1]
+        else:
+            words = self.values_by_word.iterkeys()
+        words = [w for w in words if part in w]
+        self._word_cache = (part, words)
+        return words
+
+    def substring_candidates(self, content):
+        """
+            Values that may contain content. Any part of content without
+            whitespace has to be inside a single word of the value.
+        """
+        parts = content.lower().split()
+        if not parts:
+            return None
+        part = max(parts, key=len)
+        candidates = set()
+        for word in self._words_containing(part):
+            values = self.values_by_word.get(word)
+            if values:
+                candidates.update(values)
+        return candidates
+
+    def _get_numeric(self):
+        numeric = self._numeric
+        if numeric is None:
+            pairs = []
+            for value in self.tracks_by_value:
+                number = _to_float(value)
+                if number is not None:
+                    pairs.append((number, value))
+            pairs.sort()
+            numeric = self._numeric = ([p[0] for p in pairs],
+                                       [p[1] for p in pairs])
+        return numeric
+
+    def numeric_range(self, low=None, high=None):
+        """
+            Values that are numbers between low and high, exclusive
+        """
+        numbers, values = self._get_numeric()
+        start = 0 if low is None else bisect_right(numbers, low)
+        end = len(numbers) if high is None else bisect_left(numbers, high)
+        return values[start:end]
+
+
+class SearchCancelled(Exception):
+    """
+        Raised by :meth:`SearchIndex.search` when it was cancelled
+    """
+    pass
+
+
+class SearchIndex(object):
+    """
+        Answers searches on a set of tracks through per-tag inverted
+        indexes, which are built the first time a tag is searched on and
+        kept up to date afterwards.
+
+        The owner of the index has to report added and removed tracks
+        and tag changes through :meth:`add_tracks`, :meth:`remove_tracks`
+        and :meth:`update_track`. These never wait for a search that is
+        running: the changes are queued, and applied by the search when
+        it is done, or before the next one.
+
+        :param tracks: the initial tracks
+    """
+    def __init__(self, tracks=()):
+        # held while the indexes are used, searches can hold it for long
+        self._lock = threading.RLock()
+        # only ever held briefly, protects _pending
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        self._tracks = set(tracks)
+        self._tags = {}
+
+    def add_tracks(self, tracks):
+        self._queue([(self._add, track) for track in tracks])
+
+    def remove_tracks(self, tracks):
+        self._queue([(self._remove, track) for track in tracks])
+
+    def update_track(self, track, tag):
+        """
+            Updates the index after tag has changed on track
+        """
+        self._queue([(self._update, (track, tag))])
+
+    def _queue(self, changes):
+        """
+            Queues changes, and applies them right away unless a search
+            is running
+        """
+        with self._pending_lock:
+            self._pending.extend(changes)
+        self._apply_pending(blocking=False)
+
+    def _apply_pending(self, blocking=True):
+        """
+            Applies the queued changes. When not blocking, this gives up
+            if a search holds the indexes; the search applies them once it
+            releases the indexes.
+        """
+        while self._pending:
+            if not self._lock.acquire(blocking):
+                return
+            try:
+                with self._pending_lock:
+                    pending = self._pending
+                    self._pending = []
+                for func, arg in pending:
+                    func(arg)
+            finally:
+                self._lock.release()
+            blocking = False
+
+    def _add(self, track):
+        if track in self._tracks:
+            return
+        self._tracks.add(track)
+        for index in self._tags.itervalues():
+            index.add(track)
+
+    def _remove(self, track):
+        if track not in self._tracks:
+            return
+        self._tracks.discard(track)
+        for index in self._tags.itervalues():
+            index.remove(track)
+
+    def _update(self, change):
+        track, tag = change
+        for t in (tag,) + _DERIVED_TAGS.get(tag, ()):
+            index = self._tags.get(t)
+            if index is not None:
+                index.update(track)
+
+    def _get_tag_index(self, tag):
+        index = self._tags.get(tag)
+        if index is None:
+            index = self._tags[tag] = _TagIndex(tag, self._tracks)
+        return index
+
+    def search(self, trackmatchers, cancelled=None):
+        """
+            Same as :func:`xl.trax.search.search_tracks` over the indexed
+            tracks.
+
+            :param cancelled: a function returning whether the search
+                should be given up, called every now and then
+            :returns: a list of :class:`SearchResultTrack`, or None if
+                none of the matchers can be answered from the index
+            :raises: :class:`SearchCancelled`
+        """
+        if cancelled is None:
+            cancelled = lambda: False
+
+        self._apply_pending()
+        try:
+            with self._lock:
+                sets = {}
+                result = None
+                for tma in trackmatchers:
+                    if cancelled():
+                        raise SearchCancelled()
+                    matched = self._match(tma, sets, cancelled)
+                    if matched is not None:
+                        result = matched if result is None \
+                            else result & matched
+                if result is None:
+                    return None
+        finally:
+            # changes queued during the search
+            self._apply_pending(blocking=False)
+
+        results = []
+        for i, track in enumerate(result):
+            if i % 1000 == 0 and cancelled():
+                raise SearchCancelled()
+            srtr = SearchResultTrack(track)
+            for tma in trackmatchers:
+                if id(tma) in sets:
+                    if isinstance(tma, TracksMatcher):
+                        self._add_on_tags(tma, srtr, sets)
+                elif not tma.match(srtr):
+                    break
+            else:
+                results.append(srtr)
+        return results
+
+    # Matcher evaluation. Each of these returns the exact set of tracks
+    # matching, or None if it can't be determined from the index. Results
+    # are remembered by matcher id in sets.
+
+    def _match(self, matcher, sets, cancelled):
+        if isinstance(matcher, _Matcher):
+            if type(matcher).match.im_func is _Matcher.match.im_func:
+                result = self._match_values(matcher, cancelled)
+            else:
+                result = None
+        elif isinstance(matcher, (TracksMatcher, _MultiMetaMatcher)):
+            result = self._match_all(matcher.matchers, sets, cancelled)
+        elif isinstance(matcher, _ManyMultiMetaMatcher):
+            result = set()
+            for ma in matcher.matchers:
+                matched = self._match(ma, sets, cancelled)
+                if matched is None:
+                    result = None
+                    break
+                result |= matched
+        elif isinstance(matcher, _OrMetaMatcher):
+            left = self._match(matcher.left, sets, cancelled)
+            right = self._match(matcher.right, sets, cancelled)
+            if left is None or right is None:
+                result = None
+            else:
+                result = left | right
+        elif isinstance(matcher, _NotMetaMatcher):
+            inner = self._match(matcher.matcher, sets, cancelled)
+            result = None if inner is None else self._tracks - inner
+        elif isinstance(matcher, TracksNotInList):
+            result = self._tracks - matcher._tracks
+        elif isinstance(matcher, TracksInList):
+            result = self._tracks & matcher._tracks
+        else:
+            result = None
+
+        if result is not None:
+            sets[id(matcher)] = result
+        return result
+
+    def _match_all(self, matchers, sets, cancelled):
+        """
+            AND of matchers. Matchers that can't be answered from the
+            index are checked on the tracks matched by the others.
+        """
+        result = None
+        remaining = []
+        for ma in matchers:
+            if cancelled():
+                raise SearchCancelled()
+            matched = self._match(ma, sets, cancelled)
+            if matched is None:
+                remaining.append(ma)
+            elif result is None:
+                result = matched
+            else:
+                result = result & matched
+        if result is None:
+            if remaining:
+                return None
+            result = set(self._tracks)
+        if remaining:
+            matched = set()
+            for i, t in enumerate(result):
+                if i % 1000 == 0 and cancelled():
+                    raise SearchCancelled()
+                srtr = SearchResultTrack(t)
+                if all(ma.match(srtr) for ma in remaining):
+                    matched.add(t)
+            result = matched
+        return result
+
+    def _match_values(self, matcher, cancelled):
+        """
+            Evaluates a single-tag matcher on the distinct values of its
+            tag, exactly like :meth:`_Matcher.match` does per track.
+        """
+        index = self._get_tag_index(matcher.tag)
+        content = matcher.content
+
+        if isinstance(matcher, _ExactMatcher):
+            if content is None:
+                candidates = [None]
+            elif isinstance(content, basestring):
+                candidates = index.substring_candidates(content)
+                if candidates is not None and content in index.tracks_by_value:
+                    candidates.add(content)
+                number = _to_float(content)
+                if matcher.tag.startswith('__') and number is not None:
+                    if candidates is not None:
+                        candidates.update(index.numeric_range(
+                            number - 0.0001, number + 0.0001))
+            else:
+                candidates = None
+        elif isinstance(matcher, _InMatcher):
+            if content and isinstance(content, basestring):
+                candidates = index.substring_candidates(content)
+            else:
+                candidates = None
+        elif isinstance(matcher, _GtMatcher):
+            number = _to_float(content)
+            candidates = [] if number is None else \
+                index.numeric_range(low=number)
+        elif isinstance(matcher, _LtMatcher):
+            number = _to_float(content)
+            candidates = [] if number is None else \
+                index.numeric_range(high=number) + [None]
+        else:
+            candidates = None
+
+        if candidates is None:
+            candidates = index.tracks_by_value.iterkeys()
+
+        lower = matcher.lower
+        result = set()
+        for i, value in enumerate(candidates):
+            if i % 1000 == 0 and cancelled():
+                raise SearchCancelled()
+            tracks = index.tracks_by_value.get(value)
+            if not tracks:
+                continue
+            if matcher._matches(lower(value) if value is not None else None):
+                result |= tracks
+        return result
+
+    def _add_on_tags(self, tma, srtr, sets):
+        """
+            Fills in the tags a result track was matched on, like
+            :meth:`TracksMatcher.match` does
+        """
+        for ma in tma.matchers:
+            if ma.tag is not None:
+                tags = [ma.tag]
+            elif isinstance(ma, _ManyMultiMetaMatcher):
+                tags = self._get_many_tags(ma, srtr.track, sets)
+            else:
+                continue
+            for tag in tags:
+                if tag not in srtr.on_tags:
+                    srtr.on_tags.append(tag)
+
+    def _get_many_tags(self, matcher, track, sets):
+        tags = []
+        for ma in matcher.matchers:
+            if track not in sets[id(ma)]:
+                continue
+            if ma.tag:
+                tags.append(ma.tag)
+            elif isinstance(ma, _ManyMultiMetaMatcher):
+                tags.extend(self._get_many_tags(ma, track, sets))
+        return tags
+
+# vim: et sts=4 sw=4
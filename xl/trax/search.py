@@ -42,6 +42,18 @@ class SearchResultTrack(object):
         self.track = track
         self.on_tags = []
 
+def get_search_values(track, tag):
+    """
+        Returns the values of a tag that matchers compare against,
+        as a list of unicode strings and/or None.
+    """
+    vals = track.get_tag_search(tag, format=False)
+    if vals == '__null__':
+        vals = None
+    if not isinstance(vals, list):
+        vals = [vals]
+    return vals
+
 class _Matcher(object):
     """
         Base class for match conditions
@@ -55,13 +67,7 @@ class _Matcher(object):
         self.lower = lower
 
     def match(self, srtrack):
-        vals = srtrack.track.get_tag_search(self.tag, format=False)
-        if vals == '__null__':
-            vals = None
-        if not isinstance(vals, list):
-            vals = [vals]
-            
-        for item in vals:
+        for item in get_search_values(srtrack.track, self.tag):
             if item is not None:
                 item = self.lower(item)
             
@@ -493,9 +499,21 @@ def search_tracks(trackiter, trackmatchers):
     """
         Search a set of tracks for those that match specified conditions.
 
+        If trackiter is a :class:`xl.trax.TrackDB`, its search index is
+        used instead of looking at every track. Results are not returned
+        in any particular order then.
+
         :param trackiter: An iterable object returning Track objects
         :param trackmatchers: A list of TrackMatcher objects
     """
+    get_search_index = getattr(trackiter, 'get_search_index', None)
+    if get_search_index is not None:
+        results = get_search_index().search(trackmatchers)
+        if results is not None:
+            return iter(results)
+    return _scan_tracks(trackiter, trackmatchers)
+
+def _scan_tracks(trackiter, trackmatchers):
     for srtr in trackiter:
         if not isinstance(srtr, SearchResultTrack):
             srtr = SearchResultTrack(srtr)
@@ -0,0 +1,428 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+Columnar, append-only on-disk storage for :class:`xl.trax.TrackDB`
+
+A store consists of two files:
+
+* a snapshot at the database location, holding every track's tags
+  grouped by tag name (one column per tag), with all string values
+  interned into a single string table. The snapshot is memory-mapped
+  and decoded column by column on load.
+* a delta log next to it (``<location>.log``), to which changed and
+  removed tracks are appended on every save. The log is replayed on
+  top of the snapshot on load and folded back into a new snapshot
+  ("compacted") once it grows too large.
+"""
+
+import cPickle as pickle
+import logging
+import marshal
+import mmap
+import os
+import struct
+import sys
+import threading
+
+from xl import common
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 'EXTRKDB\x00'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8sIQ')
+_RECORD = struct.Struct('<I')
+
+# Kinds of values stored in a column
+_KIND_LIST1 = 0     # list with a single string, stored as string index
+_KIND_LIST = 1      # list of strings, stored as list of string indices
+_KIND_STR = 2       # single (non-list) string, stored as string index
+_KIND_RAW = 3       # marshallable value, stored as-is
+_KIND_PICKLE = 4    # anything else, stored pickled
+
+# Log record types
+_REC_PUT = 'p'
+_REC_DELETE = 'd'
+_REC_ATTRS = 'a'
+
+#: The log is folded into the snapshot once it is larger than this
+#: and larger than a quarter of the snapshot.
+COMPACT_MIN_LOG_SIZE = 1 << 20
+
+
+def _replace(src, dst):
+    """
+        Atomically replaces dst with src, as far as the platform allows
+    """
+    if sys.platform == 'win32' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+class _StringTable(object):
+    """
+        Assigns a unique index to each distinct string value
+    """
+    __slots__ = ['strings', '_index']
+
+    def __init__(self):
+        self.strings = []
+        self._index = {}
+
+    def intern(self, value):
+        # str and unicode compare equal in python2, but must round-trip
+        # as their own type
+        key = (value.__class__, value)
+        try:
+            return self._index[key]
+        except KeyError:
+            idx = self._index[key] = len(self.strings)
+            self.strings.append(value)
+            return idx
+
+
+def _is_string_list(value):
+    for v in value:
+        if not isinstance(v, basestring):
+            return False
+    return True
+
+
+def _encode_value(value, strings):
+    """
+        Returns a (kind, encoded) tuple for a single tag value
+    """
+    if isinstance(value, list):
+        if _is_string_list(value):
+            if len(value) == 1:
+                return _KIND_LIST1, strings.intern(value[0])
+            return _KIND_LIST, [strings.intern(v) for v in value]
+    elif isinstance(value, basestring):
+        return _KIND_STR, strings.intern(value)
+    else:
+        try:
+            marshal.dumps(value, 2)
+            return _KIND_RAW, value
+        except ValueError:
+            pass
+    return _KIND_PICKLE, pickle.dumps(value, common.PICKLE_PROTOCOL)
+
+
+def _encode_columns(records, strings):
+    """
+        Turns a list of (uri, key, tags, attrs) records into a dict of
+        tag -> {kind: (rows, values)}
+    """
+    columns = {}
+    for row, record in enumerate(records):
+        for tag, value in record[2].iteritems():
+            kind, encoded = _encode_value(value, strings)
+            column = columns.get(tag)
+            if column is None:
+                column = columns[tag] = {}
+            try:
+                rows, values = column[kind]
+            except KeyError:
+                rows, values = column[kind] = ([], [])
+            rows.append(row)
+            values.append(encoded)
+    return columns
+
+
+class TrackStore(object):
+    """
+        Reads and writes the on-disk representation of a
+        :class:`xl.trax.TrackDB`.
+
+        Records exchanged with this class are tuples of
+        ``(uri, key, tags, attrs)``, where *tags* is the tag dict of a
+        track as returned by :meth:`Track._pickles` and *key* and *attrs*
+        are the corresponding :class:`TrackHolder` values.
+
+        :param location: path of the snapshot file
+    """
+    def __init__(self, location):
+        self.location = location
+        self.log_location = location + '.log'
+        self.compact_log_location = location + '.log.compacting'
+        self.snapshot_size = 0
+        self.log_size = 0
+        self._compacting = False
+        self._lock = threading.Lock()
+
+    def exists(self):
+        """
+            Whether a snapshot in this format exists at the location
+        """
+        try:
+            with open(self.location, 'rb') as f:
+                return f.read(len(MAGIC)) == MAGIC
+        except IOError:
+            return False
+
+    # Reading
+
+    def load(self):
+        """
+            Loads the snapshot and replays the delta logs on top of it.
+
+            :returns: a tuple of (attrs, records), where attrs is a dict
+                of the :class:`TrackDB` attributes.
+        """
+        attrs, records = self._load_snapshot()
+
+        if os.path.exists(self.compact_log_location) or \
+                os.path.exists(self.log_location):
+            byuri = dict((r[0], r) for r in records)
+            for location in (self.compact_log_location, self.log_location):
+                for record in self._read_log(location):
+                    rtype = record[0]
+                    if rtype == _REC_PUT:
+                        byuri[record[1]] = record[1:]
+                    elif rtype == _REC_DELETE:
+                        byuri.pop(record[1], None)
+                    elif rtype == _REC_ATTRS:
+                        attrs.update(record[1])
+            records = byuri.values()
+
+        return attrs, records
+
+    def _load_snapshot(self):
+        with open(self.location, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.snapshot_size = len(mm)
+            magic, version, index_offset = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                raise ValueError("%s is not a track database" % self.location)
+            if version > FORMAT_VERSION:
+                raise common.VersionError(
+                    "DB was created on a newer Exaile version.")
+
+            index = marshal.loads(mm[index_offset:])
+
+            def section(name):
+                offset, length = index[name]
+                return mm[offset:offset + length]
+
+            attrs = pickle.loads(section('attrs'))
+            strings = marshal.loads(section('strings'))
+            uris = marshal.loads(section('uris'))
+            keys = marshal.loads(section('keys'))
+            holder_attrs = pickle.loads(section('holder_attrs'))
+
+            tags = [{} for uri in uris]
+            for name in index:
+                if name.startswith('col:'):
+                    self._decode_column(name[4:],
+                        marshal.loads(section(name)), strings, tags)
+        finally:
+            mm.close()
+
+        records = [(uri, key, t, holder_attrs.get(row, {}))
+            for row, (uri, key, t) in enumerate(zip(uris, keys, tags))]
+        return attrs, records
+
+    @staticmethod
+    def _decode_column(tag, column, strings, tags):
+        for kind, (rows, values) in column.iteritems():
+            if kind == _KIND_LIST1:
+                for row, idx in zip(rows, values):
+                    tags[row][tag] = [strings[idx]]
+            elif kind == _KIND_LIST:
+                for row, idxs in zip(rows, values):
+                    tags[row][tag] = [strings[i] for i in idxs]
+            elif kind == _KIND_STR:
+                for row, idx in zip(rows, values):
+                    tags[row][tag] = strings[idx]
+            elif kind == _KIND_RAW:
+                for row, value in zip(rows, values):
+                    tags[row][tag] = value
+            elif kind == _KIND_PICKLE:
+                for row, value in zip(rows, values):
+                    tags[row][tag] = pickle.loads(value)
+
+    def _read_log(self, location):
+        """
+            Yields the records of a delta log. A truncated record at
+            the end (e.g. after a crash during a save) is ignored.
+        """
+        try:
+            f = open(location, 'rb')
+        except IOError:
+            return
+        with f:
+            data = f.read()
+        if location == self.log_location:
+            self.log_size = len(data)
+        pos = 0
+        while pos + _RECORD.size <= len(data):
+            length, = _RECORD.unpack_from(data, pos)
+            start = pos + _RECORD.size
+            if start + length > len(data):
+                break
+            try:
+                record = pickle.loads(data[start:start + length])
+            except Exception:
+                logger.exception("Corrupt record in %s", location)
+                break
+            for r in record:
+                yield r
+            pos = start + length
+        if pos != len(data):
+            logger.warning("Ignoring %d trailing bytes in %s",
+                    len(data) - pos, location)
+
+    # Writing
+
+    def write_snapshot(self, attrs, records):
+        """
+            Replaces the snapshot with one containing exactly the given
+            attributes and records, and drops any logs it supersedes.
+
+            :param attrs: dict of :class:`TrackDB` attributes
+            :param records: iterable of (uri, key, tags, attrs) tuples
+        """
+        records = list(records)
+        strings = _StringTable()
+        columns = _encode_columns(records, strings)
+
+        sections = [
+            ('attrs', pickle.dumps(attrs, common.PICKLE_PROTOCOL)),
+            ('uris', marshal.dumps([r[0] for r in records], 2)),
+            ('keys', marshal.dumps([r[1] for r in records], 2)),
+            ('holder_attrs', pickle.dumps(dict((row, r[3])
+                for row, r in enumerate(records) if r[3]),
+                common.PICKLE_PROTOCOL)),
+        ]
+        for tag, column in columns.iteritems():
+            sections.append(('col:' + tag, marshal.dumps(column, 2)))
+        # The string table is complete only after all columns are encoded
+        sections.append(('strings', marshal.dumps(strings.strings, 2)))
+
+        tmp = self.location + '.tmp'
+        index = {}
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0))
+            offset = _HEADER.size
+            for name, data in sections:
+                f.write(data)
+                index[name] = (offset, len(data))
+                offset += len(data)
+            f.write(marshal.dumps(index, 2))
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, offset))
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._lock:
+            _replace(tmp, self.location)
+            self.snapshot_size = offset
+            try:
+                os.remove(self.compact_log_location)
+            except OSError:
+                pass
+            if not self._compacting:
+                # Everything in the log is part of the snapshot now
+                try:
+                    os.remove(self.log_location)
+                except OSError:
+                    pass
+                self.log_size = 0
+            self._compacting = False
+
+    def append(self, attrs=None, puts=(), deletes=()):
+        """
+            Appends changes to the delta log as a single write.
+
+            :param attrs: dict of changed :class:`TrackDB` attributes
+            :param puts: (uri, key, tags, attrs) records of added or
+                changed tracks
+            :param deletes: uris of removed tracks
+        """
+        record = [(_REC_DELETE, uri) for uri in deletes]
+        record.extend((_REC_PUT,) + tuple(r) for r in puts)
+        if attrs:
+            record.append((_REC_ATTRS, attrs))
+        if not record:
+            return
+
+        data = pickle.dumps(record, common.PICKLE_PROTOCOL)
+        with self._lock:
+            with open(self.log_location, 'ab') as f:
+                f.write(_RECORD.pack(len(data)))
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.log_size += _RECORD.size + len(data)
+
+    # Compaction
+
+    def needs_compaction(self):
+        """
+            Whether the log has grown large enough to be folded into
+            the snapshot
+        """
+        return not self._compacting and \
+            self.log_size > max(COMPACT_MIN_LOG_SIZE, self.snapshot_size // 4)
+
+    def begin_compaction(self):
+        """
+            Moves the current log aside, so that new changes go to a
+            fresh log while the snapshot is being rewritten. The caller
+            must then capture the full database state and pass it to
+            :meth:`write_snapshot`.
+
+            :returns: False if a compaction is already running
+        """
+        with self._lock:
+            if self._compacting:
+                return False
+            self._compacting = True
+            if os.path.exists(self.log_location):
+                if os.path.exists(self.compact_log_location):
+                    # left over from an interrupted compaction; both logs
+                    # are older than the snapshot about to be written
+                    with open(self.compact_log_location, 'ab') as dst:
+                        with open(self.log_location, 'rb') as src:
+                            dst.write(src.read())
+                    os.remove(self.log_location)
+                else:
+                    _replace(self.log_location, self.compact_log_location)
+            self.log_size = 0
+            return True
+
+    def abort_compaction(self):
+        """
+            Gives up on a compaction started with :meth:`begin_compaction`.
+            The moved-aside log is kept and replayed on the next load.
+        """
+        with self._lock:
+            self._compacting = False
+
+# vim: et sts=4 sw=4
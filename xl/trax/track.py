@@ -25,7 +25,6 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
-from copy import deepcopy
 from gi.repository import Gio
 from gi.repository import GLib
 import logging
@@ -60,6 +59,8 @@ _sortcharmap = {
         u'ҥ': u'ng', # U+04A5
         u'ҵ': u'ts', # U+04B5
         }
+_sortcharre = re.compile(u'|'.join(_sortcharmap.iterkeys()))
+_nonasciire = re.compile(u'[^\x00-\x7f]')
 
 # Cache these here because calling gettext inside get_tag_display
 # is two orders of magnitude slower.
@@ -68,6 +69,88 @@ _UNKNOWNSTR = _("Unknown")
 #TRANSLATORS: String multiple tag values will be joined by
 _JOINSTR = _(u' / ')
 
+# Tags whose values tend to be shared by many tracks. Their values are
+# interned, so that e.g. all tracks of an album share one album string.
+_INTERNED_TAGS = frozenset([
+    'album', 'albumartist', 'arranger', 'artist', 'composer', 'conductor',
+    'date', 'genre', 'grouping', 'label', 'lyricist', 'organization',
+    'originaldate', 'performer', 'version', '__basedir'
+])
+# str and unicode values compare equal, so keep them apart
+_INTERN_TABLES = {str: {}, unicode: {}}
+# number of interned values after which the tables are pruned
+_intern_limit = 4096
+# maximum number of values cached per track by Track.get_cached
+_TAG_CACHE_SIZE = 24
+# the keys of the cached values, shared by all tracks
+_TAG_CACHE_KEYS = {}
+
+def _intern(value):
+    """
+        Returns the shared copy of a tag value
+    """
+    table = _INTERN_TABLES.get(type(value))
+    if table is None:
+        return value
+    shared = table.get(value)
+    if shared is None:
+        shared = table.setdefault(value, value)
+        if len(table) > _intern_limit:
+            _prune_interned()
+    return shared
+
+def _prune_interned():
+    """
+        Drops the interned values that no track has anymore, e.g. the
+        ones of removed tracks or changed tags. This happens whenever
+        the tables have doubled in size, so it costs constant time per
+        interned value on average.
+    """
+    global _intern_limit
+    used = set(Track._list_interned_values())
+    for table in _INTERN_TABLES.itervalues():
+        for value in table.keys():
+            if value not in used:
+                table.pop(value, None)
+    _intern_limit = max(4096,
+        2 * sum(len(table) for table in _INTERN_TABLES.itervalues()))
+
+def _intern_tag(tag):
+    """
+        Returns the shared copy of a tag name
+    """
+    return intern(tag) if type(tag) is str else tag
+
+def _pack(tag, values):
+    """
+        Converts a tag value to its stored form, which takes less memory:
+        lists with a single value are stored as that value and longer
+        lists as tuples. Internal tags are stored as they are.
+    """
+    if tag in _INTERNED_TAGS:
+        if isinstance(values, list):
+            values = [_intern(v) for v in values]
+        else:
+            values = _intern(values)
+    if tag.startswith('__'):
+        return values[:] if isinstance(values, list) else values
+    if not isinstance(values, list):
+        return values
+    if len(values) == 1 and not isinstance(values[0], tuple):
+        return values[0]
+    return tuple(values)
+
+def _unpack(tag, value):
+    """
+        Converts a stored tag value back, see :func:`_pack`. Lists are
+        always new copies.
+    """
+    if tag.startswith('__'):
+        return value[:] if isinstance(value, list) else value
+    if isinstance(value, tuple):
+        return list(value)
+    return [value]
+
 
 class _MetadataCacher(object):
     """
@@ -130,8 +213,9 @@ class Track(object):
     """
         Represents a single track.
     """
-    # save a little memory this way
-    __slots__ = ["__tags", "_scan_valid",
+    # save a little memory this way. Tag values are stored in the
+    # compact form returned by _pack, use __get to read them.
+    __slots__ = ["__tags", "__tag_cache", "_scan_valid",
             "_dirty", "__weakref__", "_init"]
     # this is used to enforce the one-track-per-uri rule
     __tracksdict = weakref.WeakValueDictionary()
@@ -221,6 +305,8 @@ class Track(object):
             return
 
         self.__tags = {}
+        # values stored by get_cached, cleared on changes
+        self.__tag_cache = None
         self._scan_valid = None # whether our last tag read attempt worked
         self._dirty = False
 
@@ -251,6 +337,27 @@ class Track(object):
         except KeyError:
             pass
 
+    @classmethod
+    def _list_interned_values(cls):
+        """
+            Yields the interned tag values of all tracks, see
+            :func:`_prune_interned`
+        """
+        for track in cls.__tracksdict.values():
+            try:
+                tags = track.__tags.items()
+            except AttributeError:
+                # not initialized yet
+                continue
+            for tag, value in tags:
+                if tag not in _INTERNED_TAGS:
+                    continue
+                if isinstance(value, (list, tuple)):
+                    for v in value:
+                        yield v
+                else:
+                    yield value
+
     def set_loc(self, loc):
         """
             Sets the location.
@@ -260,6 +367,7 @@ class Track(object):
         self.__unregister()
         gloc = Gio.File.new_for_commandline_arg(loc)
         self.__tags['__loc'] = gloc.get_uri()
+        self.__tag_cache = None
         self.__register()
         event.log_event('track_tags_changed', self, '__loc')
 
@@ -342,7 +450,7 @@ class Track(object):
             f = metadata.get_format(self.get_loc_for_io())
             if f is None:
                 return False # not a supported type
-            f.write_tags(self.__tags)
+            f.write_tags(self._pickles())
             return f
         except IOError as e:
             # error writing to the file, probably
@@ -437,7 +545,10 @@ class Track(object):
 
             internal use only please
         """
-        return deepcopy(self.__tags)
+        tags = {}
+        for tag, value in self.__tags.iteritems():
+            tags[tag] = _unpack(tag, value)
+        return tags
 
     def _unpickles(self, pickle_obj):
         """
@@ -445,7 +556,19 @@ class Track(object):
 
             internal use only please
         """
-        self.__tags = deepcopy(pickle_obj)
+        self.__tags = dict((_intern_tag(tag), _pack(tag, value))
+            for tag, value in pickle_obj.iteritems() if value not in (None, []))
+        self.__tag_cache = None
+
+    def __get(self, tag, default=None):
+        """
+            Returns the value of a tag, as returned by get_tag_raw
+        """
+        try:
+            value = self.__tags[tag]
+        except KeyError:
+            return default
+        return _unpack(tag, value)
 
     def list_tags(self):
         """
@@ -494,8 +617,9 @@ class Track(object):
             except KeyError:
                 pass
         else:
-            self.__tags[tag] = values
+            self.__tags[_intern_tag(tag)] = _pack(tag, values)
 
+        self.__tag_cache = None
         self._dirty = True
         if notify_changed:
             event.log_event("track_tags_changed", self, tag)
@@ -514,13 +638,42 @@ class Track(object):
         elif tag == '__startoffset': # necessary?
             value = self.__tags.get(tag, 0)
         else:
-            value = self.__tags.get(tag)
+            value = self.__get(tag)
 
         if join and value and not tag.startswith('__'):
             return self.join_values(value)
 
         return value
 
+    def get_cached(self, key, func, *args):
+        """
+            Returns func(*args), remembered under key until the track
+            changes. This is meant for values derived from the tags,
+            like sort keys or formatted text.
+
+            At most _TAG_CACHE_SIZE values are kept per track. When a
+            new value does not fit anymore, the cache starts over, so
+            that keys which are not used anymore (closed playlist
+            columns, old search tags) don't add up. The keys themselves
+            are shared by all tracks.
+        """
+        cache = self.__tag_cache
+        if cache is None:
+            cache = self.__tag_cache = {}
+        try:
+            value = cache[key]
+        except KeyError:
+            if len(cache) >= _TAG_CACHE_SIZE:
+                cache = self.__tag_cache = {}
+            if len(_TAG_CACHE_KEYS) > 1000:
+                _TAG_CACHE_KEYS.clear()
+            key = _TAG_CACHE_KEYS.setdefault(key, key)
+            # If the track changes meanwhile, this goes to the old cache
+            value = cache[key] = func(*args)
+        if isinstance(value, list):
+            return value[:]
+        return value
+
     def get_tag_sort(self, tag, join=True, artist_compilations=False,
             extend_title=True):
         """
@@ -535,19 +688,40 @@ class Track(object):
             :param extend_title: If the title tag is unknown, try to
                 add some identifying information to it.
         """
+        return self.get_cached(
+            ('sort', tag, join, artist_compilations, extend_title),
+            self.__get_tag_sort, tag, join, artist_compilations, extend_title)
+
+    def _get_sort_key(self, fields, artist_compilations=False):
+        """
+            Returns the tuple of the sort values of fields, used by
+            :func:`xl.trax.util.sort_tracks`
+
+            :param fields: tag names
+            :type fields: tuple
+        """
+        return self.get_cached(('sortkey', fields, artist_compilations),
+            self.__get_sort_key, fields, artist_compilations)
+
+    def __get_sort_key(self, fields, artist_compilations):
+        get_tag_sort = self.__get_tag_sort
+        return tuple([get_tag_sort(field, True, artist_compilations, True)
+            for field in fields])
+
+    def __get_tag_sort(self, tag, join, artist_compilations, extend_title):
         # The two magic values here are to ensure that compilations
         # and unknown values are always sorted below all normal
         # values.
         value = None
-        sorttag = self.__tags.get(tag + "sort")
+        sorttag = self.__get(tag + "sort")
         if sorttag and tag != "albumartist":
             value = sorttag
         elif tag == "albumartist":
-            if artist_compilations and self.__tags.get('__compilation'):
-                value = self.__tags.get('albumartist',
+            if artist_compilations and self.__get('__compilation'):
+                value = self.__get('albumartist',
                         u"\uffff\uffff\uffff\ufffe")
             else:
-                value = self.__tags.get('artist',
+                value = self.__get('artist',
                         u"\uffff\uffff\uffff\uffff")
             if sorttag and value not in (u"\uffff\uffff\uffff\ufffe",
                     u"\uffff\uffff\uffff\uffff"):
@@ -555,21 +729,21 @@ class Track(object):
             else:
                 sorttag = None
         elif tag in ('tracknumber', 'discnumber'):
-            value = self.split_numerical(self.__tags.get(tag))[0]
+            value = self.split_numerical(self.__get(tag))[0]
         elif tag in ('__length', '__playcount'):
-            value = self.__tags.get(tag, 0)
+            value = self.__get(tag, 0)
         elif tag == 'bpm':
             try:
-                value = int(self.__tags.get(tag, [0])[0])
+                value = int(self.__get(tag, [0])[0])
             except ValueError:
-                digits = re.search(r'\d+\.?\d*', self.__tags.get(tag, [0])[0])
+                digits = re.search(r'\d+\.?\d*', self.__get(tag, [0])[0])
                 if digits:
                     value = float(digits.group())
         elif tag == '__basename':
             # TODO: Check if unicode() is required
             value = self.get_basename()
         else:
-            value = self.__tags.get(tag)
+            value = self.__get(tag)
 
         if not value:
             value = u"\uffff\uffff\uffff\uffff" # unknown
@@ -610,16 +784,16 @@ class Track(object):
 
         value = None
         if tag == "albumartist":
-            if artist_compilations and self.__tags.get('__compilation'):
-                value = self.__tags.get('albumartist', _VARIOUSARTISTSSTR)
+            if artist_compilations and self.__get('__compilation'):
+                value = self.__get('albumartist', _VARIOUSARTISTSSTR)
             else:
-                value = self.__tags.get('artist', _UNKNOWNSTR)
+                value = self.__get('artist', _UNKNOWNSTR)
         elif tag in ('tracknumber', 'discnumber'):
-            value = self.split_numerical(self.__tags.get(tag))[0] or u""
+            value = self.split_numerical(self.__get(tag))[0] or u""
         elif tag in ('__length', '__startoffset', '__stopoffset'):
-            value = self.__tags.get(tag, u"")
+            value = self.__get(tag, u"")
         elif tag in ('__rating', '__playcount'):
-            value = self.__tags.get(tag, u"0")
+            value = self.__get(tag, u"0")
         elif tag == '__bitrate':
             try:
                 value = int(self.__tags['__bitrate']) // 1000
@@ -633,7 +807,7 @@ class Track(object):
         elif tag == '__basename':
             value = self.get_basename_display()
         else:
-            value = self.__tags.get(tag)
+            value = self.__get(tag)
 
         if value is None:
             value = ''
@@ -667,18 +841,23 @@ class Track(object):
                 
             :returns: unicode string that is used for searching
         """
+        return self.get_cached(
+            ('search', tag, format, artist_compilations, extend_title),
+            self.__get_tag_search, tag, format, artist_compilations)
+
+    def __get_tag_search(self, tag, format, artist_compilations):
         extraformat = ""
         if tag == "albumartist":
-            if artist_compilations and self.__tags.get('__compilation'):
-                value = self.__tags.get('albumartist', None)
+            if artist_compilations and self.__get('__compilation'):
+                value = self.__get('albumartist', None)
                 tag = 'albumartist'
                 extraformat += " ! __compilation==__null__"
             else:
-                value = self.__tags.get('artist')
+                value = self.__get('artist')
         elif tag in ('tracknumber', 'discnumber'):
-            value = self.split_numerical(self.__tags.get(tag))[0]
+            value = self.split_numerical(self.__get(tag))[0]
         elif tag in ('__length', '__playcount', '__rating', '__startoffset', '__stopoffset'):
-            value = self.__tags.get(tag, 0)
+            value = self.__get(tag, 0)
         elif tag == '__bitrate':
             try:
                 value = int(self.__tags['__bitrate']) // 1000
@@ -691,7 +870,7 @@ class Track(object):
         elif tag == '__basename':
             value = self.get_basename()
         else:
-            value = self.__tags.get(tag)
+            value = self.__get(tag)
 
         # Quote arguments
         if value is None:
@@ -882,6 +1061,9 @@ class Track(object):
         """
         # value is appended afterwards so that like-accented values
         # will sort together.
+        if not _nonasciire.search(value):
+            # nothing to strip
+            return value + u" " + value
         return u''.join([c for c in unicodedata.normalize('NFD', value)
             if unicodedata.category(c) != 'Mn']) + u" " + value
 
@@ -895,6 +1077,8 @@ class Track(object):
 
             value must be in lower-case
         """
+        if not _sortcharre.search(value):
+            return value
         for k, v in _sortcharmap.iteritems():
             value = value.replace(k, v)
         return value
@@ -935,6 +1119,9 @@ class Track(object):
         """
         if data == "collection/strip_list":
             cls._Track__the_cuts = settings.get_option('collection/strip_list', [])
+            # the cuts are part of the cached sort values
+            for track in cls._Track__tracksdict.values():
+                track._Track__tag_cache = None
 
     ### Utility method intended for TrackDB ###
     
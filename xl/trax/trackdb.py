@@ -27,15 +27,20 @@
 from __future__ import absolute_import
 
 import logging
+import os
 import shelve
+import threading
 
 from copy import deepcopy
+from whichdb import whichdb
 
 from gi.repository import GLib
 
 from xl import common, event
 from xl.nls import gettext as _
 
+from xl.trax.index import SearchIndex
+from xl.trax.store import TrackStore
 from xl.trax.track import Track
 from xl.trax.util import sort_tracks
 from xl.trax.search import search_tracks_from_string
@@ -44,10 +49,13 @@ logger = logging.getLogger(__name__)
 
 
 class TrackHolder(object):
+    __slots__ = ['_track', '_key', '_attrs']
+
     def __init__(self, track, key, **kwargs):
         self._track = track
         self._key = key
-        self._attrs = kwargs
+        # most holders have no attributes, don't keep a dict for them
+        self._attrs = kwargs or None
 
     def __getattr__(self, attr):
         return getattr(self._track, attr)
@@ -100,9 +108,15 @@ class TrackDB(object):
         self.pickle_attrs += ['tracks', 'name', '_key']
         self._saving = False
         self._key = 0
-        self._dbversion = 2.0
+        self._dbversion = 3.0
         self._dbminorversion = 0
-        self._deleted_keys = []
+        self._store = None
+        self._search_index = None
+        # locations of tracks that were changed/removed since the last save
+        self._dirty_locs = set()
+        self._deleted_locs = set()
+        self._dirty_lock = threading.Lock()
+        event.add_callback(self._on_track_tags_changed, 'track_tags_changed')
         if location:
             self.load_from_location()
             self._timeout_save()
@@ -160,12 +174,33 @@ class TrackDB(object):
         self.location = location
         self._dirty = True
 
+    def _on_track_tags_changed(self, type, track, tag):
+        """
+            Remembers changed tracks, so that saving does not have to
+            look at every track in the database
+        """
+        loc = track.get_loc_for_io()
+        if loc in self.tracks:
+            with self._dirty_lock:
+                self._dirty_locs.add(loc)
+            search_index = self._search_index
+            if search_index is not None:
+                search_index.update_track(track, tag)
+
+    def _get_store(self, location):
+        if self._store is not None and self._store.location == location:
+            return self._store
+        return TrackStore(location)
+
     @common.synchronized
     def load_from_location(self, location=None):
         """
-            Restores :class:`TrackDB` state from the pickled representation
+            Restores :class:`TrackDB` state from the representation
             stored at the specified location.
 
+            Databases in the old shelve format are converted on the fly,
+            see :mod:`xl.migrations.database`.
+
             :param location: the location to load the data from
             :type location: string
         """
@@ -176,79 +211,118 @@ class TrackDB(object):
                     _("You did not specify a location to load the db from"))
 
         logger.debug("Loading %s DB from %s." % (self.name, location))
-                    
-        try:
-            try:
-                pdata = shelve.open(location, flag='c',
-                        protocol=common.PICKLE_PROTOCOL)
-            except ImportError:
-                import bsddb3 # ArchLinux disabled bsddb in python2, so we have to use the external module
-                _db = bsddb3.hashopen(location, 'c')
-                pdata = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
-            if "_dbversion" in pdata:
-                if int(pdata['_dbversion']) > int(self._dbversion):
-                    raise common.VersionError("DB was created on a newer Exaile version.")
-                elif pdata['_dbversion'] < self._dbversion:
-                    logger.info("Upgrading DB format....")
-                    import shutil
-                    shutil.copyfile(location,
-                            location + "-%s.bak"%pdata['_dbversion'])
-                    import xl.migrations.database as dbmig
-                    dbmig.handle_migration(self, pdata, pdata['_dbversion'],
-                            self._dbversion)
 
+        store = self._get_store(location)
+        try:
+            if not store.exists():
+                if not os.path.exists(location) and not whichdb(location):
+                    # nothing saved yet
+                    if location == self.location:
+                        self._store = store
+                    return
+                self._migrate_from_shelve(location)
+            attrs, records = store.load()
         except common.VersionError:
             raise
         except Exception:
             logger.exception("Failed to open music DB.")
             return
 
+        if int(attrs.get('_dbversion', self._dbversion)) > int(self._dbversion):
+            raise common.VersionError("DB was created on a newer Exaile version.")
+
         for attr in self.pickle_attrs:
             try:
                 if 'tracks' == attr:
                     data = {}
-                    for k in (x for x in pdata.keys() \
-                            if x.startswith("tracks-")):
-                        p = pdata[k]
-                        tr = Track(_unpickles=p[0])
+                    for uri, key, tags, holder_attrs in records:
+                        tr = Track(_unpickles=tags)
                         loc = tr.get_loc_for_io()
                         if loc not in data:
-                            data[loc] = TrackHolder(tr, p[1], **p[2])
+                            data[loc] = TrackHolder(tr, key, **holder_attrs)
                         else:
-                            logger.warning("Duplicate track found: %s" % loc )
-                            # presumably the second track was written because of an error, 
-                            # so use the first track found. 
-                            del pdata[k]
-                            
+                            logger.warning("Duplicate track found: %s" % loc)
+                            # presumably the second track was written because of an error,
+                            # so use the first track found. The duplicate is dropped
+                            # the next time the store is compacted.
+
                     setattr(self, attr, data)
+                    self._search_index = None
                 else:
-                    setattr(self, attr, pdata.get(attr, getattr(self, attr)))
+                    setattr(self, attr, attrs.get(attr, getattr(self, attr)))
             except Exception:
                 # FIXME: Do something about this
                 logger.exception("Exception occurred while loading %s" % location)
 
-        pdata.close()
+        if location == self.location:
+            self._store = store
 
         self._dirty = False
 
+    def _migrate_from_shelve(self, location):
+        """
+            Converts a database in the old shelve format at location
+            to the current format, keeping a backup of the old file.
+        """
+        try:
+            pdata = shelve.open(location, flag='w',
+                    protocol=common.PICKLE_PROTOCOL)
+        except ImportError:
+            import bsddb3 # ArchLinux disabled bsddb in python2, so we have to use the external module
+            _db = bsddb3.hashopen(location, 'w')
+            pdata = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
+
+        try:
+            # shelves written before versioning are at version 2
+            version = pdata.get('_dbversion', 2.0)
+            if int(version) > int(self._dbversion):
+                raise common.VersionError("DB was created on a newer Exaile version.")
+
+            logger.info("Upgrading DB format....")
+            if os.path.exists(location):
+                import shutil
+                shutil.copyfile(location, location + "-%s.bak" % version)
+            import xl.migrations.database as dbmig
+            dbmig.handle_migration(self, pdata, version, self._dbversion,
+                    location=location)
+        finally:
+            pdata.close()
+
+    def _get_pickle_attrs(self):
+        """
+            Returns the attributes to save, except for the tracks
+        """
+        attrs = dict((attr, deepcopy(getattr(self, attr)))
+            for attr in self.pickle_attrs if attr != 'tracks')
+        attrs['_dbversion'] = self._dbversion
+        return attrs
+
+    def _get_records(self, locs=None):
+        """
+            Returns store records for the tracks at the given locations,
+            or for all tracks
+        """
+        if locs is None:
+            holders = self.tracks.itervalues()
+        else:
+            holders = (self.tracks[loc] for loc in locs if loc in self.tracks)
+        return [(holder._track.get_loc_for_io(), holder._key,
+                 holder._track._pickles(), deepcopy(holder._attrs or {}))
+                for holder in holders]
+
     @common.synchronized
     def save_to_location(self, location=None):
         """
-            Saves a pickled representation of this :class:`TrackDB` to the
-            specified location.
+            Saves this :class:`TrackDB` to the specified location.
+
+            Saving to the location the database was loaded from only
+            appends changed tracks to its delta log, which is compacted
+            into a new snapshot in the background once it grows too large.
+            Saving anywhere else writes a complete snapshot.
 
             :param location: the location to save the data to
             :type location: string
         """
-        if not self._dirty:
-            for track in self.tracks.itervalues():
-                if track._track._dirty:
-                    self._dirty = True
-                    break
-
-        if not self._dirty:
-            return
-
         if not location:
             location = self.location
         if not location:
@@ -257,54 +331,80 @@ class TrackDB(object):
 
         if self._saving:
             return
+
+        with self._dirty_lock:
+            dirty_locs, self._dirty_locs = self._dirty_locs, set()
+            deleted_locs, self._deleted_locs = self._deleted_locs, set()
+
+        store = self._get_store(location)
+        incremental = store is self._store and store.exists()
+
+        if incremental and not (self._dirty or dirty_locs or deleted_locs):
+            return
+
         self._saving = True
 
         logger.debug("Saving %s DB to %s." % (self.name, location))
 
         try:
-            try:
-                pdata = shelve.open(location, flag='c',
-                        protocol=common.PICKLE_PROTOCOL)
-            except ImportError:
-                import bsddb3
-                _db = bsddb3.hashopen(location, 'c')
-                pdata = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
-            if pdata.get('_dbversion', self._dbversion) > self._dbversion:
-                raise common.VersionError("DB was created on a newer Exaile.")
+            if incremental:
+                store.append(self._get_pickle_attrs() if self._dirty else None,
+                        self._get_records(dirty_locs), deleted_locs)
+            else:
+                store.write_snapshot(self._get_pickle_attrs(),
+                        self._get_records())
         except Exception:
-            logger.exception("Failed to open music DB for writing.")
+            logger.exception("Failed to save music DB.")
+            if incremental:
+                with self._dirty_lock:
+                    self._dirty_locs.update(dirty_locs)
+                    self._deleted_locs.update(deleted_locs)
+            self._saving = False
             return
 
-        for attr in self.pickle_attrs:
-            # bad hack to allow saving of lists/dicts of Tracks
-            if 'tracks' == attr:
-                for k, track in self.tracks.iteritems():
-                    key = "tracks-%s" % track._key
-                    if track._track._dirty or key not in pdata:
-                        pdata[key] = (
-                            track._track._pickles(),
-                            track._key,
-                            deepcopy(track._attrs)
-                        )
-            else:
-                pdata[attr] = deepcopy(getattr(self, attr))
-
-        pdata['_dbversion'] = self._dbversion
-
-        for key in self._deleted_keys:
-            key = "tracks-%s" % key
-            if key in pdata:
-                del pdata[key]
-
-        pdata.sync()
-        pdata.close()
+        if incremental:
+            saved = (self.tracks[loc] for loc in dirty_locs if loc in self.tracks)
+        else:
+            saved = self.tracks.itervalues()
+        for holder in saved:
+            holder._track._dirty = False
 
-        for track in self.tracks.itervalues():
-            track._track._dirty = False
+        if location == self.location:
+            self._store = store
+            if store.needs_compaction():
+                self._compact_store()
 
         self._dirty = False
         self._saving = False
 
+    @common.threaded
+    def _compact_store(self):
+        """
+            Folds the delta log into a new snapshot
+        """
+        store = self._store
+        data = self._begin_compaction(store)
+        if data is None:
+            return
+        logger.debug("Compacting %s DB at %s." % (self.name, store.location))
+        try:
+            store.write_snapshot(*data)
+        except Exception:
+            logger.exception("Failed to compact music DB.")
+            store.abort_compaction()
+
+    @common.synchronized
+    def _begin_compaction(self, store):
+        """
+            Captures the database state for a compaction. Changes made
+            after this go to a fresh log.
+        """
+        if not store.begin_compaction():
+            return None
+        # Unsaved changes would only be written to the new log, which
+        # is not part of the snapshot; they are captured here anyway
+        return self._get_pickle_attrs(), self._get_records()
+
     def get_track_by_loc(self, loc, raw=False):
         """
             returns the track having the given loc. if no such track exists,
@@ -355,11 +455,17 @@ class TrackDB(object):
         """
         locations = []
 
-        for tr in tracks:
-            location = tr.get_loc_for_io()
-            locations += [location]
-            self.tracks[location] = TrackHolder(tr, self._key)
-            self._key += 1
+        with self._dirty_lock:
+            for tr in tracks:
+                location = tr.get_loc_for_io()
+                locations += [location]
+                self.tracks[location] = TrackHolder(tr, self._key)
+                self._key += 1
+                self._dirty_locs.add(location)
+                self._deleted_locs.discard(location)
+
+        if self._search_index is not None:
+            self._search_index.add_tracks(tracks)
 
         event.log_event('tracks_added', self, locations)
 
@@ -380,11 +486,16 @@ class TrackDB(object):
         """
         locations = []
 
-        for tr in tracks:
-            location = tr.get_loc_for_io()
-            locations += [location]
-            self._deleted_keys.append(self.tracks[location]._key)
-            del self.tracks[location]
+        with self._dirty_lock:
+            for tr in tracks:
+                location = tr.get_loc_for_io()
+                locations += [location]
+                del self.tracks[location]
+                self._deleted_locs.add(location)
+                self._dirty_locs.discard(location)
+
+        if self._search_index is not None:
+            self._search_index.remove_tracks(tracks)
 
         event.log_event('tracks_removed', self, locations)
 
@@ -393,6 +504,17 @@ class TrackDB(object):
     def get_tracks(self):
         return list(self)
 
+    @common.synchronized
+    def get_search_index(self):
+        """
+            Returns the :class:`xl.trax.index.SearchIndex` over the tracks
+            in this database, which :func:`xl.trax.search_tracks` uses
+            when searching it.
+        """
+        if self._search_index is None:
+            self._search_index = SearchIndex(self)
+        return self._search_index
+
 
     def search(self, query, sort_fields=[], return_lim=-1,
             tracks=None, reverse=False):
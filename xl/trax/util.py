@@ -104,11 +104,14 @@ def sort_tracks(fields, iter, trackfunc=None, reverse=False, artist_compilations
         :param reverse: whether to sort in reversed order
         :type reverse: boolean
     """
-    fields = list(fields) # we need the index method
+    # The tuple of sort values is cached by each track, so sorting the
+    # same tracks again only needs to compare the cached tuples.
+    fields = tuple(fields)
     if trackfunc is None:
-        trackfunc = lambda tr: tr
-    keyfunc = lambda tr: [trackfunc(tr).get_tag_sort(field,
-        artist_compilations=artist_compilations) for field in fields]
+        keyfunc = lambda tr: tr._get_sort_key(fields, artist_compilations)
+    else:
+        keyfunc = lambda tr: trackfunc(tr)._get_sort_key(fields,
+            artist_compilations)
     
     return sorted(iter, key=keyfunc, reverse=reverse)
 
@@ -45,7 +45,7 @@ from xl import (
     settings,
     xdg
 )
-from xl.covers import MANAGER as COVER_MANAGER
+from xl.covers import MANAGER as COVER_MANAGER, THUMBNAIL_SIZES
 from xl.nls import gettext as _
 from xlgui.widgets import dialogs
 from xlgui import (
@@ -72,6 +72,92 @@ def save_pixbuf(pixbuf, path, type_):
     pixbuf.savev(path, type_, [None], [])
 
 
+# Recently used thumbnails, (db_string, size) -> pixbuf
+_THUMBNAILS = common.LimitedCache(500)
+_THUMBNAILS_LOCK = threading.Lock()
+
+
+def get_thumbnail(db_string, size):
+    """Get a scaled down cover.
+
+    Thumbnails are kept in memory and, in a few fixed sizes, on disk, so
+    that the full cover only needs to be decoded once.
+
+    :param db_string: The db_string identifying the cover, see
+        :meth:`xl.covers.CoverManager.get_db_string`
+    :type db_string: str
+    :param size: Maximum width and height of the thumbnail
+    :type size: int
+    :return: The thumbnail, or None if the cover can't be loaded
+    :rtype: GdkPixbuf.Pixbuf
+    """
+    key = (db_string, size)
+    with _THUMBNAILS_LOCK:
+        try:
+            return _THUMBNAILS[key]
+        except KeyError:
+            pass
+
+    tier = None
+    for tier_size in THUMBNAIL_SIZES:
+        if tier_size >= size:
+            tier = tier_size
+            break
+
+    pixbuf = None
+    if tier is not None:
+        data = COVER_MANAGER.get_thumbnail_data(db_string, tier)
+        pixbuf = icons.MANAGER.pixbuf_from_data(data)
+
+    if pixbuf is None:
+        data = COVER_MANAGER.get_cover_data(db_string)
+        if not data:
+            return None
+        pixbuf = icons.MANAGER.pixbuf_from_data(data, (tier or size,) * 2)
+        if pixbuf is None:
+            return None
+        if tier is not None:
+            success, data = pixbuf.save_to_bufferv('png', [], [])
+            if success:
+                COVER_MANAGER.set_thumbnail_data(db_string, tier, data)
+
+    width, height = pixbuf.get_width(), pixbuf.get_height()
+    scale = size / float(max(width, height))
+    if scale < 1:
+        pixbuf = pixbuf.scale_simple(max(1, int(width * scale)),
+            max(1, int(height * scale)), GdkPixbuf.InterpType.BILINEAR)
+
+    with _THUMBNAILS_LOCK:
+        _THUMBNAILS[key] = pixbuf
+    return pixbuf
+
+
+def get_track_thumbnail(track, size, set_only=True):
+    """Get a scaled down cover of a track, see :func:`get_thumbnail`.
+
+    :param track: The track to get the cover of
+    :type track: xl.trax.Track
+    :param size: Maximum width and height of the thumbnail
+    :type size: int
+    :param set_only: Only use covers that have been set in the db
+    :type set_only: bool
+    :return: The thumbnail, or None if there is no cover
+    :rtype: GdkPixbuf.Pixbuf
+    """
+    db_string = COVER_MANAGER.get_db_string(track)
+    if db_string is None and not set_only:
+        data = COVER_MANAGER.get_cover(track)
+        if not data:
+            return None
+        db_string = COVER_MANAGER.get_db_string(track)
+        if db_string is None:
+            # Albumless track, nothing to store the thumbnail for
+            return icons.MANAGER.pixbuf_from_data(data, (size, size))
+    if db_string is None:
+        return None
+    return get_thumbnail(db_string, size)
+
+
 class CoverManager(GObject.GObject):
     """
         Cover manager window
@@ -199,10 +285,8 @@ class CoverManager(GObject.GObject):
 
         outstanding = []
         # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
-        pixbuf_from_data = icons.MANAGER.pixbuf_from_data
         default_cover_pixbuf = self.default_cover_pixbuf
-        cover_size = self.cover_size
+        cover_size = max(self.cover_size)
 
         self.emit('prefetch-started')
 
@@ -210,13 +294,10 @@ class CoverManager(GObject.GObject):
             if self.stopper.is_set():
                 return
 
-            cover_data = get_cover(self.album_tracks[album][0], set_only=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+            thumbnail_pixbuf = get_track_thumbnail(
+                self.album_tracks[album][0], cover_size)
 
-            try:
-                thumbnail_pixbuf = cover_pixbuf.scale_simple(*cover_size,
-                    interp_type=GdkPixbuf.InterpType.BILINEAR)
-            except AttributeError: # cover_pixbuf is None
+            if thumbnail_pixbuf is None:
                 thumbnail_pixbuf = default_cover_pixbuf
                 outstanding.append(album)
 
@@ -236,17 +317,16 @@ class CoverManager(GObject.GObject):
         self.emit('fetch-started', len(self.outstanding))
 
         # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
         save = COVER_MANAGER.save
-        pixbuf_from_data = icons.MANAGER.pixbuf_from_data
+        cover_size = max(self.cover_size)
 
         for i, album in enumerate(self.outstanding[:]):
             if self.stopper.is_set():
                 # Allow for "fetch-completed" signal to be emitted
                 break
 
-            cover_data = get_cover(self.album_tracks[album][0], save_cover=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+            cover_pixbuf = get_track_thumbnail(self.album_tracks[album][0],
+                cover_size, set_only=False)
 
             self.emit('fetch-progress', i + 1)
 
@@ -1075,7 +1155,7 @@ class CoverChooser(GObject.GObject):
         """
             Searches for covers for the current track
         """
-        db_strings = COVER_MANAGER.find_covers(self.track)
+        db_strings = COVER_MANAGER.find_covers(self.track, refresh=True)
 
         if db_strings:
             for db_string in db_strings:
@@ -338,7 +338,8 @@ class MainWindow(GObject.GObject):
             player.PLAYER)
         event.add_ui_callback(self.on_toggle_pause, 'playback_toggle_pause',
             player.PLAYER)
-        event.add_ui_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.add_batch_callback(self.on_track_tags_changed,
+                'track_tags_changed', coalesce=True)
         event.add_ui_callback(self.on_buffering, 'playback_buffering',
             player.PLAYER)
         event.add_ui_callback(self.on_playback_error, 'playback_error',
@@ -627,12 +628,15 @@ class MainWindow(GObject.GObject):
         percent = min(percent, 100)
         self.statusbar.set_status(_("Buffering: %d%%...") % percent, 1)
 
-    def on_track_tags_changed(self, type, track, tag):
+    def on_track_tags_changed(self, events):
         """
             Called when tags are changed
         """
-        if track is player.PLAYER.current:
-            self._update_track_information()
+        current = player.PLAYER.current
+        for type, track, tag in events:
+            if track is current:
+                self._update_track_information()
+                break
 
     def on_collection_tree_loaded(self, tree):
         """
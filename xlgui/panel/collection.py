@@ -152,6 +152,111 @@ DEFAULT_ORDERS = [
             (("discnumber", "tracknumber", "title"), "$title", ("title",)))),
 ]
 
+class _Group(object):
+    """
+        A node of the collection tree: the tracks having the same values
+        for the levels of an Order down to the node
+    """
+    __slots__ = ['parent', 'depth', 'key', 'sort_key', 'display',
+                 'tracks', 'children', 'sorted']
+
+    def __init__(self, parent, depth, key, sort_key, display):
+        self.parent = parent
+        self.depth = depth
+        self.key = key
+        self.sort_key = sort_key
+        self.display = display
+        self.tracks = set()
+        # key -> _Group, None until the children are needed. Groups at
+        # the last level but one have tracks as children, and keep None.
+        self.children = None
+        # children or tracks in order, None until needed
+        self.sorted = None
+
+class _GroupIndex(object):
+    """
+        The tracks of a collection arranged into the groups of an Order.
+
+        Groups below a level are only built once they are asked for, and
+        are kept up to date through add() and remove().
+    """
+    def __init__(self, order, tracks):
+        self.order = order
+        self.root = _Group(None, -1, None, None, None)
+        if len(order) > 1:
+            self.root.children = {}
+        # location -> (track, deepest group built for it)
+        self.tracks = {}
+        for track in tracks:
+            self.add(track)
+
+    def __get_group(self, parent, track):
+        depth = parent.depth + 1
+        tags = tuple(self.order.get_sort_tags(depth))
+        display = self.order.format_track(depth, track)
+        # Different *sort tags can cause tracks to sort differently but
+        # still be displayed and searched for the same, so groups are
+        # made of the tracks that look the same.
+        query = " ".join([track.get_tag_search(t, format=True)
+            for t in tags])
+        key = (query, display)
+        group = parent.children.get(key)
+        if group is None:
+            group = parent.children[key] = _Group(parent, depth, key,
+                track._get_sort_key(tags), display)
+            parent.sorted = None
+        group.tracks.add(track)
+        return group
+
+    def add(self, track):
+        """
+            Adds track, or moves it to its groups after its tags have
+            changed
+        """
+        loc = track.get_loc_for_io()
+        self.remove(loc)
+        group = self.root
+        group.tracks.add(track)
+        while group.children is not None:
+            group = self.__get_group(group, track)
+        group.sorted = None
+        self.tracks[loc] = (track, group)
+
+    def remove(self, loc):
+        try:
+            track, group = self.tracks.pop(loc)
+        except KeyError:
+            return
+        group.sorted = None
+        while group is not None:
+            group.tracks.discard(track)
+            parent = group.parent
+            if parent is not None and not group.tracks:
+                del parent.children[group.key]
+                parent.sorted = None
+            group = parent
+
+    def get_children(self, group):
+        """
+            Returns the child groups of group in order, or its tracks in
+            order if they are at the last level
+        """
+        if group.sorted is None:
+            depth = group.depth + 1
+            if depth == len(self.order) - 1:
+                tags = tuple(self.order.get_sort_tags(depth))
+                group.sorted = sorted(group.tracks,
+                    key=lambda tr: tr._get_sort_key(tags))
+            else:
+                if group.children is None:
+                    group.children = {}
+                    for track in group.tracks:
+                        child = self.__get_group(group, track)
+                        self.tracks[track.get_loc_for_io()] = (track, child)
+                group.sorted = sorted(group.children.itervalues(),
+                    key=lambda g: (g.sort_key, g.display))
+        return group.sorted
+
 class CollectionPanel(panel.Panel):
     """
         The collection panel
@@ -178,6 +283,12 @@ class CollectionPanel(panel.Panel):
         self._show_collection_empty_message = _show_collection_empty_message
         self.collection = collection
         self.use_alphabet = settings.get_option('gui/use_alphabet', True)
+        self._sync_on_tag_change = settings.subscribe(
+            'gui/sync_on_tag_change', True)
+        self._display_track_counts = settings.subscribe(
+            'gui/display_track_counts', True)
+        self._draw_separators = settings.subscribe(
+            'gui/draw_separators', True)
         self.vbox = self.builder.get_object('CollectionPanel')
         self.message = self.builder.get_object('EmptyCollectionPanel')
         self.choice = self.builder.get_object('collection_combo_box')
@@ -193,8 +304,12 @@ class CollectionPanel(panel.Panel):
         self._setup_images()
         self._connect_events()
         self.order = None
-        self.tracks = []
-        self.sorted_tracks = []
+        # levels of an Order -> _GroupIndex, built when first shown
+        self._indexes = {}
+        # tracks matching the keyword, None if there is no keyword
+        self.matched = None
+        # matched track -> deepest level it was matched on
+        self._match_depths = {}
 
         event.add_ui_callback(self._check_collection_empty, 'libraries_modified',
             collection)
@@ -257,7 +372,8 @@ class CollectionPanel(panel.Panel):
             'on_add_music_button_clicked': self.on_add_music_button_clicked
         })
         self.tree.connect('key-release-event', self.on_key_released)
-        event.add_ui_callback(self.refresh_tags_in_tree, 'track_tags_changed')
+        event.add_batch_callback(self.refresh_tags_in_tree,
+            'track_tags_changed')
         event.add_ui_callback(self.refresh_tracks_in_tree, 
             'tracks_added', self.collection)
         event.add_ui_callback(self.refresh_tracks_in_tree, 
@@ -407,11 +523,14 @@ class CollectionPanel(panel.Panel):
         """
             finds tracks matching a given iter.
         """
-        self.load_subtree(iter)
-        search = self.get_node_search_terms(iter)
-        matcher = trax.TracksMatcher(search)
-        srtrs = trax.search_tracks(self.tracks, [matcher])
-        return [ x.track for x in srtrs ]
+        node = self.model.get_value(iter, 2)
+        if isinstance(node, _Group):
+            if self.matched is None:
+                return list(node.tracks)
+            return list(node.tracks & self.matched)
+        elif node is not None:
+            return [node]
+        return []
 
     def append_to_playlist(self, item=None, event=None, replace=False):
         """
@@ -473,19 +592,44 @@ class CollectionPanel(panel.Panel):
             return ""
 
         queries = []
-        while node:
-            queries.append(self.model.get_value(node, 2))
+        value = self.model.get_value(node, 2)
+        if not isinstance(value, _Group):
+            if value is None:
+                return ""
+            # a track
+            queries.append(value.get_tag_search("__loc", format=True))
             node = self.model.iter_parent(node)
+            value = self.model.get_value(node, 2) if node else None
+        while value is not None and value.key is not None:
+            queries.append(value.key[0])
+            value = value.parent
 
         return " ".join(queries)
 
-    def refresh_tags_in_tree(self, type, track, tag):
-        if settings.get_option('gui/sync_on_tag_change', True) and \
-            tag in self.order.all_sort_tags() and \
-            self.collection.loc_is_member(track.get_loc_for_io()):
+    def refresh_tags_in_tree(self, events):
+        if not self._sync_on_tag_change.value:
+            return
+        changed = False
+        for index in self._indexes.itervalues():
+            tags = set(index.order.all_sort_tags())
+            tracks = set(track for type, track, tag in events if tag in tags)
+            for track in tracks:
+                if self.collection.loc_is_member(track.get_loc_for_io()):
+                    index.add(track)
+                    changed = changed or index.order is self.order
+        if changed:
             self._refresh_tags_in_tree()
 
-    def refresh_tracks_in_tree(self, type, obj, loc):
+    def refresh_tracks_in_tree(self, type, collection, locs):
+        for index in self._indexes.itervalues():
+            if type == 'tracks_added':
+                for loc in locs:
+                    track = collection.get_track_by_loc(loc)
+                    if track is not None:
+                        index.add(track)
+            else:
+                for loc in locs:
+                    index.remove(loc)
         self._refresh_tags_in_tree()
 
     @common.glib_wait(500)
@@ -498,16 +642,19 @@ class CollectionPanel(panel.Panel):
         # so we delay it until we're done scanning.
         if self.collection._scanning:
             return True
-        self.resort_tracks()
         self.load_tree()
         return False
 
-    def resort_tracks(self):
-#        import time
-#        print "sorting...", time.clock()
-        self.sorted_tracks = trax.sort_tracks(self.order.get_sort_tags(0),
-            self.collection.get_tracks())
-#        print "sorted.", time.clock()
+    def _get_index(self):
+        """
+            Returns the groups of the collection for the current order
+        """
+        key = tuple(self.order.get_levels())
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._indexes[key] = _GroupIndex(self.order,
+                self.collection.get_tracks())
+        return index
 
     def load_tree(self):
         """
@@ -522,25 +669,34 @@ class CollectionPanel(panel.Panel):
         self.model.clear()
 
         self.root = None
-        oldorder = self.order
         self.order = self.orders[self.choice.get_active()]
 
-        if not oldorder or oldorder != self.order:
-            self.resort_tracks()
-
         # save the active view setting
         settings.set_option(
                 'gui/collection_active_view',
                 self.choice.get_active())
 
         keyword = self.keyword.strip()
-        tags = list(SEARCH_TAGS)
-        tags += self.order.all_search_tags()
-        tags = list(set(tags)) # uniquify list to speed up search
-
-        self.tracks = list(
-                trax.search_tracks_from_string(self.sorted_tracks,
-                    keyword, case_sensitive=False, keyword_tags=tags) )
+        if keyword:
+            tags = list(SEARCH_TAGS)
+            tags += self.order.all_search_tags()
+            tags = list(set(tags)) # uniquify list to speed up search
+
+            levels = {}
+            for depth in range(len(self.order)):
+                for tag in self.order.get_sort_tags(depth):
+                    levels[tag] = depth
+
+            matcher = trax.TracksMatcher(keyword, case_sensitive=False,
+                keyword_tags=tags)
+            self._match_depths = {}
+            for srtr in trax.search_tracks(self.collection, [matcher]):
+                self._match_depths[srtr.track] = max([-1] +
+                    [levels[t] for t in srtr.on_tags if t in levels])
+            self.matched = set(self._match_depths)
+        else:
+            self.matched = None
+            self._match_depths = {}
 
         self.load_subtree(None)
 
@@ -548,37 +704,6 @@ class CollectionPanel(panel.Panel):
 
         self.emit('collection-tree-loaded')
 
-    def _expand_node_by_name(self, search_num, parent, name, rest=None):
-        """
-            Recursive function to expand all nodes in a hierarchical list of
-            names.
-
-            @param search_num: the current search number
-            @param parent: the parent node
-            @param name: the name of the node to expand
-            @param rest: the list of the nodes to expand after this one
-        """
-        iter = self.model.iter_children(parent)
-
-        while iter:
-            if search_num != self._search_num: return
-            value = self.model.get_value(iter, 1)
-            if not value:
-                value = self.model.get_value(iter, 2)
-            if value: value = unicode(value, 'utf-8')
-
-            if value == name:
-                self.tree.expand_row(self.model.get_path(iter), False)
-                parent = iter
-                break
-
-            iter = self.model.iter_next(iter)
-
-        if rest:
-            item = rest.pop(0)
-            GLib.idle_add(self._expand_node_by_name, search_num,
-                parent, item, rest)
-
     def load_subtree(self, parent):
         """
             Loads all the sub nodes for a specified node
@@ -588,29 +713,19 @@ class CollectionPanel(panel.Panel):
         previously_loaded = False # was the subtree already loaded
         iter_sep = None
         if parent == None:
-            depth = 0
+            group = self._get_index().root
         else:
             if self.model.iter_n_children(parent) != 1 or \
                 self.model.get_value(
                     self.model.iter_children(parent), 1) != None:
                 previously_loaded = True
             iter_sep = self.model.iter_children(parent)
-            depth = self.model.iter_depth(parent) + 1
-        if previously_loaded:
+            group = self.model.get_value(parent, 2)
+        if previously_loaded or not isinstance(group, _Group):
             return
 
-        search = self.get_node_search_terms(parent)
-
-        try:
-            tags = self.order.get_sort_tags(depth)
-            matchers = [trax.TracksMatcher(search)]
-            srtrs = trax.search_tracks(self.tracks, matchers)
-            # sort only if we are not on top level, because tracks are 
-            # already sorted by fist order
-            if depth > 0:
-                srtrs = trax.sort_result_tracks(tags, srtrs)
-        except IndexError:
-            return # at the bottom of the tree
+        depth = group.depth + 1
+        tags = self.order.get_sort_tags(depth)
         try:
             image = getattr(self, "%s_image"%tags[-1])
         except Exception:
@@ -619,96 +734,56 @@ class CollectionPanel(panel.Panel):
         if depth == len(self.order)-1:
             bottom = True
 
-
-        display_counts = settings.get_option('gui/display_track_counts', True)
-        draw_seps = settings.get_option('gui/draw_separators', True)
+        display_counts = self._display_track_counts.value
+        draw_seps = self._draw_separators.value
+        matched = self.matched
         last_char = ''
-        last_val = ''
-        last_dval = ''
-        last_matchq = ''
-        count = 0
-        first = True
-        path = None
-        expanded = False
         to_expand = []
 
-        for srtr in srtrs:
-            stagvals = [unicode(srtr.track.get_tag_sort(x)) for x in tags]
-            stagval = " ".join(stagvals)
-            if (last_val != stagval or bottom):
-                tagval = self.order.format_track(depth, srtr.track)
-                match_query = " ".join([
-                    srtr.track.get_tag_search(t, format=True) for t in tags])
-                if bottom:
-                    match_query += " " + \
-                            srtr.track.get_tag_search("__loc", format=True)
-
-                # Different *sort tags can cause stagval to not match
-                # but the below code will produce identical entries in
-                # the displayed tree.  This condition checks to ensure
-                # that new entries are added if and only if they will
-                # display different results, avoiding that problem.
-                if match_query != last_matchq or tagval != last_dval or bottom:
-                    if display_counts and path and not bottom:
-                        iter = self.model.get_iter(path)
-                        val = self.model.get_value(iter, 1)
-                        val = "%s (%s)"%(val, count)
-                        self.model.set_value(iter, 1, val)
-                        count = 0
-
-                    last_val = stagval
-                    last_dval = tagval
-                    if depth == 0 and draw_seps:
-                        val = srtr.track.get_tag_sort(tags[0])
-                        char = first_meaningful_char(val)
-                        if first:
-                            last_char = char
-                        else:
-                            if char != last_char and last_char != '':
-                                self.model.append(parent, [None, None, None])
-                            last_char = char
-                    first = False
-
-                    last_matchq = match_query
-                    iter = self.model.append(parent, 
-                        [image, tagval, match_query])
-                    path = self.model.get_path(iter)
-                    expanded = False
-                    if not bottom:
-                        self.model.append(iter, [None, None, None])
-            count += 1
-            if not expanded:
-                alltags = []
-                for i in range(depth+1, len(self.order)):
-                    alltags.extend(self.order.get_sort_tags(i))
-                for t in alltags:
-                    if t in srtr.on_tags:
-                        # keep original path intact for following block
-                        newpath = path
-                        if depth > 0:
-                            # for some reason, nested iters are always
-                            # off by one in the terminal entry.
-                            newpath = Gtk.TreePath.new_from_indices(newpath[:-1] + [newpath[-1]-1])
-                        to_expand.append(newpath)
-                        expanded = True
-
-        if display_counts and path and not bottom:
-            iter = self.model.get_iter(path)
-            val = self.model.get_value(iter, 1)
-            val = "%s (%s)"%(val, count)
-            self.model.set_value(iter, 1, val)
-            count = 0
+        for child in self._get_index().get_children(group):
+            if bottom:
+                if matched is None or child in matched:
+                    self.model.append(parent, [image,
+                        self.order.format_track(depth, child), child])
+                continue
+
+            if matched is None:
+                count = len(child.tracks)
+            else:
+                tracks = child.tracks & matched
+                count = len(tracks)
+                if not count:
+                    continue
+
+            if depth == 0 and draw_seps:
+                char = first_meaningful_char(child.sort_key[0])
+                if char != last_char and last_char != '':
+                    self.model.append(parent, [None, None, None])
+                last_char = char
+
+            tagval = child.display
+            if display_counts:
+                tagval = "%s (%s)"%(tagval, count)
+            iter = self.model.append(parent, [image, tagval, child])
+            self.model.append(iter, [None, None, None])
+
+            if matched is not None:
+                for track in tracks:
+                    if self._match_depths[track] > depth:
+                        to_expand.append(iter)
+                        break
+
+        if iter_sep is not None:
+            self.model.remove(iter_sep)
 
         if settings.get_option("gui/expand_enabled", True) and \
             len(to_expand) < \
                     settings.get_option("gui/expand_maximum_results", 100) and \
             len(self.keyword.strip()) >= \
                     settings.get_option("gui/expand_minimum_term_length", 2):
-            for row in to_expand:
-                GLib.idle_add(self.tree.expand_row, row, False)
-
-        if iter_sep is not None:
-            self.model.remove(iter_sep)
+            for iter in to_expand:
+                GLib.idle_add(self.tree.expand_row,
+                    self.model.get_path(iter), False)
 
 class CollectionDragTreeView(DragTreeView):
     """
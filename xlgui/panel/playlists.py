@@ -28,6 +28,7 @@
 from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
+from gi.repository import GLib
 from gi.repository import GObject
 
 
@@ -374,13 +375,18 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
             Intializes the playlists panel
 
             @param playlist_manager:  The playlist manager
+            @param smart_manager: The smart playlist manager, or a
+                function returning it, which is then only called once
+                the main loop runs
         """
         panel.Panel.__init__(self, parent, name)
         BasePlaylistPanelMixin.__init__(self)
         self.playlist_manager = playlist_manager
-        self.smart_manager = smart_manager
+        self.smart_manager = None
         self.collection = collection
         self.box = self.builder.get_object('playlists_box')
+        self._sync_on_tag_change = settings.subscribe(
+            'gui/sync_on_tag_change', True)
         
         self.playlist_name_info = 500
         self.track_target = Gtk.TargetEntry.new("text/uri-list", 0, 0)
@@ -433,6 +439,10 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
         
         self._connect_events()
         self._load_playlists()
+        if callable(smart_manager):
+            GLib.idle_add(self._load_smart_playlists, smart_manager)
+        else:
+            self._load_smart_playlists(smart_manager)
 
     def _connect_events(self):
         event.add_ui_callback(self.refresh_playlists, 'track_tags_changed')
@@ -450,7 +460,7 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
             wrapper so that multiple events dont cause multiple
             reloads in quick succession
         """
-        if settings.get_option('gui/sync_on_tag_change', True) and \
+        if self._sync_on_tag_change.value and \
             tag in ['title', 'artist']:
             self._refresh_playlists()
 
@@ -460,7 +470,7 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
             Callback for when tags have changed and the playlists
             need refreshing.
         """
-        if settings.get_option('gui/sync_on_tag_change', True):
+        if self._sync_on_tag_change.value:
             for playlist in self.playlist_nodes:
                 self.update_playlist_node(playlist)
                 
@@ -489,12 +499,6 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
         self.custom = self.model.append(None, [self.folder,
             _("Custom Playlists"), None])
 
-        names = self.smart_manager.playlists[:]
-        names.sort()
-        for name in names:
-            self.model.append(self.smart, [self.playlist_image, name,
-                self.smart_manager.get_playlist(name)])
-
         names = self.playlist_manager.playlists[:]
         names.sort()
         for name in names:
@@ -503,9 +507,23 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
                 self.custom, [self.playlist_image, name, playlist])
             self._load_playlist_nodes(playlist)
 
-        self.tree.expand_row(self.model.get_path(self.smart), False)
         self.tree.expand_row(self.model.get_path(self.custom), False)
 
+    def _load_smart_playlists(self, smart_manager):
+        """
+            Loads the saved smart playlists
+        """
+        if callable(smart_manager):
+            smart_manager = smart_manager()
+        self.smart_manager = smart_manager
+
+        names = self.smart_manager.playlists[:]
+        names.sort()
+        for name in names:
+            self.model.append(self.smart, [self.playlist_image, name,
+                self.smart_manager.get_playlist(name)])
+        self.tree.expand_row(self.model.get_path(self.smart), False)
+
     def update_playlist_node(self, pl):
         """
             Updates the playlist node of the playlist
@@ -74,13 +74,16 @@ class RadioPanel(panel.Panel, playlistpanel.BasePlaylistPanelMixin):
         radio_manager, station_manager, name):
         """
             Initializes the radio panel
+
+            The managers can also be given as functions returning them,
+            they are then only asked for once the main loop runs.
         """
         panel.Panel.__init__(self, parent, name)
         playlistpanel.BasePlaylistPanelMixin.__init__(self)
 
         self.collection = collection
-        self.manager = radio_manager
-        self.playlist_manager = station_manager
+        self.manager = None
+        self.playlist_manager = None
         self.nodes = {}
         self.load_nodes = {}
         self.complete_reload = {}
@@ -96,9 +99,25 @@ class RadioPanel(panel.Panel, playlistpanel.BasePlaylistPanelMixin):
         self.track_menu = menus.TrackPanelMenu(self)
         self._connect_events()
 
-        self.load_streams()
+        if callable(radio_manager) or callable(station_manager):
+            GLib.idle_add(self._load_managers, radio_manager,
+                station_manager)
+        else:
+            self._load_managers(radio_manager, station_manager)
         RadioPanel._radiopanel = self
 
+    def _load_managers(self, radio_manager, station_manager):
+        self.manager = radio_manager() if callable(radio_manager) \
+            else radio_manager
+        self.playlist_manager = station_manager() \
+            if callable(station_manager) else station_manager
+
+        event.add_ui_callback(self._add_driver_cb, 'station_added',
+                self.manager)
+        event.add_ui_callback(self._remove_driver_cb, 'station_removed',
+                self.manager)
+        self.load_streams()
+
     def load_streams(self):
         """
             Loads radio streams from plugins
@@ -169,11 +188,6 @@ class RadioPanel(panel.Panel, playlistpanel.BasePlaylistPanelMixin):
         self.tree.connect('row-activated', self.on_row_activated)
         self.tree.connect('key-release-event', self.on_key_released)
 
-        event.add_ui_callback(self._add_driver_cb, 'station_added',
-                self.manager)
-        event.add_ui_callback(self._remove_driver_cb, 'station_removed',
-                self.manager)
-
     def _on_add_button_clicked(self, *e):
         dialog = dialogs.MultiTextEntryDialog(self.parent,
             _("Add Radio Station"))
@@ -270,15 +270,18 @@ def _register_builtin_panels(exaile, window):
                                    _show_collection_empty_message=True)
     )
     
+    # the radio and the smart playlists are loaded once the window is
+    # shown
     providers.register('main-panel',       
         radio.RadioPanel(window, exaile.collection,
-                         exaile.radio, exaile.stations, 'radio')
+                         lambda: exaile.radio, lambda: exaile.stations,
+                         'radio')
     )
     
     providers.register('main-panel',
         playlists.PlaylistsPanel(window,
                                  exaile.playlists,
-                                 exaile.smart_playlists,
+                                 lambda: exaile.smart_playlists,
                                  exaile.collection,
                                  'playlists')
     )
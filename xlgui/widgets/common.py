@@ -278,6 +278,7 @@ class DragTreeView(AutoScrollTreeView):
             Async call counterpart to on_drag_begin, so that cover fetching
             doesn't block dragging.
         """
+        from xlgui.cover import get_track_thumbnail
         cover_manager = covers.MANAGER
         width = height = settings.get_option('gui/cover_width', 100)
 
@@ -290,10 +291,10 @@ class DragTreeView(AutoScrollTreeView):
             for track in tracks:
                 album = track.get_tag_raw('album', join=True)
                 if album not in albums:
-                    image_data = cover_manager.get_cover(track,
-                        set_only=True, use_default=True)
-                    pixbuf = icons.MANAGER.pixbuf_from_data(
-                        image_data, (width, height))
+                    pixbuf = get_track_thumbnail(track, width)
+                    if pixbuf is None:
+                        pixbuf = icons.MANAGER.pixbuf_from_data(
+                            cover_manager.get_default_cover(), (width, height))
 
                     if first_pixbuf is None:
                         first_pixbuf = pixbuf
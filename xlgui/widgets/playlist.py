@@ -34,6 +34,7 @@ from gi.repository import Pango
 from itertools import izip
 import logging
 import sys
+import threading
 
 from xl.nls import gettext as _
 from xl.playlist import (
@@ -51,6 +52,7 @@ from xl import (
     trax,
     xdg
 )
+from xl.trax.index import SearchIndex, SearchCancelled
 
 from xlgui.widgets.common import AutoScrollTreeView
 from xlgui.widgets.notebook import NotebookPage
@@ -676,6 +678,8 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
                                     # a notify::width event was initiated
                                     # by the user.
         self._insert_focusing = False
+        # selection, cursor and scroll position during a bulk edit
+        self._bulk_edit_state = None
         
         self._hack_is_osx = sys.platform == 'darwin'
         self._hack_osx_control_mask = False
@@ -690,6 +694,15 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         self.selection.set_mode(Gtk.SelectionMode.MULTIPLE)
 
         self._filter_matcher = None
+        # (visible tracks, searched tracks) computed in the background for
+        # the current filter, and the filter searches waiting for a thread
+        self._filter_visible = None
+        self._filter_generation = 0
+        self._filter_lock = threading.Lock()
+        self._filter_pending = None
+        self._filter_running = False
+        # tracks whose tags changed while a search was running
+        self._filter_changed = set()
         
         self._setup_columns()
         self.columns_changed_id = self.connect("columns-changed",
@@ -724,11 +737,22 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
             
             The filter will search any currently enabled columns AND the
             default columns. 
+            
+            The matching tracks are searched for on a separate thread, in
+            the search index of the playlist, and the rows are only
+            refiltered once they are known. A search still running when
+            the filter changes again is abandoned.
         '''
+        self._filter_generation += 1
+        # rows changed or inserted until the search is done are matched
+        # one by one
+        self._filter_visible = None
+        self._filter_changed.clear()
     
         if filter_string is None:
             self._filter_matcher = None
-            self.modelfilter.refilter()
+            if self.modelfilter is not None:
+                self.modelfilter.refilter()
         else:
             # Merge default columns and currently enabled columns
             keyword_tags = set(playlist_columns.DEFAULT_COLUMNS + [c.name for c in self.get_columns()])
@@ -736,8 +760,68 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
                     case_sensitive=False,
                     keyword_tags=keyword_tags)
             logger.debug("Filtering playlist %r by %r.", self.playlist.name, filter_string)
+            
+            request = (self._filter_generation, self._filter_matcher,
+                self.model.get_search_index(), self.model.get_tracks())
+            with self._filter_lock:
+                self._filter_pending = request
+                if self._filter_running:
+                    return
+                self._filter_running = True
+            self._filter_tracks_thread()
+    
+    @common.threaded
+    def _filter_tracks_thread(self):
+        '''
+            Runs the pending filter searches, only ever the latest one
+        '''
+        while True:
+            with self._filter_lock:
+                request = self._filter_pending
+                self._filter_pending = None
+                if request is None:
+                    self._filter_running = False
+                    return
+            
+            generation, matcher, index, tracks = request
+            visible = self._filter_search(generation, matcher, index, tracks)
+            if visible is not None:
+                GLib.idle_add(self._filter_tracks_done, generation,
+                    visible, set(tracks))
+    
+    def _filter_search(self, generation, matcher, index, tracks):
+        '''
+            Returns the set of tracks matching, or None if the filter has
+            changed in the meantime
+        '''
+        cancelled = lambda: generation != self._filter_generation
+        try:
+            results = index.search([matcher], cancelled)
+        except SearchCancelled:
+            return None
+        if results is not None:
+            return set(srtr.track for srtr in results)
+        
+        # the index can't answer this one, look at every track
+        visible = set()
+        for i, track in enumerate(set(tracks)):
+            if i % 1000 == 0 and cancelled():
+                return None
+            if matcher.match(trax.SearchResultTrack(track)):
+                visible.add(track)
+        return visible
+    
+    def _filter_tracks_done(self, generation, visible, searched):
+        if generation != self._filter_generation:
+            return
+        # the search may have seen the old tags of these
+        searched.difference_update(self._filter_changed)
+        visible.difference_update(self._filter_changed)
+        self._filter_changed.clear()
+        self._filter_visible = (visible, searched)
+        if self.modelfilter is not None:
             self.modelfilter.refilter()
-            logger.debug("Filtering playlist %r by %r completed.", self.playlist.name, filter_string)
+        logger.debug("Filtering playlist %r completed.", self.playlist.name)
         
     def get_selection_count(self):
         '''
@@ -837,6 +921,8 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         # TODO: What is the fixme talking about?
         self.model = PlaylistModel(self.playlist, columns, self.player)
         self.model.connect('row-inserted', self.on_row_inserted)
+        self.model.connect('bulk-edit', self.on_bulk_edit)
+        self.model.connect('tracks-changed', self.on_tracks_changed)
         self.set_model(self.model)
         self._setup_filter()
 
@@ -860,7 +946,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
 
     def _setup_filter(self):
         '''Call this anytime after you call set_model()'''
-        self.modelfilter = self.get_model().filter_new()
+        self.modelfilter = self.model.filter_new()
         self.modelfilter.set_visible_func(self.modelfilter_visible_func)
         self.set_model(self.modelfilter)
         
@@ -960,6 +1046,47 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
 
         self._play_track_at(position, track, True)
         
+    def on_bulk_edit(self, model, editing):
+        '''
+            Detaches the view and the filter from the model while many
+            rows are added or removed, so that they don't have to follow
+            each row. The selected tracks, the track at the cursor and
+            the scroll position are restored afterwards.
+        '''
+        if editing:
+            cursor = self.get_cursor()[0]
+            if cursor is not None:
+                cursor = self.modelfilter.get_value(
+                    self.modelfilter.get_iter(cursor), 0)
+            self._bulk_edit_state = (self.get_selected_tracks(), cursor,
+                self.get_vadjustment().get_value())
+            self.set_model(None)
+            self.modelfilter = None
+        else:
+            self._setup_filter()
+            selected, cursor, scroll = self._bulk_edit_state
+            self._bulk_edit_state = None
+            
+            positions = self.model._get_positions()
+            def get_paths(track):
+                for position in positions.get(track, ()):
+                    path = self.modelfilter.convert_child_path_to_path(
+                        Gtk.TreePath((position,)))
+                    if path is not None:
+                        yield path
+            
+            # setting the cursor selects its row only
+            for path in get_paths(cursor):
+                self.set_cursor(path)
+                break
+            selection = self.get_selection()
+            selection.unselect_all()
+            for track in set(selected):
+                for path in get_paths(track):
+                    selection.select_path(path)
+            # once the rows have been measured again
+            GLib.idle_add(self.get_vadjustment().set_value, scroll)
+            
     def on_row_inserted(self, model, path, iter):
         '''
             When something is inserted into the playlist, focus on it. If 
@@ -1272,11 +1399,50 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
             columns.remove(provider.name)
             settings.set_option('gui/columns', columns)
 
+    def on_tracks_changed(self, model, tracks):
+        '''
+            Matches tracks whose tags changed against the filter again,
+            and refilters their rows if the result is not the same
+        '''
+        matcher = self._filter_matcher
+        if matcher is None:
+            return
+        if self._filter_visible is None:
+            self._filter_changed.update(tracks)
+            return
+        visible, searched = self._filter_visible
+        changed = []
+        for track in tracks:
+            if track not in searched:
+                continue
+            matched = matcher.match(trax.SearchResultTrack(track))
+            if matched != (track in visible):
+                if matched:
+                    visible.add(track)
+                else:
+                    visible.discard(track)
+                changed.append(track)
+        if not changed:
+            return
+        positions = model._get_positions()
+        for track in changed:
+            for position in positions.get(track, ()):
+                model.row_changed(Gtk.TreePath(position),
+                    model.iter_nth_child(None, position))
+
     def modelfilter_visible_func(self, model, iter, data):
-        if self._filter_matcher is not None:
-            track = model.get_value(iter, 0)
-            return self._filter_matcher.match(trax.SearchResultTrack(track))
-        return True
+        matcher = self._filter_matcher
+        if matcher is None:
+            return True
+        track = model.get_value(iter, 0)
+        if self._filter_visible is not None:
+            visible, searched = self._filter_visible
+            if track in visible:
+                return True
+            if track in searched:
+                return False
+        # added since the search
+        return matcher.match(trax.SearchResultTrack(track))
 
 class PlaylistModel(Gtk.ListStore):
 
@@ -1286,9 +1452,24 @@ class PlaylistModel(Gtk.ListStore):
             GObject.SignalFlags.RUN_LAST,
             None,
             (GObject.TYPE_BOOLEAN,)
+        ),
+        # Emitted with True before and False after adding or removing
+        # more than bulk_edit_rows rows at once, so that views can detach
+        'bulk-edit': (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_BOOLEAN,)
+        ),
+        # Emitted with the tracks of the rows whose tags changed
+        'tracks-changed': (
+            GObject.SignalFlags.RUN_LAST,
+            None,
+            (GObject.TYPE_PYOBJECT,)
         )
     }
     
+    bulk_edit_rows = 1000
+    
     def __init__(self, playlist, columns, player):
         Gtk.ListStore.__init__(self, int) # real types are set later
         self.playlist = playlist
@@ -1297,12 +1478,24 @@ class PlaylistModel(Gtk.ListStore):
         
         self.data_loading = False
         self.data_load_queue = []
+        
+        # the track of each row, and the rows of each track, which is
+        # built when needed
+        self._tracks = []
+        self._positions = None
+        self._column_indexes = dict((name, i + 2)
+            for i, name in enumerate(columns))
+        # search index over the tracks, built when the playlist is
+        # first filtered
+        self._search_index = None
 
         self.coltypes = [object, GdkPixbuf.Pixbuf] + [providers.get_provider('playlist-columns', c).datatype for c in columns]
         self.set_column_types(self.coltypes)
         
         self._redraw_timer = None
         self._redraw_queue = []
+        self._sync_on_tag_change = settings.subscribe(
+            'gui/sync_on_tag_change', True)
 
         event.add_ui_callback(self.on_tracks_added,
                 "playlist_tracks_added", playlist)
@@ -1320,7 +1513,7 @@ class PlaylistModel(Gtk.ListStore):
                 "playback_player_pause", self.player)
         event.add_ui_callback(self.on_playback_state_change,
                 "playback_player_resume", self.player)
-        event.add_ui_callback(self.on_track_tags_changed,
+        event.add_batch_callback(self.on_track_tags_changed,
                 "track_tags_changed")
 
         event.add_ui_callback(self.on_option_set, "gui_option_set")
@@ -1406,9 +1599,94 @@ class PlaylistModel(Gtk.ListStore):
         self._load_data(tracks)
 
     def on_tracks_removed(self, event_type, playlist, tracks):
-        tracks.reverse()
-        for position, track in tracks:
-            self.remove(self.iter_nth_child(None, position))
+        length = len(self._tracks)
+        positions = sorted(position + length if position < 0 else position
+            for position, track in tracks)
+        
+        bulk = len(positions) > self.bulk_edit_rows
+        if bulk:
+            self.emit('bulk-edit', True)
+        
+        # remove contiguous runs of rows, the last first so that the
+        # positions of the others stay valid
+        removed = []
+        for start, count in reversed(_get_runs(positions)):
+            for i in xrange(count):
+                self.remove(self.iter_nth_child(None, start))
+            removed.extend(self._remove_tracks(start, count))
+        
+        if self._search_index is not None and removed:
+            remaining = self._get_positions()
+            self._search_index.remove_tracks(
+                [track for track in set(removed) if track not in remaining])
+        
+        if bulk:
+            self.emit('bulk-edit', False)
+
+    def _get_positions(self):
+        '''
+            Returns a dict of the row positions of each track
+        '''
+        positions = self._positions
+        if positions is None:
+            positions = self._positions = {}
+            for position, track in enumerate(self._tracks):
+                positions.setdefault(track, []).append(position)
+        return positions
+    
+    def get_tracks(self):
+        '''
+            Returns a list of the track of each row
+        '''
+        return list(self._tracks)
+    
+    def get_search_index(self):
+        '''
+            Returns the :class:`xl.trax.index.SearchIndex` over the tracks
+            of the rows. It has to be created on the main thread, but can
+            be searched on any thread.
+        '''
+        if self._search_index is None:
+            self._search_index = SearchIndex(self._tracks)
+        return self._search_index
+    
+    def _insert_tracks(self, start, tracks):
+        '''
+            Keeps track of rows inserted at start. The index is updated
+            for rows appended at the end, and rebuilt later otherwise.
+        '''
+        at_end = start == len(self._tracks)
+        self._tracks[start:start] = tracks
+        if self._positions is not None:
+            if at_end:
+                for position, track in enumerate(tracks, start):
+                    self._positions.setdefault(track, []).append(position)
+            else:
+                self._positions = None
+        if self._search_index is not None:
+            self._search_index.add_tracks(tracks)
+    
+    def _remove_tracks(self, start, count):
+        '''
+            Keeps track of count rows removed at start
+            
+            :returns: the tracks of the removed rows
+        '''
+        end = start + count
+        at_end = end == len(self._tracks)
+        removed = self._tracks[start:end]
+        del self._tracks[start:end]
+        if self._positions is not None:
+            if at_end:
+                # the removed rows are the last ones of their tracks
+                for track in removed:
+                    positions = self._positions[track]
+                    positions.pop()
+                    if not positions:
+                        del self._positions[track]
+            else:
+                self._positions = None
+        return removed
 
     def on_current_position_changed(self, event_type, playlist, positions):
         for position in positions:
@@ -1427,32 +1705,47 @@ class PlaylistModel(Gtk.ListStore):
             return
         GLib.idle_add(self.update_icon, position)
 
-    @guiutil.idle_add()   # sync this call to prevent race conditions
-    def on_track_tags_changed(self, type, track, tag):
-        if not track or not \
-            settings.get_option('gui/sync_on_tag_change', True) or not\
-            tag in self.columns:
+    def on_track_tags_changed(self, events):
+        if self._search_index is not None:
+            for type, track, tag in events:
+                if track:
+                    self._search_index.update_track(track, tag)
+        
+        tracks = set(track for type, track, tag in events if track)
+        if tracks:
+            self.emit('tracks-changed', tracks)
+        
+        if not self._sync_on_tag_change.value:
+            return
+        changes = [(track, tag) for type, track, tag in events
+                if track and tag in self._column_indexes]
+        if not changes:
             return
             
         if self._redraw_timer:
             GLib.source_remove(self._redraw_timer)
-        self._redraw_queue.append( track )
+        self._redraw_queue.extend(changes)
         self._redraw_timer = GLib.timeout_add(100, self._on_track_tags_changed)
             
     def _on_track_tags_changed(self):
         self._redraw_timer = None
-        tracks = {}
+        changed = {}
         redraw_queue = self._redraw_queue
         self._redraw_queue = []
-        for track in redraw_queue:
-            tracks[track.get_loc_for_io()] = track
-           
-        for row in self:
-            track = tracks.get( row[0].get_loc_for_io() )
-            if track is not None:
-                track_data = [providers.get_provider('playlist-columns', name).formatter.format(track) for name in self.columns]
-                for i in range(len(track_data)):
-                    row[2+i] = track_data[i]
+        for track, tag in redraw_queue:
+            changed.setdefault(track, set()).add(tag)
+        
+        # only touch the rows of the changed tracks, and only the
+        # columns of the changed tags
+        index = self._get_positions()
+        for track, tags in changed.iteritems():
+            positions = index.get(track)
+            if not positions:
+                continue
+            columns = [self._column_indexes[tag] for tag in tags]
+            values = [providers.get_provider('playlist-columns', tag).formatter.format(track) for tag in tags]
+            for position in positions:
+                self.set(self.iter_nth_child(None, position), columns, values)
 
     #
     # Loading data into the playlist:
@@ -1500,19 +1793,46 @@ class PlaylistModel(Gtk.ListStore):
     
         for position, track in tracks:
             track_data = [track, self.icon_for_row(position).pixbuf] + [formatter(track) for formatter in formatters]
-            render_data.append((position, [Value(typ, val) for typ, val in izip(coltypes, track_data)]))
+            render_data.append((position, track, [Value(typ, val) for typ, val in izip(coltypes, track_data)]))
         
         return render_data
         
     def _load_data_done(self, render_data):
-        for args in render_data:
-            self.insert(*args)
+        bulk = len(render_data) > self.bulk_edit_rows
+        if bulk:
+            self.emit('bulk-edit', True)
+        
+        i = 0
+        for start, count in _get_runs([data[0] for data in render_data]):
+            run = render_data[i:i + count]
+            i += count
+            for position, track, values in run:
+                self.insert(position, values)
+            self._insert_tracks(start, [data[1] for data in run])
+        
+        if bulk:
+            self.emit('bulk-edit', False)
         
         self.data_loading = False
         self.emit('data-loading', False)
         
         if self.data_load_queue:
             tracks = self.data_load_queue
-            self.data_load_queue = None
+            self.data_load_queue = []
             
             self._load_data(tracks)
+
+
+def _get_runs(positions):
+    '''
+        Splits sorted positions into runs of consecutive positions
+
+        :returns: a list of (start, count) tuples
+    '''
+    runs = []
+    for position in positions:
+        if runs and runs[-1][0] + runs[-1][1] == position:
+            runs[-1][1] += 1
+        else:
+            runs.append([position, 1])
+    return runs
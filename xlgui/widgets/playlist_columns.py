@@ -50,12 +50,23 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_COLUMNS = ['tracknumber', 'title', 'album', 'artist', '__length']
 
+# Formatters of the columns, shared by all playlists so that their
+# compiled formats and cached values are reused
+_FORMATTERS = {}
+
+def _get_formatter(name):
+    formatter = _FORMATTERS.get(name)
+    if formatter is None:
+        formatter = _FORMATTERS[name] = TrackFormatter('$%s' % name,
+            cache=True)
+    return formatter
+
 class Column(Gtk.TreeViewColumn):
     name = ''
     display = ''
     menu_title = classproperty(lambda c: c.display)
     renderer = Gtk.CellRendererText
-    formatter = classproperty(lambda c: TrackFormatter('$%s' % c.name))
+    formatter = classproperty(lambda c: _get_formatter(c.name))
     size = 10 # default size
     autoexpand = False # whether to expand to fit space in Autosize mode
     datatype = str
@@ -507,7 +518,7 @@ class CommentColumn(Column):
     size = 200
     autoexpand = True
     # Remove the newlines to fit into the vertical space of rows
-    formatter = TrackFormatter('${comment:newlines=strip}')
+    formatter = TrackFormatter('${comment:newlines=strip}', cache=True)
 providers.register('playlist-columns', CommentColumn)
 
 class GroupingColumn(Column):